@@ -0,0 +1,214 @@
+# benchmarks/replay.py
+"""
+benchmark آفلاین pipeline استخراج (process_text) روی corpus ضبط‌شده
+بدون تماس با AvalAI: یک سرور LLM محلی (stub_llm_server) پاسخ‌های ضبط‌شده را برمی‌گرداند.
+
+گزارش: دقت هر فیلد، صدک‌های تأخیر end-to-end، توکن‌ها و throughput با هم‌زمانی دلخواه
+
+اجرا (از ریشه پروژه):
+    python -m benchmarks.replay --concurrency 8 --repeat 5
+    python -m benchmarks.replay --no-cache --streaming --json report.json
+    python -m benchmarks.replay --llm-url http://127.0.0.1:8765/v1   # سرور stub جداگانه
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import socket
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_FOLD = str.maketrans("يك", "یک")
+_SPACE_RE = re.compile(r"\s+")
+
+
+class _FakeMessage:
+    """جایگزین telegram.Message؛ پاسخ‌ها فقط ذخیره می‌شوند"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.replies: List[str] = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+
+
+class FakeUpdate:
+    """حداقل Update لازم برای process_text"""
+
+    def __init__(self, user_id: int, text: str):
+        self.effective_user = SimpleNamespace(id=user_id, username=f"bench{user_id}", first_name="bench")
+        self.message = _FakeMessage(text)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _configure_env(args, llm_url: str):
+    """env ساختگی؛ باید قبل از import ماژول‌های ربات انجام شود"""
+    for name in ("BOT_TOKEN", "AVALAIGPT_API_KEY", "NOCODB_TOKEN"):
+        os.environ.setdefault(name, "benchmark")
+    os.environ.setdefault("NOCODB_URL", "http://127.0.0.1:9")
+    os.environ["LLM_PROVIDERS"] = json.dumps([
+        {"name": "stub", "base_url": llm_url, "api_key": "benchmark", "model": "stub"}
+    ])
+    os.environ["LLM_STREAMING"] = "1" if args.streaming else "0"
+    os.environ["EXTRACTION_CACHE_DB"] = ""
+    if args.no_cache:
+        os.environ["EXTRACTION_CACHE_SIZE"] = "0"
+
+
+def _norm_value(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return _SPACE_RE.sub(" ", str(value).replace("‌", " ").translate(_FOLD)).strip()
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def score(records: List[Dict], results: List[Tuple[float, Dict]]) -> Tuple[Dict, List[Dict]]:
+    """مقایسه state نهایی با expected؛ فقط فیلدهای موجود در expected شمرده می‌شوند"""
+    fields: Dict[str, Dict] = {}
+    mismatches = []
+    for record, (_, state) in zip(records, results):
+        for field, expected in record["expected"].items():
+            stat = fields.setdefault(field, {"total": 0, "correct": 0})
+            stat["total"] += 1
+            actual = state.get(field)
+            if _norm_value(actual) == _norm_value(expected):
+                stat["correct"] += 1
+            else:
+                mismatches.append({"id": record["id"], "field": field, "expected": expected, "actual": actual})
+
+    for stat in fields.values():
+        stat["accuracy"] = round(stat["correct"] / stat["total"], 3)
+    return dict(sorted(fields.items())), mismatches
+
+
+async def _run(args) -> Dict:
+    from benchmarks.stub_llm_server import StubLLM, load_corpus, start_server
+
+    records = load_corpus(args.corpus)
+    stub = runner = None
+    llm_url = args.llm_url
+    if not llm_url:
+        port = _free_port()
+        stub = StubLLM(records, args.latency_ms, args.jitter_ms)
+        runner = await start_server(stub, port=port)
+        llm_url = f"http://127.0.0.1:{port}/v1"
+
+    _configure_env(args, llm_url)
+
+    from bot_processor_core import process_text
+    from conversation_state import clear_state, get_state
+    from extractor import get_extraction_cache_stats, get_token_stats
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    workload = [record for _ in range(args.repeat) for record in records]
+
+    async def run_one(index: int, record: Dict) -> Tuple[float, Dict]:
+        user_id = 10_000_000 + index
+        async with semaphore:
+            clear_state(user_id)
+            update = FakeUpdate(user_id, record["text"])
+            started = time.perf_counter()
+            try:
+                await process_text(record["text"], user_id, update)
+            except Exception as e:
+                logger.error(f"[{record['id']}] process_text failed: {e}", exc_info=True)
+            latency = time.perf_counter() - started
+            state = dict(get_state(user_id))
+            clear_state(user_id)
+            return latency, state
+
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run_one(i, r) for i, r in enumerate(workload)))
+        wall = time.perf_counter() - started
+    finally:
+        if runner:
+            await runner.cleanup()
+
+    fields, mismatches = score(workload, results)
+    latencies = [latency for latency, _ in results]
+    correct = sum(f["correct"] for f in fields.values())
+    total = sum(f["total"] for f in fields.values())
+
+    return {
+        "messages": len(workload),
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_msgs_per_sec": round(len(workload) / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            f"p{p}": round(_percentile(latencies, p) * 1000, 1) for p in (50, 90, 95, 99)
+        } | {"max": round(max(latencies, default=0) * 1000, 1)},
+        "overall_accuracy": round(correct / total, 3) if total else 0.0,
+        "fields": fields,
+        "tokens": get_token_stats(),
+        "extraction_cache": get_extraction_cache_stats(),
+        "llm_requests": stub.requests if stub else None,
+        "unmatched_llm_requests": stub.unmatched if stub else None,
+        "mismatches": mismatches,
+    }
+
+
+def _print_report(report: Dict, verbose: bool):
+    print(f"\n📊 {report['messages']} messages, concurrency={report['concurrency']}")
+    print(f"   wall={report['wall_seconds']}s  throughput={report['throughput_msgs_per_sec']} msg/s")
+    print("   latency (ms): " + "  ".join(f"{k}={v}" for k, v in report["latency_ms"].items()))
+    print(f"   LLM requests: {report['llm_requests']} (unmatched: {report['unmatched_llm_requests']})")
+    print("   tokens: " + "  ".join(f"{k}={v}" for k, v in report["tokens"].items()))
+    print(f"   cache hit rate: {report['extraction_cache']['hit_rate']}")
+    print(f"\n🎯 overall accuracy: {report['overall_accuracy']}")
+    for field, stat in report["fields"].items():
+        print(f"   {field:<18} {stat['correct']:>4}/{stat['total']:<4} {stat['accuracy']:.3f}")
+
+    if verbose and report["mismatches"]:
+        print("\n❌ mismatches:")
+        for m in report["mismatches"]:
+            print(f"   [{m['id']}] {m['field']}: expected={m['expected']!r} actual={m['actual']!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay benchmark for the extraction pipeline")
+    parser.add_argument("--corpus", default="benchmarks/corpus.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1, help="تعداد تکرار corpus")
+    parser.add_argument("--llm-url", help="base_url یک سرور stub در حال اجرا (پیش‌فرض: سرور داخلی)")
+    parser.add_argument("--latency-ms", type=float, default=800, help="تأخیر شبیه‌سازی‌شده LLM")
+    parser.add_argument("--jitter-ms", type=float, default=300)
+    parser.add_argument("--streaming", action="store_true", help="LLM_STREAMING=1")
+    parser.add_argument("--no-cache", action="store_true", help="غیرفعال کردن کش استخراج")
+    parser.add_argument("--json", dest="json_path", help="ذخیره گزارش کامل به صورت JSON")
+    parser.add_argument("--verbose", action="store_true", help="نمایش فیلدهای نادرست")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    report = asyncio.run(_run(args))
+    _print_report(report, args.verbose)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
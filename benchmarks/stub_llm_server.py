@@ -0,0 +1,171 @@
+# benchmarks/stub_llm_server.py
+"""
+سرور LLM محلی سازگار با OpenAI برای benchmark
+پاسخ‌های ضبط‌شده corpus (فیلد llm_response) را بر اساس متن پرامپت برمی‌گرداند.
+
+اجرای مستقل:
+    python -m benchmarks.stub_llm_server --port 8765 --latency-ms 800 --jitter-ms 300
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from services.prompt_builder import compress_text, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_TEXT_RE = re.compile(r'Text:\n"""(.*)"""', re.S)
+_WANTED_RE = re.compile(r"^Wanted: (.*)$", re.M)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _norm(text: str) -> str:
+    return _SPACE_RE.sub(" ", compress_text(text)).strip()
+
+
+def load_corpus(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class StubLLM:
+    """پاسخ‌دهنده ضبط‌شده با تأخیر شبیه‌سازی‌شده"""
+
+    def __init__(self, records: List[Dict], latency_ms: float = 800, jitter_ms: float = 300):
+        self.records = [(_norm(r["text"]), r.get("llm_response", {})) for r in records]
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests = 0
+        self.unmatched = 0
+        self._seen_prefixes = set()
+
+    def _lookup(self, segment: str) -> Optional[Dict]:
+        segment = _norm(segment)
+        for text, response in self.records:
+            if segment and segment in text:
+                return response
+        return None
+
+    def answer(self, messages: List[Dict]) -> Dict:
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+
+        text_match = _TEXT_RE.search(user)
+        recorded = self._lookup(text_match.group(1)) if text_match else None
+        if recorded is None:
+            self.unmatched += 1
+            recorded = {}
+
+        wanted_match = _WANTED_RE.search(user)
+        wanted = [f.strip() for f in wanted_match.group(1).split(",")] if wanted_match else list(recorded)
+        content = json.dumps({f: recorded.get(f) for f in wanted}, ensure_ascii=False)
+
+        # prefix یکسان (system) از دومین بار به بعد «کش‌شده» حساب می‌شود
+        cached = estimate_tokens(system) if system in self._seen_prefixes else 0
+        self._seen_prefixes.add(system)
+        usage = {
+            "prompt_tokens": estimate_tokens(system) + estimate_tokens(user),
+            "completion_tokens": estimate_tokens(content),
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return {"content": content, "usage": usage}
+
+    async def delay(self):
+        seconds = max(0.0, random.gauss(self.latency_ms, self.jitter_ms / 2)) / 1000
+        await asyncio.sleep(seconds)
+
+
+def _completion(model: str, content: str, usage: Dict) -> Dict:
+    return {
+        "id": f"chatcmpl-stub-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": usage,
+    }
+
+
+def _chunk(model: str, delta: Dict, finish_reason=None, usage=None) -> bytes:
+    payload = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def create_app(stub: StubLLM) -> web.Application:
+    async def chat_completions(request: web.Request):
+        body = await request.json()
+        stub.requests += 1
+        model = body.get("model", "stub")
+        result = stub.answer(body.get("messages", []))
+        await stub.delay()
+
+        if not body.get("stream"):
+            return web.json_response(_completion(model, result["content"], result["usage"]))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        content = result["content"]
+        step = max(1, len(content) // 4)
+        for i in range(0, len(content), step):
+            await response.write(_chunk(model, {"content": content[i:i + step]}))
+            await asyncio.sleep(0.01)
+        await response.write(_chunk(model, {}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await response.write(_chunk(model, {}, usage=result["usage"]))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def models(request: web.Request):
+        return web.json_response({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", models)
+    return app
+
+
+async def start_server(stub: StubLLM, host: str = "127.0.0.1", port: int = 8765) -> web.AppRunner:
+    runner = web.AppRunner(create_app(stub), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Stub LLM listening on http://{host}:{port}/v1")
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible LLM replaying the benchmark corpus")
+    parser.add_argument("--corpus", default="benchmarks/corpus.jsonl")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    stub = StubLLM(load_corpus(args.corpus), args.latency_ms, args.jitter_ms)
+    web.run_app(create_app(stub), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 # bot.py - Main Entry Point
+import asyncio
+import inspect
 import logging
+import os
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
@@ -12,6 +15,19 @@ from telegram.request import HTTPXRequest
 
 from config import BOT_TOKEN, PROXY_URL
 from bot_handlers import handle_voice, handle_text, start
+from bot_processor_core import message_coalescer
+from stt import stt_pool, warm_up_stt, shutdown_stt_backend
+from services.audio_preprocess import shutdown_preprocess_pool
+from services.nocodb.base import close_nocodb_client, init_nocodb_client
+from services.nocodb.ledger import ledger
+from conversation_state import (
+    close_state_store,
+    restore_state_snapshot,
+    run_state_flusher,
+    run_state_snapshotter,
+    run_state_sweeper,
+    save_state_snapshot,
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -19,6 +35,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# تعداد آپدیت‌هایی که هم‌زمان پردازش می‌شوند؛ پیام‌های هر کاربر با user_locks ترتیبی می‌مانند (1 = ترتیبی)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+
+_background_tasks = []
+
+
+async def on_startup(app):
+    """
+    ساخت کلاینت NocoDB و بررسی ستون‌های ledger اعتبار (فقط خواندن؛ خطا log می‌شود)،
+    گرم کردن backend تبدیل صدا (بارگذاری مدل محلی در صورت انتخاب) و شروع پاکسازی/ذخیره state ها
+    """
+    await init_nocodb_client()
+    try:
+        await ledger.check()
+    except Exception as e:
+        logger.error(f"Credit ledger check failed (run verify_ledger.py): {e}")
+    await warm_up_stt()
+    _background_tasks.append(asyncio.create_task(run_state_sweeper()))
+    _background_tasks.append(asyncio.create_task(run_state_flusher()))
+    _background_tasks.append(asyncio.create_task(run_state_snapshotter()))
+
+
+async def on_stop(app):
+    """پردازش پیام‌های بافر شده؛ در post_stop که bot هنوز برای ارسال پاسخ آماده است"""
+    try:
+        await message_coalescer.flush_all()
+    except Exception as e:
+        logger.error(f"Flushing buffered messages failed: {e}", exc_info=True)
+
+
+async def on_shutdown(app):
+    """توقف workerهای STT و ذخیره آخرین state ها قبل از خروج؛ خطای یک مرحله بقیه را متوقف نمی‌کند"""
+    for task in _background_tasks:
+        task.cancel()
+
+    steps = [
+        ("stt pool", stt_pool.shutdown),
+        ("preprocess pool", shutdown_preprocess_pool),
+        ("stt backend", shutdown_stt_backend),
+        ("state snapshot", save_state_snapshot),
+        ("state store", close_state_store),
+        ("nocodb client", close_nocodb_client),
+    ]
+    for name, step in steps:
+        try:
+            result = step()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Shutdown step '{name}' failed: {e}", exc_info=True)
+
+
 def main():
     """Main bot runner"""
     request = HTTPXRequest(
@@ -30,13 +98,26 @@ def main():
     )
     
     logger.info(f"Bot starting with Proxy: {PROXY_URL}")
+
+    # گفتگوهای نیمه‌کاره قبل از restart/deploy
+    restore_state_snapshot()
     
     try:
-        app = ApplicationBuilder().token(BOT_TOKEN).request(request).build()
+        app = (
+            ApplicationBuilder()
+            .token(BOT_TOKEN)
+            .request(request)
+            .concurrent_updates(BOT_CONCURRENT_UPDATES)
+            .post_init(on_startup)
+            .post_stop(on_stop)
+            .post_shutdown(on_shutdown)
+            .build()
+        )
         
         # Register handlers
         app.add_handler(CommandHandler("start", start))
-        app.add_handler(MessageHandler(filters.VOICE, handle_voice))
+        # block=False: انتظار برای STT پردازش پیام‌های متنی را متوقف نمی‌کند
+        app.add_handler(MessageHandler(filters.VOICE, handle_voice, block=False))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
         
         print("Bot is ready. Waiting for messages...")
@@ -1,16 +1,22 @@
 # bot_handlers.py - Telegram Message Handlers
+import asyncio
 import logging
 import traceback
 from telegram import Update, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 
-from stt import voice_to_text
-from bot_processor_core import process_text
+from stt import transcribe, stt_pool, get_cached_transcript
+from services.circuit_breaker import CircuitOpenError
+from services.stt_pool import STTQueueFull, STTSuperseded
+from bot_processor_core import process_text, message_coalescer, user_locks
 from conversation_state import clear_state
 from nocodb_client import get_or_create_user
 
 logger = logging.getLogger(__name__)
 
+# قطعه‌های صدای بلند در task جدا پردازش می‌شوند؛ ارجاع قوی تا پایان کار
+_partial_tasks = set()
+
 # ✅ پیام استارت جدید
 START_MESSAGE = """👋 سلام! برای ثبت ملک خود، اطلاعات را صوتی 🎤 یا متنی⌨️ ارسال کنید.
 
@@ -37,7 +43,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ❌ last_name حذف شد
     )
 
-    clear_state(tg_user.id)
+    stt_pool.cancel_user(tg_user.id)
+    # بعد از پیام در حال پردازش همین کاربر (وگرنه state قدیمی دوباره ادغام می‌شود)
+    async with user_locks.hold(tg_user.id):
+        clear_state(tg_user.id)
 
     await update.message.reply_text(
         START_MESSAGE,
@@ -54,14 +63,53 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("در حال پردازش صدا...")
 
     try:
+        user_id = update.effective_user.id
+
+        # صدای تکراری/فوروارد شده: بدون get_file، دانلود و Whisper
+        cached = await get_cached_transcript(update.message.voice.file_unique_id)
+        if cached:
+            logger.info(f"🎧 Transcript cache hit for user {user_id}")
+            await process_text(cached, user_id, update)
+            return
+
+        delivered = []
+
+        async def deliver(partial: str, previous):
+            if previous is not None:
+                await asyncio.wait([previous])  # ترتیب قطعه‌ها حفظ شود
+            try:
+                await message_coalescer.submit(partial, user_id, update)
+            except Exception as e:
+                logger.error(f"Voice chunk processing error for user {user_id}: {e}", exc_info=True)
+
+        async def on_partial(partial: str):
+            # صدای بلند: متن هر قطعه به ترتیب وارد coalescer می‌شود، اما در task خودش؛
+            # لغو job (صدای جدیدتر) فقط تبدیل صدا را متوقف می‌کند، نه ادغام state را
+            task = asyncio.create_task(deliver(partial, delivered[-1] if delivered else None))
+            _partial_tasks.add(task)
+            task.add_done_callback(_partial_tasks.discard)
+            delivered.append(task)
+
         file = await context.bot.get_file(update.message.voice.file_id)
-        text = await voice_to_text(file)
+        # در صف STT منتظر می‌ماند؛ handler با block=False ثبت شده و بقیه آپدیت‌ها معطل نمی‌شوند
+        text = await transcribe(user_id, file, duration=update.message.voice.duration, on_partial=on_partial)
 
+        if delivered:
+            await asyncio.gather(*delivered)  # قطعه‌ها قبلاً به ترتیب پردازش شده‌اند
+            return
         if text:
-            await process_text(text, update.effective_user.id, update)
+            await process_text(text, user_id, update)
         else:
             await update.message.reply_text("متاسفانه صدا نامفهوم بود. لطفا مجددا تلاش کنید.")
 
+    except STTSuperseded:
+        logger.info(f"Voice of user {update.effective_user.id} superseded by a newer voice message")
+    except STTQueueFull:
+        await update.message.reply_text("⏳ تعداد پیام‌های صوتی در صف زیاد است. لطفاً کمی بعد دوباره ارسال کنید.")
+    except (TimeoutError, asyncio.TimeoutError):
+        await update.message.reply_text("⏳ پردازش صدا بیش از حد طول کشید. لطفا مجددا تلاش کنید یا متن را تایپ کنید.")
+    except CircuitOpenError:
+        await update.message.reply_text("⏳ سرویس تبدیل صدا موقتاً در دسترس نیست. لطفاً چند لحظه دیگر تلاش کنید یا متن را تایپ کنید.")
     except Exception as e:
         logger.error(f"Voice processing error: {e}")
         await update.message.reply_text("خطا در پردازش صدا. لطفا مجددا تلاش کنید.")
@@ -70,7 +118,8 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text messages"""
     if update.message.text:
         try:
-            await process_text(update.message.text, update.effective_user.id, update)
+            # پیام‌های پشت‌سرهم کاربر با هم پردازش می‌شوند (یک استخراج، یک پاسخ)
+            await message_coalescer.submit(update.message.text, update.effective_user.id, update)
         except Exception as e:
             logger.error(f"Text processing error: {e}")
             logger.error(traceback.format_exc())
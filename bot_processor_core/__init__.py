@@ -2,12 +2,16 @@
 """ماژول پردازش بات - نقطه ورود داخلی"""
 
 from .processor import process_text
+from .coalescer import message_coalescer
+from .user_lock import user_locks
 from .handlers import handle_edit_request, handle_callback_query
 from .constants import KEYBOARD_OPTIONS, BUTTON_VALUE_MAP
 from .utils import get_reply_keyboard, normalize_button_input
 
 __all__ = [
     "process_text",
+    "message_coalescer",
+    "user_locks",
     "handle_edit_request",
     "handle_callback_query",
     "KEYBOARD_OPTIONS",
@@ -0,0 +1,112 @@
+# bot_processor_core/coalescer.py
+"""تجمیع پیام‌های پشت‌سرهم یک کاربر قبل از استخراج (debounce)"""
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List
+
+from telegram import Update
+
+from conversation_state import get_pending_field, is_confirmation_mode, load_state
+from .constants import BUTTON_VALUE_MAP
+from .processor import process_text, _try_fast_path
+
+logger = logging.getLogger(__name__)
+
+# پیام‌هایی که در این بازه (ثانیه) پشت سر هم برسند با هم پردازش می‌شوند؛ 0 = غیرفعال
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "1.5"))
+COALESCE_MAX_MESSAGES = int(os.getenv("COALESCE_MAX_MESSAGES", "8"))
+
+
+class MessageCoalescer:
+    """
+    بافر پیام برای هر کاربر
+    با هر پیام جدید تایمر از نو شروع می‌شود؛ بعد از سکوت به اندازه window،
+    متن‌ها با هم به handler داده می‌شوند و فقط یک پاسخ ارسال می‌شود.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, int, Update], Awaitable],
+        window_seconds: float = COALESCE_WINDOW_SECONDS,
+        max_messages: int = COALESCE_MAX_MESSAGES,
+    ):
+        self.handler = handler
+        self.window_seconds = window_seconds
+        self.max_messages = max_messages
+        self._buffers: Dict[int, List[str]] = {}
+        self._updates: Dict[int, Update] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+        self.coalesced_messages = 0
+
+    def _should_bypass(self, user_id: int, text: str) -> bool:
+        """پاسخ دکمه، حالت تایید و جواب کوتاه به سوال فعلی منتظر نمی‌مانند"""
+        if self.window_seconds <= 0:
+            return True
+        if user_id in self._buffers:
+            return False  # حفظ ترتیب: به بافر موجود اضافه شود
+        if text.strip() in BUTTON_VALUE_MAP or is_confirmation_mode(user_id):
+            return True
+        fast_ok, _ = _try_fast_path(get_pending_field(user_id), text)
+        return fast_ok
+
+    async def submit(self, text: str, user_id: int, update: Update):
+        """ثبت پیام؛ بلافاصله برمی‌گردد تا آپدیت‌های بعدی معطل نشوند"""
+        await load_state(user_id)
+        if self._should_bypass(user_id, text):
+            await self._run(user_id, text, update)
+            return
+
+        buffer = self._buffers.setdefault(user_id, [])
+        buffer.append(text)
+        self._updates[user_id] = update
+
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+
+        delay = 0 if len(buffer) >= self.max_messages else self.window_seconds
+        self._timers[user_id] = asyncio.create_task(self._flush_later(user_id, delay))
+
+    async def _flush_later(self, user_id: int, delay: float):
+        await asyncio.sleep(delay)
+        # از این لحظه تایمر قابل لغو نیست؛ پیام بعدی بافر جدید می‌سازد
+        self._timers.pop(user_id, None)
+        await self._flush(user_id)
+
+    async def _flush(self, user_id: int):
+        texts = self._buffers.pop(user_id, [])
+        update = self._updates.pop(user_id, None)
+        if not texts or update is None:
+            return
+
+        if len(texts) > 1:
+            self.coalesced_messages += len(texts) - 1
+            logger.info(f"🧺 Coalesced {len(texts)} messages from user {user_id}")
+
+        await self._run(user_id, "\n".join(texts), update)
+
+    async def _run(self, user_id: int, text: str, update: Update):
+        try:
+            await self.handler(text, user_id, update)
+        except Exception as e:
+            logger.error(f"Text processing error: {e}", exc_info=True)
+            try:
+                await update.message.reply_text("❌ خطا در پردازش پیام. لطفا مجددا تلاش کنید.")
+            except Exception as reply_error:
+                logger.error(f"Error reply to user {user_id} failed: {reply_error}")
+
+    async def flush_all(self):
+        """پردازش فوری همه بافرها (مثلاً هنگام خاموش شدن)"""
+        for user_id in list(self._buffers):
+            timer = self._timers.pop(user_id, None)
+            if timer:
+                timer.cancel()
+            try:
+                await self._flush(user_id)
+            except Exception as e:
+                logger.error(f"Flushing messages of user {user_id} failed: {e}", exc_info=True)
+
+
+message_coalescer = MessageCoalescer(process_text)
@@ -37,6 +37,17 @@ NUMERIC_FIELDS = [
 
 PRICE_FIELDS = ["price_total", "rent", "deposit", "price", "mortgage"]
 
+# ✅ کلمات مجاز در عبارت قیمت (عدد حروفی، ضریب، واحد پول)
+PRICE_WORDS = {
+    "صفر", "یک", "یه", "دو", "سه", "چهار", "پنج", "شش", "شیش", "هفت", "هشت", "نه",
+    "ده", "یازده", "دوازده", "سیزده", "چهارده", "پانزده", "پونزده", "شانزده",
+    "هفده", "هجده", "هیجده", "نوزده", "بیست", "سی", "چهل", "پنجاه", "شصت",
+    "هفتاد", "هشتاد", "نود", "صد", "یکصد", "دویست", "سیصد", "چهارصد", "پانصد",
+    "پونصد", "ششصد", "هفتصد", "هشتصد", "نهصد",
+    "هزار", "هزارو", "میلیون", "ملیون", "میلیونو", "میلیارد", "ملیارد", "میلیادو",
+    "و", "تومان", "تومن", "ریال",
+}
+
 TEXT_FIELDS = ["owner_name", "neighborhood", "city", "address"]
 
 # ✅ فیلدهای متن آزاد - هر ورودی قبول می‌شود و pending پاک می‌شود
@@ -138,5 +149,31 @@ SALE_FIELDS = ["price", "price_total"]
 # فیلدهای مربوط به رهن و اجاره
 RENT_FIELDS = ["deposit", "mortgage", "rent"]
 
+# ✅ امکاناتی که LLM به صورت جداگانه برمی‌گرداند و در additional_features خلاصه می‌شوند
+AMENITY_LABELS = {
+    "has_lobby": "لابی",
+    "has_pool": "استخر",
+    "has_sauna": "سونا",
+    "has_gym": "باشگاه",
+    "has_guard": "نگهبان",
+    "has_central_vacuum": "جاروی مرکزی",
+    "has_balcony": "بالکن",
+    "has_terrace": "تراس",
+    "has_roof_garden": "روف گاردن",
+    "has_video_intercom": "آیفون تصویری",
+    "has_central_antenna": "آنتن مرکزی",
+    "view_type": "ویو",
+    "floor_material": "کف",
+    "cabinet_type": "کابینت",
+    "cooling_system": "سرمایش",
+    "heating_system": "گرمایش",
+}
+
 # فیلدهای بولین
 BOOLEAN_FIELDS = ["has_parking", "has_elevator", "has_storage", "has_balcony"]
+
+# ✅ پاسخ وقتی سرویس استخراج (LLM) موقتاً در دسترس نیست (circuit breaker باز است)
+LLM_UNAVAILABLE_MESSAGE = "⏳ سرویس پردازش متن موقتاً در دسترس نیست. لطفاً چند لحظه دیگر دوباره ارسال کنید."
+
+# صف پیام‌های کاربر پر است (پیام‌های قبلی هنوز در حال پردازش‌اند)
+USER_BUSY_MESSAGE = "⏳ پیام‌های قبلی شما هنوز در حال پردازش است. لطفاً کمی صبر کنید و دوباره ارسال کنید."
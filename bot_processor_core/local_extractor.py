@@ -0,0 +1,228 @@
+# bot_processor_core/local_extractor.py
+"""استخراج قاعده‌محور فیلدها از متن فارسی (قبل از فراخوانی LLM)"""
+
+import logging
+import re
+from typing import Dict, Tuple
+
+from bot_utils import text_to_int
+from phone_utils import normalize_iran_phone
+from utils import validate_area, validate_floor, validate_year, validate_count
+
+from .constants import PRICE_WORDS
+from .utils import (
+    persian_text_to_number,
+    normalize_transaction_type,
+    normalize_property_type,
+)
+
+logger = logging.getLogger(__name__)
+
+_DIGIT_FOLD = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+
+# کلمات عددی عبارت قیمت: ضریب‌ها جدا از عددها، چون بعد از ضریب فقط «عدد + ضریب» مجاز است
+_MULTIPLIER_WORDS = sorted(
+    {"هزار", "هزارو", "میلیون", "ملیون", "میلیونو", "میلیارد", "ملیارد", "میلیادو"},
+    key=len, reverse=True,
+)
+_NUMBER_WORDS = sorted(
+    PRICE_WORDS - set(_MULTIPLIER_WORDS) - {"و", "تومان", "تومن", "ریال"},
+    key=len, reverse=True,
+)
+
+_NOT_LETTER = r"(?![آ-یa-z])"
+_NO_LETTER_BEFORE = r"(?<![آ-یa-z])"
+_NUM = r"\d+(?:[.,،]\d+)*"
+_PHONE = r"(?<!\d)(?:\+98|0098|0)?9\d{2}[\s\-]?\d{3}[\s\-]?\d{4}(?!\d)"
+_SEP = r"\s*[:：=]?\s*"
+
+# «۵ میلیارد و ۲۰۰ میلیون»: عدد بعد از ضریب فقط وقتی پذیرفته می‌شود که خودش ضریب داشته باشد؛
+# وگرنه شماره تلفن یا عدد بعدی متن جزو قیمت حساب می‌شد
+_AMOUNT = (
+    rf"(?:(?!{_PHONE}){_NUM}|(?:{'|'.join(_NUMBER_WORDS)}){_NOT_LETTER})"
+    rf"(?:\s+(?:و\s+)?(?:{'|'.join(_NUMBER_WORDS)}){_NOT_LETTER})*"
+)
+_MULTIPLIER = rf"(?:{'|'.join(_MULTIPLIER_WORDS)}){_NOT_LETTER}"
+_PRICE = (
+    rf"(?:{_AMOUNT}(?:\s*{_MULTIPLIER})?|{_MULTIPLIER})"
+    rf"(?:\s+(?:و\s*)?{_AMOUNT}\s*{_MULTIPLIER})*"
+    rf"(?:\s*(?:تومان|تومن|ریال){_NOT_LETTER})?"
+)
+
+# کلماتی که عدد بعدشان فاصله است نه متراژ («فاصله تا دریا ۲۰۰ متر»)
+_DISTANCE_WORDS = {"فاصله", "تا", "از"}
+# بخش‌هایی که متراژ خودشان را دارند («تراس ۱۲ متر»، «حیاط ۴۰ متری») یا عرض معبر («خیابان ۱۲ متری»)
+_PART_WORDS = ("تراس", "حیاط", "بالکن", "انباری", "خیابان", "کوچه")
+_APPROX_WORDS = {"حدود", "حدودا", "حدوداً", "تقریبا", "تقریباً"}
+_PROPERTY_TYPE_RE = re.compile(r"^(?:آپارتمان|اپارتمان|ویلایی|ویلا|زمین|مغازه|سوله|دفتر)")
+_CLAUSE_SPLIT_RE = re.compile(r"[،,.؛;:\n]")
+
+_ORDINAL_FLOORS = {
+    "اول": 1, "دوم": 2, "سوم": 3, "چهارم": 4, "پنجم": 5,
+    "ششم": 6, "هفتم": 7, "هشتم": 8, "نهم": 9, "دهم": 10,
+}
+
+_AMENITY_FIELDS = {
+    "آسانسور": "has_elevator",
+    "پارکینگ": "has_parking",
+    "انباری": "has_storage",
+}
+
+# کلماتی که بعد از حذف بخش‌های شناخته‌شده، اطلاعات جدیدی ندارند
+_FILLER_WORDS = {
+    "و", "با", "در", "به", "یک", "یه", "دارد", "داره", "است", "هست",
+    "ملک", "واحد", "ساختمان", "تومان", "تومن", "ریال", "ماهیانه", "ماهانه",
+}
+
+# یک regex واحد؛ متن فقط یک بار پیمایش می‌شود و ترتیب شاخه‌ها مهم است
+_LOCAL_RE = re.compile(
+    "|".join([
+        rf"(?P<phone>{_PHONE})",
+        rf"(?P<price_kw>قیمت(?:\s*کل)?|رهن|ودیعه|اجاره(?:\s*(?:ماهیانه|ماهانه|بها))?)"
+        rf"{_SEP}(?P<price_v>{_PRICE})",
+        r"(?P<presale>پیش[‌\s]?فروش)",
+        rf"{_NO_LETTER_BEFORE}(?P<tx>فروش|رهن|اجاره)ی?{_NOT_LETTER}",
+        rf"{_NO_LETTER_BEFORE}(?P<ptype>آپارتمان|اپارتمان|ویلایی|ویلا|زمین|مغازه|سوله|دفتر\s*کار){_NOT_LETTER}",
+        rf"(?P<area_kw>متراژ|زیربنا){_SEP}(?P<area_v>{_NUM})",
+        rf"(?P<area_u>{_NUM})\s*(?:متر\s*مربع|مترمربع|متر{_NOT_LETTER})",
+        r"(?P<unit_floor>واحد\s*در\s*طبقه\s*[:：=]?\s*\d+)",
+        rf"(?:تعداد\s*طبقات|کل\s*طبقات){_SEP}(?P<tf_kw>\d+)",
+        rf"(?P<tf_u>\d+)\s*طبقه{_NOT_LETTER}",
+        rf"طبقه{_SEP}(?P<floor_v>\d+)",
+        rf"طبقه\s*(?P<floor_ord>{'|'.join(_ORDINAL_FLOORS)}){_NOT_LETTER}",
+        r"(?P<bed_v>\d+|یک|دو|سه|چهار|پنج)\s*(?:اتاق\s*خواب|خوابه|خواب|اتاقه)",
+        rf"(?:تعداد\s*)?(?:اتاق\s*خواب|خواب){_SEP}(?P<bed_kw>\d+)",
+        rf"(?:سال\s*ساخت|ساخت){_SEP}(?P<year>\d{{4}})",
+        rf"بدون\s*(?P<amen_no>{'|'.join(_AMENITY_FIELDS)})",
+        rf"(?P<amen>{'|'.join(_AMENITY_FIELDS)}){_SEP}(?P<amen_neg>ندارد|نداره|نیست)?",
+    ])
+)
+
+_LEFTOVER_STRIP_RE = re.compile(r"[^\w\s]|\d|_")
+
+
+def _to_number(raw: str):
+    return text_to_int(raw.replace("،", "").replace(",", ""))
+
+
+def _is_distance(text: str, start: int, end: int) -> bool:
+    """
+    آیا «N متر» در این جمله فاصله است؟ (یکی از کلمات فاصله در سه کلمه قبل)
+    اگر عدد کنار نوع ملک باشد («آپارتمان ۱۲۰ متر») متراژ حساب می‌شود.
+    """
+    before = _CLAUSE_SPLIT_RE.split(text[:start])[-1].split()
+    after = _CLAUSE_SPLIT_RE.split(text[end:])[0].split()
+    if (before and _PROPERTY_TYPE_RE.match(before[-1])) or (after and _PROPERTY_TYPE_RE.match(after[0])):
+        return False
+    return any(w in _DISTANCE_WORDS for w in before[-3:])
+
+
+def _is_part_area(text: str, start: int) -> bool:
+    """آیا «N متر» متراژ یک بخش (تراس، حیاط، ...) است؟ کلمه قبل از عدد (بدون «حدود») بررسی می‌شود"""
+    before = [w for w in _CLAUSE_SPLIT_RE.split(text[:start])[-1].split() if w not in _APPROX_WORDS]
+    return bool(before) and before[-1].startswith(_PART_WORDS)
+
+
+def extract_local(text: str) -> Tuple[Dict, str]:
+    """
+    استخراج فیلدهای قطعی (متراژ، تلفن، قیمت، طبقه، خواب، نوع معامله/ملک، ...)
+    Returns: (فیلدهای استخراج‌شده, باقیمانده متن که شناسایی نشد)
+    """
+    if not text:
+        return {}, ""
+
+    folded = text.translate(_DIGIT_FOLD)
+    fields: Dict = {}
+    leftover_parts = []
+    last_end = 0
+
+    for m in _LOCAL_RE.finditer(folded):
+        leftover_parts.append(folded[last_end:m.start()])
+        last_end = m.end()
+        kind = m.lastgroup
+        groups = m.groupdict()
+
+        if groups["phone"]:
+            phone = normalize_iran_phone(groups["phone"])
+            if phone:
+                fields.setdefault("owner_phone", phone)
+
+        elif groups["price_kw"]:
+            keyword = groups["price_kw"]
+            value = persian_text_to_number(groups["price_v"])
+            if keyword.startswith("قیمت"):
+                field = "price_total"
+            elif keyword.startswith("اجاره"):
+                field = "rent"
+                fields.setdefault("transaction_type", "رهن و اجاره")
+            else:
+                field = "deposit"
+                fields.setdefault("transaction_type", "رهن و اجاره")
+            if value:
+                fields.setdefault(field, value)
+
+        elif groups["presale"]:
+            fields.setdefault("transaction_type", "پیش‌فروش")
+
+        elif groups["tx"]:
+            tx = normalize_transaction_type(groups["tx"])
+            if tx:
+                fields.setdefault("transaction_type", tx)
+
+        elif groups["ptype"]:
+            ptype = normalize_property_type(groups["ptype"])
+            if ptype:
+                fields.setdefault("property_type", ptype)
+
+        elif groups["area_u"] and (_is_distance(folded, m.start(), m.end()) or _is_part_area(folded, m.start())):
+            # فاصله (مثلاً تا دریا) یا متراژ تراس/حیاط را متراژ ملک نگیر؛ LLM تصمیم می‌گیرد
+            leftover_parts.append(m.group(0))
+
+        elif groups["area_v"] or groups["area_u"]:
+            area = validate_area(_to_number(groups["area_v"] or groups["area_u"]))
+            if area:
+                fields.setdefault("area", area)
+
+        elif groups["unit_floor"]:
+            # «واحد در طبقه» مبهم است (طبقه یا تعداد واحد) - به LLM سپرده می‌شود
+            leftover_parts.append(m.group(0))
+
+        elif groups["tf_kw"] or groups["tf_u"]:
+            total = validate_count(groups["tf_kw"] or groups["tf_u"], "total_floors")
+            if total:
+                fields.setdefault("total_floors", total)
+
+        elif groups["floor_v"] or groups["floor_ord"]:
+            raw = groups["floor_v"] or _ORDINAL_FLOORS[groups["floor_ord"]]
+            floor = validate_floor(raw)
+            if floor:
+                fields.setdefault("floor", floor)
+
+        elif groups["bed_v"] or groups["bed_kw"]:
+            bedrooms = validate_count(_to_number(groups["bed_v"] or groups["bed_kw"]), "bedroom_count")
+            if bedrooms:
+                fields.setdefault("bedroom_count", bedrooms)
+
+        elif groups["year"]:
+            year = validate_year(groups["year"])
+            if year:
+                fields.setdefault("build_year", year)
+
+        elif groups["amen_no"]:
+            fields.setdefault(_AMENITY_FIELDS[groups["amen_no"]], False)
+
+        elif groups["amen"]:
+            fields.setdefault(_AMENITY_FIELDS[groups["amen"]], not groups["amen_neg"])
+
+        else:
+            logger.debug(f"Unhandled local match group: {kind}")
+
+    leftover_parts.append(folded[last_end:])
+    leftover = " ".join(
+        w for w in _LEFTOVER_STRIP_RE.sub(" ", " ".join(leftover_parts)).split()
+        if w not in _FILLER_WORDS
+    )
+
+    if fields:
+        logger.info(f"🔎 Local extraction: {fields}")
+    return fields, leftover
@@ -2,6 +2,8 @@
 """پردازشگر اصلی متن با اعتبارسنجی ورودی"""
 
 import logging
+import re
+from contextlib import aclosing
 from typing import Dict, Optional, Tuple
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 
@@ -12,9 +14,9 @@ from nocodb_client import (
     is_confirmation_token_used,
 )
 
-from extractor import extract_json
+from extractor import extract_json, extract_json_stream, llm_available, LLM_STREAMING
 from phone_utils import normalize_iran_phone
-from rule_engine import run_rule_engine
+from rule_engine import run_rule_engine, _get_required_fields, _is_field_filled
 
 from conversation_state import (
     merge_state,
@@ -24,6 +26,8 @@ from conversation_state import (
     clear_state,
     set_confirmation_mode,
     is_confirmation_mode,
+    get_confirmation_token,
+    load_state,
 )
 
 from services.inference_service import (
@@ -32,19 +36,27 @@ from services.inference_service import (
     normalize_location,
 )
 
-from utils import normalize_price, validate_area, validate_floor
+from utils import normalize_price, validate_area, validate_count, validate_floor, validate_year
 from bot_utils import text_to_int, normalize_yes_no, format_confirmation_message
 
 from .constants import (
     KEYBOARD_OPTIONS,
+    BUTTON_VALUE_MAP,
     FIELD_QUESTIONS,
     PRICE_FIELDS,
     FREE_TEXT_FIELDS,
     NUMERIC_FIELDS,
     BOOLEAN_FIELDS,
+    PRICE_WORDS,
+    AMENITY_LABELS,
+    LLM_UNAVAILABLE_MESSAGE,
+    USER_BUSY_MESSAGE,
 )
 
+from .local_extractor import extract_local
+from .user_lock import UserBusy, user_locks
 from .utils import (
+    persian_text_to_number,
     normalize_button_input,
     normalize_transaction_type,
     normalize_property_type,
@@ -55,114 +67,6 @@ from .utils import (
 
 logger = logging.getLogger(__name__)
 
-def persian_text_to_number(text: str) -> Optional[float]:
-    """
-    تبدیل متن فارسی قیمت به عدد
-    مثال: "چهار میلیارد و دویست میلیون تومان" -> 4,200,000,000
-    """
-    if not text:
-        return None
-
-    original_text = text
-    text = text.strip().lower()
-
-    # اعداد فارسی به انگلیسی
-    persian_digits = '۰۱۲۳۴۵۶۷۸۹'
-    english_digits = '0123456789'
-    for p, e in zip(persian_digits, english_digits):
-        text = text.replace(p, e)
-
-    # حذف "تومان" و "ریال" و کاراکترهای اضافی
-    text = text.replace('تومان', '').replace('ریال', '').replace('تومن', '')
-    text = text.replace('،', '').replace(',', '').strip()
-
-    # اگر عدد مستقیم باشد
-    clean = text.replace(' ', '')
-    try:
-        return float(clean)
-    except ValueError:
-        pass
-
-    # === نرمال‌سازی کلمات ===
-    # اصلاح غلط‌های املایی رایج
-    text = text.replace('میلیادو', 'میلیارد و')
-    text = text.replace('میلیادی', 'میلیاردی')
-    text = text.replace('ملیارد', 'میلیارد')
-    text = text.replace('ملیون', 'میلیون')
-    text = text.replace('میلیونو', 'میلیون و')
-    text = text.replace('هزارو', 'هزار و')
-    
-    # کلمات عددی فارسی
-    word_numbers = {
-        'صفر': 0, 'یک': 1, 'یه': 1, 'دو': 2, 'سه': 3, 'چهار': 4,
-        'پنج': 5, 'شش': 6, 'شیش': 6, 'هفت': 7, 'هشت': 8, 'نه': 9,
-        'ده': 10, 'یازده': 11, 'دوازده': 12, 'سیزده': 13,
-        'چهارده': 14, 'پانزده': 15, 'پونزده': 15, 'شانزده': 16, 
-        'هفده': 17, 'هجده': 18, 'هیجده': 18, 'نوزده': 19,
-        'بیست': 20, 'سی': 30, 'چهل': 40, 'پنجاه': 50,
-        'شصت': 60, 'هفتاد': 70, 'هشتاد': 80, 'نود': 90,
-        'صد': 100, 'یکصد': 100, 'دویست': 200, 'سیصد': 300,
-        'چهارصد': 400, 'پانصد': 500, 'پونصد': 500,
-        'ششصد': 600, 'هفتصد': 700, 'هشتصد': 800, 'نهصد': 900,
-    }
-
-    # ضرایب بزرگ
-    multipliers = {
-        'هزار': 1_000,
-        'میلیون': 1_000_000,
-        'میلیارد': 1_000_000_000,
-    }
-
-    # === الگوریتم پردازش ===
-    # جدا کردن با "و"
-    text = text.replace(' و ', ' ')
-    words = text.split()
-
-    total = 0
-    current_chunk = 0  # عدد فعلی قبل از ضریب
-    
-    i = 0
-    while i < len(words):
-        word = words[i].strip()
-        
-        if not word:
-            i += 1
-            continue
-        
-        # اگر عدد است
-        if word in word_numbers:
-            current_chunk += word_numbers[word]
-        
-        # اگر ضریب است
-        elif word in multipliers:
-            multiplier = multipliers[word]
-            
-            if current_chunk == 0:
-                current_chunk = 1
-            
-            # ضرب در ضریب و اضافه به total
-            total += current_chunk * multiplier
-            current_chunk = 0
-        
-        # اگر عدد انگلیسی است
-        else:
-            try:
-                num = float(word)
-                current_chunk += num
-            except ValueError:
-                pass
-        
-        i += 1
-
-    # اضافه کردن باقیمانده
-    total += current_chunk
-
-    if total > 0:
-        logger.info(f"💰 persian_text_to_number: '{original_text}' -> {total:,.0f}")
-        return float(total)
-    
-    return None
-
 def _validate_and_normalize_input(pending_field: str, text) -> Tuple[bool, Optional[any]]:
     """اعتبارسنجی و نرمال‌سازی ورودی"""
     # اگر از قبل نرمال‌سازی شده (مثلاً بولی)، مستقیم برگردان
@@ -264,6 +168,126 @@ def _validate_and_normalize_input(pending_field: str, text) -> Tuple[bool, Optio
     return False, None
 
 
+# === مسیر سریع (بدون LLM) برای پاسخ‌های کوتاه به فیلد pending ===
+FAST_PATH_MAX_WORDS = 6
+
+# فیلدهایی که با کلمه کلیدی تشخیص داده می‌شوند
+KEYWORD_FIELDS = ["transaction_type", "property_type", "usage_type"]
+
+# واحدهایی که بعد از پاسخ عددی می‌آیند (مثل «120 متر») و فیلدهایی که به آن‌ها می‌خورند
+# واحد نامربوط («۱۲۰ متر» برای تعداد خواب) به LLM سپرده می‌شود
+NUMERIC_UNIT_WORDS = {
+    "متر": {"area"},
+    "مترمربع": {"area"},
+    "متری": {"area"},
+    "خواب": {"bedroom_count"},
+    "اتاق": {"bedroom_count"},
+    "طبقه": {"floor", "total_floors"},
+    "واحد": {"unit_count"},
+}
+
+_DIGITS_RE = re.compile(r"[0-9۰-۹]")
+_NUMBER_TOKEN_RE = re.compile(r"^[0-9۰-۹.,،]+$")
+_PHONE_ANSWER_RE = re.compile(r"^[+0-9۰-۹\s\-()]+$")
+
+
+def _is_price_answer(text: str) -> bool:
+    """آیا متن فقط از عدد و کلمات عددی/واحد پول تشکیل شده؟"""
+    tokens = text.replace("،", " ").replace(",", " ").split()
+    return bool(tokens) and all(
+        _NUMBER_TOKEN_RE.match(t) or t in PRICE_WORDS for t in tokens
+    )
+
+
+def _numeric_in_range(field: str, value: int) -> bool:
+    """بازه منطقی هر فیلد عددی (همان اعتبارسنجی‌های utils)"""
+    if field == "area":
+        return validate_area(value) is not None
+    if field == "floor":
+        return validate_floor(value) is not None
+    if field == "build_year":
+        return validate_year(value) is not None
+    return validate_count(value, field) is not None
+
+
+def _try_fast_path(pending_field: Optional[str], text: str) -> Tuple[bool, Optional[any]]:
+    """
+    تلاش برای پاسخ به فیلد pending فقط با پارسرهای محلی
+    فقط وقتی True برمی‌گرداند که مطمئن باشیم متن چیزی جز پاسخ همین فیلد ندارد؛
+    در غیر این صورت باید LLM فراخوانی شود.
+    """
+    if not pending_field:
+        return False, None
+
+    clean_text = text.strip()
+
+    # ورودی دکمه همیشه محلی قابل پردازش است
+    if clean_text in BUTTON_VALUE_MAP:
+        return _validate_and_normalize_input(pending_field, normalize_button_input(clean_text))
+
+    words = clean_text.split()
+    if not words or len(words) > FAST_PATH_MAX_WORDS or "\n" in clean_text:
+        return False, None
+
+    if pending_field in NUMERIC_FIELDS:
+        # text_to_int فقط عدد خالص (یا یک کلمه عددی) را می‌پذیرد
+        if len(words) == 2:
+            if pending_field not in NUMERIC_UNIT_WORDS.get(words[1], ()):
+                return False, None
+            clean_text = words[0]
+        ok, value = _validate_and_normalize_input(pending_field, clean_text)
+        if not ok or not _numeric_in_range(pending_field, value):
+            return False, None
+        return True, value
+
+    if pending_field in PRICE_FIELDS:
+        if not _is_price_answer(clean_text):
+            return False, None
+        return _validate_and_normalize_input(pending_field, clean_text)
+
+    if pending_field == "owner_phone":
+        if not _PHONE_ANSWER_RE.match(clean_text):
+            return False, None
+        return _validate_and_normalize_input(pending_field, clean_text)
+
+    # فیلدهای کلمه‌کلیدی، بولی و متنی: فقط پاسخ‌های خیلی کوتاه و بدون عدد
+    if _DIGITS_RE.search(clean_text):
+        return False, None
+
+    if len(words) > 3:
+        return False, None
+
+    # متن باید دقیقاً یک مقدار باشد: «فروش آپارتمان» یا «آپارتمان مسکونی»
+    # فیلد دیگری هم دارند و باید به استخراج کامل برسند
+    local_fields, leftover = extract_local(clean_text)
+    if set(local_fields) - {pending_field}:
+        return False, None
+    if pending_field in local_fields:
+        if leftover:
+            return False, None
+        return _validate_and_normalize_input(pending_field, local_fields[pending_field])
+
+    if pending_field in KEYWORD_FIELDS and len(words) > 1:
+        return False, None
+
+    return _validate_and_normalize_input(pending_field, clean_text)
+
+
+def _can_skip_llm(user_id: int, local_fields: Dict, leftover: str) -> bool:
+    """
+    آیا استخراج محلی برای این پیام کافی است؟
+    - کل متن شناسایی شده باشد، یا
+    - همه فیلدهای اجباری (با احتساب state فعلی) پر شده باشند
+    """
+    if not local_fields:
+        return False
+    if not leftover:
+        return True
+
+    merged = {**get_state(user_id), **local_fields}
+    return all(_is_field_filled(merged, f) for f in _get_required_fields(merged))
+
+
 def _get_validation_error_message(pending_field: str) -> str:
     """پیام خطای اعتبارسنجی برای هر فیلد"""
     messages = {
@@ -333,50 +357,100 @@ async def _process_pending_field(
 
 
 async def process_text(text: str, user_id: int, update: Update):
-    """تابع اصلی پردازش متن"""
+    """تابع اصلی پردازش متن (پیام‌های هر کاربر یکی‌یکی و به ترتیب ورود)"""
+    try:
+        async with user_locks.hold(user_id):
+            await load_state(user_id)
+            return await _process_text(text, user_id, update)
+    except UserBusy:
+        logger.warning(f"User {user_id} has too many pending messages; dropping: {text}")
+        await update.message.reply_text(USER_BUSY_MESSAGE)
+
+
+async def _process_text(text: str, user_id: int, update: Update):
     logger.info(f"INPUT from user {user_id}: {text}")
     
     # === حالت تایید ===
     if is_confirmation_mode(user_id):
         return await _handle_confirmation_mode(user_id, text, update)
     
-    # === استخراج با LLM ===
-    extracted = extract_json(text) or {}
-    
     # === پردازش فیلد pending ===
     pending_field = get_pending_field(user_id)
-    
-    # === اگر pending_field داریم، مقادیر متناقض LLM را نادیده بگیر ===
-    if pending_field:
-        # حذف مقادیری که LLM اشتباه استخراج کرده
-        numeric_fields = ['price_total', 'rent', 'deposit', 'area', 'floor', 'bedroom_count', 'total_floors', 'unit_count', 'build_year']
-        text_fields = ['owner_name', 'neighborhood', 'city']
+
+    # === مسیر سریع: پاسخ کوتاه به فیلد pending بدون فراخوانی LLM ===
+    fast_ok, fast_value = _try_fast_path(pending_field, text)
+
+    if fast_ok:
+        logger.info(f"⚡ Fast path for {pending_field}: {fast_value} (LLM skipped)")
+        extracted = {pending_field: fast_value}
+        set_pending_field(user_id, None)
+
+    else:
+        # === استخراج محلی (regex) قبل از LLM ===
+        local_fields, leftover = extract_local(text)
+
+        if pending_field and pending_field in local_fields:
+            logger.info(f"🔎 Pending field {pending_field} answered by local extraction")
+            set_pending_field(user_id, None)
+            pending_field = None
+
+        if _can_skip_llm(user_id, local_fields, leftover):
+            logger.info("⚡ Local extraction covers the message (LLM skipped)")
+            extracted = {}
+        elif not llm_available():
+            # === provider در دسترس نیست (مدار باز): فقط استخراج محلی ===
+            if not local_fields and not pending_field:
+                await update.message.reply_text(LLM_UNAVAILABLE_MESSAGE)
+                return
+            logger.warning("⚠️ LLM circuit open; continuing with local extraction only")
+            extracted = {}
+        elif LLM_STREAMING and not pending_field:
+            # === استخراج استریم با پاسخ زودهنگام ===
+            return await _process_streaming(user_id, text, local_fields, update)
+        else:
+            # === استخراج با LLM (فقط فیلدهایی که نه در state هستند و نه محلی پیدا شدند) ===
+            extracted = await extract_json(
+                text, exclude_fields=tuple(local_fields), known=get_state(user_id)
+            ) or {}
+
+        # === اگر pending_field داریم، مقادیر متناقض LLM را نادیده بگیر ===
+        if pending_field:
+            # حذف مقادیری که LLM اشتباه استخراج کرده
+            numeric_fields = ['price_total', 'rent', 'deposit', 'area', 'floor', 'bedroom_count', 'total_floors', 'unit_count', 'build_year']
+            text_fields = ['owner_name', 'neighborhood', 'city']
         
-        fields_to_remove = []
-        for cf in extracted.keys():
-            if cf == pending_field:
-                continue  # فیلد مورد انتظار را حذف نکن
+            fields_to_remove = []
+            for cf in extracted.keys():
+                if cf == pending_field:
+                    continue  # فیلد مورد انتظار را حذف نکن
             
-            # اگر فیلد عددی است و pending_field هم عددی است
-            if cf in numeric_fields:
-                fields_to_remove.append(cf)
-            # اگر فیلد متنی است و pending_field هم متنی است
-            elif cf in text_fields and pending_field in text_fields:
-                fields_to_remove.append(cf)
+                # اگر فیلد عددی است و pending_field هم عددی است
+                if cf in numeric_fields:
+                    fields_to_remove.append(cf)
+                # اگر فیلد متنی است و pending_field هم متنی است
+                elif cf in text_fields and pending_field in text_fields:
+                    fields_to_remove.append(cf)
         
-        for cf in fields_to_remove:
-            logger.info(f"🚫 Ignoring LLM extraction of {cf}={extracted[cf]} while pending_field is {pending_field}")
-            del extracted[cf]
+            for cf in fields_to_remove:
+                logger.info(f"🚫 Ignoring LLM extraction of {cf}={extracted[cf]} while pending_field is {pending_field}")
+                del extracted[cf]
 
-        
-        # پردازش ورودی pending
-        handled = await _process_pending_field(
-            user_id, text, pending_field, extracted, update
-        )
-        if handled:
-            return  # خطای اعتبارسنجی - منتظر ورودی جدید
+        # مقادیر استخراج محلی قطعی‌تر از LLM هستند
+        extracted.update(local_fields)
 
+        if pending_field:
+            # پردازش ورودی pending
+            handled = await _process_pending_field(
+                user_id, text, pending_field, extracted, update
+            )
+            if handled:
+                return  # خطای اعتبارسنجی - منتظر ورودی جدید
+
+    await _apply_extracted(user_id, extracted, update)
 
+
+def _prepare_extracted(user_id: int, extracted: Dict) -> Dict:
+    """نرمال‌سازی و inference روی داده‌های استخراج شده (state تغییر نمی‌کند)"""
     
     # === نرمال‌سازی داده‌ها ===
     extracted = _normalize_extracted_data(extracted)
@@ -395,13 +469,19 @@ async def process_text(text: str, user_id: int, update: Update):
         extracted = infer_usage_type(extracted)
     extracted = normalize_location(extracted)
     
+    return extracted
+
+
+async def _apply_extracted(user_id: int, extracted: Dict, update: Update):
+    """ادغام با state، اجرای Rule Engine و ارسال پاسخ"""
+    extracted = _prepare_extracted(user_id, extracted)
+    
     # === ادغام state ===
     data = merge_state(user_id, extracted)
-    data["_user_id"] = user_id
-    logger.info(f"Merged state for user {user_id}: {data}")
+    logger.info(f"Merged state for user {user_id}: {dict(data)}")
     
     # === Rule Engine ===
-    result = run_rule_engine(data)
+    result = run_rule_engine(data, user_id)
     logger.info(f"Rule Engine Result: {result}")
     
     # === پاسخ به کاربر ===
@@ -431,9 +511,87 @@ async def process_text(text: str, user_id: int, update: Update):
         )
 
 
+def _early_question_ready(user_id: int, extracted: Dict, settled: set) -> bool:
+    """
+    آیا سوال بعدی Rule Engine قطعی است؟
+    وقتی نوع معامله/ملک و فیلد گمشده‌ای که پرسیده می‌شود هر دو قطعی باشند،
+    فیلدهایی که بعداً از استریم می‌رسند سوال را تغییر نمی‌دهند.
+    """
+    if not {"transaction_type", "property_type"} <= settled:
+        return False
+
+    preview = {**get_state(user_id), **_prepare_extracted(user_id, dict(extracted))}
+
+    result = run_rule_engine(preview)  # بدون user_id: بدون side effect روی pending field
+    return result["status"] == "question" and result["missing"] in settled
+
+
+async def _process_streaming(user_id: int, text: str, local_fields: Dict, update: Update):
+    """
+    استخراج استریم: به محض قطعی شدن سوال بعدی پاسخ می‌دهد
+    و فیلدهایی که بعد از آن می‌رسند بی‌صدا در state ادغام می‌شوند.
+    """
+    current_state = get_state(user_id)
+    known = {k for k, v in current_state.items() if v is not None}
+    known |= set(local_fields)
+
+    extracted = dict(local_fields)
+    applied = None
+
+    async with aclosing(extract_json_stream(
+        text, exclude_fields=tuple(local_fields), known=current_state
+    )) as stream:
+        async for fields, seen in stream:
+            extracted = {**fields, **local_fields}
+
+            if applied is None and _early_question_ready(user_id, extracted, known | seen):
+                logger.info(f"⚡ Early reply from partial stream: {list(extracted.keys())}")
+                applied = dict(extracted)
+                await _apply_extracted(user_id, dict(extracted), update)
+
+    if applied is None:
+        await _apply_extracted(user_id, extracted, update)
+        return
+
+    late = {k: v for k, v in extracted.items() if k not in applied}
+    if any(k in AMENITY_LABELS or k == "additional_features" for k in late):
+        # امکانات با هم در additional_features خلاصه می‌شوند؛ همه را دوباره بفرست
+        late.update({
+            k: v for k, v in extracted.items()
+            if k in AMENITY_LABELS or k == "additional_features"
+        })
+    if late:
+        merge_state(user_id, _prepare_extracted(user_id, late))
+        logger.info(f"Merged late stream fields for user {user_id}: {list(late.keys())}")
+
+
+def _fold_amenities(extracted: Dict) -> Dict:
+    """خلاصه کردن فیلدهای امکانات (has_pool, view_type, ...) در additional_features"""
+    labels = []
+    for key, label in AMENITY_LABELS.items():
+        if key not in extracted:
+            continue
+        value = extracted.pop(key)
+        if value is True:
+            labels.append(label)
+        elif isinstance(value, str) and value.strip():
+            labels.append(f"{label}: {value.strip()}")
+
+    if labels:
+        existing = extracted.get("additional_features")
+        if isinstance(existing, str) and existing.strip():
+            labels.append(existing.strip())
+        extracted["additional_features"] = "، ".join(labels)
+
+    return extracted
+
+
 def _normalize_extracted_data(extracted: Dict) -> Dict:
     """نرمال‌سازی داده‌های استخراج شده"""
     
+    # امکانات جداگانه -> additional_features
+    extracted = _fold_amenities(extracted)
+    
     # نرمال‌سازی شماره تلفن
     if extracted.get("owner_phone"):
         extracted["owner_phone"] = normalize_iran_phone(extracted["owner_phone"])
@@ -477,10 +635,10 @@ async def _handle_confirmation_mode(user_id: int, text: str, update: Update):
 
     # ✅ تایید نهایی
     if clean_text in {"تایید", "تأیید", "بله", "اره", "آره", "ok", "yes"}:
-        state = get_state(user_id) or {}
+        state = {**get_state(user_id)}
         state.setdefault("user_telegram_id", user_id)
 
-        confirmation_token = state.get("confirmation_token")
+        confirmation_token = get_confirmation_token(user_id)
         if not confirmation_token:
             await update.message.reply_text(
                 "❌ خطای سیستمی: توکن تایید یافت نشد.\n"
@@ -0,0 +1,77 @@
+# bot_processor_core/user_lock.py
+"""
+قفل جداگانه برای هر کاربر
+- پیام‌های یک کاربر یکی‌یکی و به ترتیب ورود پردازش می‌شوند (asyncio.Lock صف FIFO دارد)
+- کاربران مختلف کاملاً موازی اجرا می‌شوند
+- تعداد پیام‌های منتظر هر کاربر محدود است
+- قفل کاربری که پیام در جریان ندارد بلافاصله حذف می‌شود (registry رشد نمی‌کند)
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# حداکثر پیام منتظر هر کاربر (علاوه بر پیامی که در حال پردازش است)
+USER_MAX_PENDING_UPDATES = int(os.getenv("USER_MAX_PENDING_UPDATES", "5"))
+
+
+class UserBusy(Exception):
+    """صف پیام‌های این کاربر پر است"""
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # در حال اجرا + منتظر
+
+
+class UserLocks:
+    def __init__(self, max_pending: int = USER_MAX_PENDING_UPDATES):
+        self.max_pending = max_pending
+        self._entries: Dict[int, _Entry] = {}
+        self.contended = 0
+        self.rejected = 0
+        self.peak_users = 0
+
+    @asynccontextmanager
+    async def hold(self, user_id: int):
+        """
+        اجرای بخش بحرانی برای user_id
+        Raises: UserBusy اگر max_pending پیام دیگر منتظر باشند
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            entry = self._entries[user_id] = _Entry()
+            self.peak_users = max(self.peak_users, len(self._entries))
+        elif entry.users > self.max_pending:
+            self.rejected += 1
+            raise UserBusy()
+        elif entry.users:
+            self.contended += 1
+
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if entry.users == 0 and self._entries.get(user_id) is entry:
+                del self._entries[user_id]
+
+    def stats(self) -> Dict:
+        return {
+            "active_users": len(self._entries),
+            "waiting": sum(max(e.users - 1, 0) for e in self._entries.values()),
+            "peak_users": self.peak_users,
+            "contended": self.contended,
+            "rejected": self.rejected,
+        }
+
+
+user_locks = UserLocks()
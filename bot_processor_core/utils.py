@@ -1,10 +1,13 @@
 # bot_processor_core/utils.py
 """توابع کمکی پردازشگر"""
 
+import logging
 from typing import Optional
 from telegram import ReplyKeyboardMarkup
 from .constants import KEYBOARD_OPTIONS, BUTTON_VALUE_MAP
 
+logger = logging.getLogger(__name__)
+
 
 def normalize_button_input(text: str):
     """تبدیل متن دکمه به مقدار واقعی"""
@@ -28,16 +31,125 @@ def get_reply_keyboard(field: str) -> Optional[ReplyKeyboardMarkup]:
     return None
 
 
+def persian_text_to_number(text: str) -> Optional[float]:
+    """
+    تبدیل متن فارسی قیمت به عدد
+    مثال: "چهار میلیارد و دویست میلیون تومان" -> 4,200,000,000
+    """
+    if not text:
+        return None
+
+    original_text = text
+    text = text.strip().lower()
+
+    # اعداد فارسی به انگلیسی
+    persian_digits = '۰۱۲۳۴۵۶۷۸۹'
+    english_digits = '0123456789'
+    for p, e in zip(persian_digits, english_digits):
+        text = text.replace(p, e)
+
+    # حذف "تومان" و "ریال" و کاراکترهای اضافی
+    text = text.replace('تومان', '').replace('ریال', '').replace('تومن', '')
+    text = text.replace('،', '').replace(',', '').strip()
+
+    # اگر عدد مستقیم باشد
+    clean = text.replace(' ', '')
+    try:
+        return float(clean)
+    except ValueError:
+        pass
+
+    # === نرمال‌سازی کلمات ===
+    # اصلاح غلط‌های املایی رایج
+    text = text.replace('میلیادو', 'میلیارد و')
+    text = text.replace('میلیادی', 'میلیاردی')
+    text = text.replace('ملیارد', 'میلیارد')
+    text = text.replace('ملیون', 'میلیون')
+    text = text.replace('میلیونو', 'میلیون و')
+    text = text.replace('هزارو', 'هزار و')
+    
+    # کلمات عددی فارسی
+    word_numbers = {
+        'صفر': 0, 'یک': 1, 'یه': 1, 'دو': 2, 'سه': 3, 'چهار': 4,
+        'پنج': 5, 'شش': 6, 'شیش': 6, 'هفت': 7, 'هشت': 8, 'نه': 9,
+        'ده': 10, 'یازده': 11, 'دوازده': 12, 'سیزده': 13,
+        'چهارده': 14, 'پانزده': 15, 'پونزده': 15, 'شانزده': 16, 
+        'هفده': 17, 'هجده': 18, 'هیجده': 18, 'نوزده': 19,
+        'بیست': 20, 'سی': 30, 'چهل': 40, 'پنجاه': 50,
+        'شصت': 60, 'هفتاد': 70, 'هشتاد': 80, 'نود': 90,
+        'صد': 100, 'یکصد': 100, 'دویست': 200, 'سیصد': 300,
+        'چهارصد': 400, 'پانصد': 500, 'پونصد': 500,
+        'ششصد': 600, 'هفتصد': 700, 'هشتصد': 800, 'نهصد': 900,
+    }
+
+    # ضرایب بزرگ
+    multipliers = {
+        'هزار': 1_000,
+        'میلیون': 1_000_000,
+        'میلیارد': 1_000_000_000,
+    }
+
+    # === الگوریتم پردازش ===
+    # جدا کردن با "و"
+    text = text.replace(' و ', ' ')
+    words = text.split()
+
+    total = 0
+    current_chunk = 0  # عدد فعلی قبل از ضریب
+    
+    i = 0
+    while i < len(words):
+        word = words[i].strip()
+        
+        if not word:
+            i += 1
+            continue
+        
+        # اگر عدد است
+        if word in word_numbers:
+            current_chunk += word_numbers[word]
+        
+        # اگر ضریب است
+        elif word in multipliers:
+            multiplier = multipliers[word]
+            
+            if current_chunk == 0:
+                current_chunk = 1
+            
+            # ضرب در ضریب و اضافه به total
+            total += current_chunk * multiplier
+            current_chunk = 0
+        
+        # اگر عدد انگلیسی است
+        else:
+            try:
+                num = float(word)
+                current_chunk += num
+            except ValueError:
+                pass
+        
+        i += 1
+
+    # اضافه کردن باقیمانده
+    total += current_chunk
+
+    if total > 0:
+        logger.info(f"💰 persian_text_to_number: '{original_text}' -> {total:,.0f}")
+        return float(total)
+    
+    return None
+
 def normalize_transaction_type(text: str) -> Optional[str]:
     """نرمال‌سازی نوع معامله"""
     text = text.lower().strip()
     
+    # پیش‌فروش باید قبل از فروش چک شود (شامل کلمه «فروش» است)
+    if any(k in text for k in ["پیش", "presale", "پیش‌فروش", "پیشفروش"]):
+        return "پیش‌فروش"
     if any(k in text for k in ["فروش", "خرید", "sale"]):
         return "فروش"
     if any(k in text for k in ["رهن", "اجاره", "rent"]):
         return "رهن و اجاره"
-    if any(k in text for k in ["پیش", "presale", "پیش‌فروش", "پیشفروش"]):
-        return "پیش‌فروش"
     
     return None
 
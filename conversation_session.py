@@ -0,0 +1,107 @@
+# conversation_session.py
+"""
+مدل session گفتگوی ثبت ملک
+- fields: فقط فیلدهای آگهی (همان چیزی که به create_property می‌رود)
+- meta: وضعیت داخلی گفتگو با چیدمان ثابت (__slots__)
+- snapshot: نمای فقط‌خواندنی از fields بدون کپی؛ اولین نوشتن بعد از snapshot کپی می‌کند (copy-on-write)
+"""
+
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+# کلیدهای state تخت قدیمی -> meta (برای خواندن state های ذخیره‌شده نسخه قبل)
+_LEGACY_META_KEYS = {
+    "_pending_field": "pending_field",
+    "_editing_field": "editing_field",
+    "_confirmation_mode": "confirmation_mode",
+    "confirmation_token": "confirmation_token",
+    "waiting_for": "waiting_for",
+}
+
+EMPTY_FIELDS: Mapping[str, Any] = MappingProxyType({})
+
+
+class SessionMeta:
+    __slots__ = ("pending_field", "editing_field", "confirmation_mode", "confirmation_token", "waiting_for")
+
+    def __init__(self):
+        self.pending_field: Optional[str] = None
+        self.editing_field: Optional[str] = None
+        self.confirmation_mode: bool = False
+        self.confirmation_token: Optional[str] = None
+        self.waiting_for: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> "SessionMeta":
+        meta = cls()
+        for name in cls.__slots__:
+            if name in data:
+                setattr(meta, name, data[name])
+        return meta
+
+
+class ConversationSession:
+    __slots__ = ("user_id", "meta", "_fields", "_shared")
+
+    def __init__(self, user_id: int, fields: Optional[Dict] = None, meta: Optional[SessionMeta] = None):
+        self.user_id = user_id
+        self.meta = meta or SessionMeta()
+        self._fields: Dict[str, Any] = fields if fields is not None else {}
+        self._shared = False
+
+    # === فیلدهای آگهی ===
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._fields.get(key, default)
+
+    def _writable(self) -> Dict[str, Any]:
+        if self._shared:
+            self._fields = dict(self._fields)
+            self._shared = False
+        return self._fields
+
+    def set_field(self, key: str, value: Any):
+        self._writable()[key] = value
+
+    def update(self, new_data: Mapping):
+        """ادغام (مقادیر None نادیده گرفته می‌شوند)"""
+        fields = self._writable()
+        for key, value in new_data.items():
+            if value is not None:
+                fields[key] = value
+
+    def replace(self, fields: Mapping):
+        self._fields = dict(fields)
+        self._shared = False
+
+    def snapshot(self) -> Mapping[str, Any]:
+        """نمای فقط‌خواندنی O(1)؛ با تغییرات بعدی session عوض نمی‌شود"""
+        self._shared = True
+        return MappingProxyType(self._fields)
+
+    # === ذخیره‌سازی ===
+
+    def to_dict(self) -> Dict:
+        return {"fields": self._fields, "meta": self.meta.to_dict()}
+
+    @classmethod
+    def from_dict(cls, user_id: int, data: Mapping) -> "ConversationSession":
+        if "fields" in data and "meta" in data:
+            return cls(user_id, dict(data["fields"]), SessionMeta.from_dict(data["meta"]))
+
+        # state تخت قدیمی
+        fields, meta = {}, SessionMeta()
+        for key, value in data.items():
+            if key in _LEGACY_META_KEYS:
+                setattr(meta, _LEGACY_META_KEYS[key], value)
+            elif key == "data" and isinstance(value, dict):
+                fields.update(value)
+            elif not key.startswith("_"):
+                fields[key] = value
+        return cls(user_id, fields, meta)
+
+    def __repr__(self) -> str:
+        return f"ConversationSession(user_id={self.user_id}, fields={self._fields!r}, meta={self.meta.to_dict()!r})"
@@ -1,115 +1,384 @@
 # conversation_state.py
 # ✅ COMPLETE VERSION - با set_state و سایر توابع
 
+import asyncio
+import heapq
+import json
 import logging
-from typing import Dict, Optional, Any
-from datetime import datetime, timedelta
+import os
+import time
+from typing import Dict, List, Mapping, Optional, Any, Set, Tuple
 from uuid import uuid4
 
+from conversation_session import EMPTY_FIELDS, ConversationSession
+from services.cache import LRUCache
+from services.state_store import MemoryStateStore, build_state_store, dump_state
+from services.state_snapshot import read_snapshot, write_snapshot
+
 logger = logging.getLogger(__name__)
 
-_states: Dict[int, Dict] = {}
-_state_timestamps: Dict[int, datetime] = {}
+# کش داغ: همه خواندن/نوشتن‌ها روی این dict انجام می‌شود
+_states: Dict[int, ConversationSession] = {}
+# زمان انقضای هر کاربر (time.monotonic)
+_expires_at: Dict[int, float] = {}
+# min-heap انقضا با حذف تنبل: ورودی‌هایی که با _expires_at نمی‌خوانند کهنه‌اند و رد می‌شوند
+_expiry_heap: List[Tuple[float, int]] = []
+_evicted_total = 0
 
 STATE_TTL_MINUTES = 60
+STATE_SWEEP_INTERVAL_SECONDS = float(os.getenv("STATE_SWEEP_INTERVAL_SECONDS", "60"))
+
+# === ذخیره‌سازی ماندگار (write-behind) ===
+# STATE_BACKEND: memory | sqlite | redis - تغییرات هر STATE_FLUSH_INTERVAL_SECONDS یکجا نوشته می‌شوند
+STATE_FLUSH_INTERVAL_SECONDS = float(os.getenv("STATE_FLUSH_INTERVAL_SECONDS", "1"))
+# کاربرانی که در store نبودند تا این مدت دوباره از store خوانده نمی‌شوند
+STATE_MISS_TTL_SECONDS = float(os.getenv("STATE_MISS_TTL_SECONDS", "30"))
+
+state_store = build_state_store()
+_persistent = not isinstance(state_store, MemoryStateStore)
+_dirty: Set[int] = set()
+_deleted: Set[int] = set()
+_absent = LRUCache(10000, STATE_MISS_TTL_SECONDS)
+_store_loads = 0
+_store_errors = 0
+
+# === snapshot باینری برای restart گرم (خالی = غیرفعال) ===
+STATE_SNAPSHOT_PATH = os.getenv("STATE_SNAPSHOT_PATH", "conversation_state.snapshot")
+STATE_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("STATE_SNAPSHOT_INTERVAL_SECONDS", "30"))
+
+# payload سریال‌شده هر session؛ فقط session های تغییرکرده دوباره سریال می‌شوند
+_snapshot_payloads: Dict[int, bytes] = {}
+_snapshot_dirty: Set[int] = set()
+_snapshot_stats = {"snapshots": 0, "restored": 0, "bytes": 0, "errors": 0}
+
+
+def _touch(user_id: int):
+    """تمدید TTL کاربر و علامت‌گذاری برای نوشتن - O(log n)"""
+    _set_expiry(user_id, time.monotonic() + STATE_TTL_MINUTES * 60)
+    if STATE_SNAPSHOT_PATH:
+        _snapshot_dirty.add(user_id)
+    if _persistent:
+        _dirty.add(user_id)
+        _deleted.discard(user_id)
+
+
+def _set_expiry(user_id: int, expires_at: float):
+    _expires_at[user_id] = expires_at
+    heapq.heappush(_expiry_heap, (expires_at, user_id))
+
+    # ورودی‌های کهنه زیاد شدند: بازسازی heap
+    if len(_expiry_heap) > 4 * len(_expires_at) + 64:
+        _expiry_heap[:] = [(exp, uid) for uid, exp in _expires_at.items()]
+        heapq.heapify(_expiry_heap)
+
+
+def _evict(user_id: int):
+    global _evicted_total
+    _states.pop(user_id, None)
+    _expires_at.pop(user_id, None)
+    if STATE_SNAPSHOT_PATH:
+        _snapshot_dirty.add(user_id)
+    _evicted_total += 1
+    logger.info(f"[STATE EXPIRED] user_id={user_id}")
+
+
+def _expire_if_stale(user_id: int):
+    """بررسی انقضای همین کاربر (بین دو sweep) - O(1)"""
+    expires_at = _expires_at.get(user_id)
+    if expires_at is not None and expires_at <= time.monotonic():
+        _evict(user_id)
+
+
+def _needs_load(user_id: int) -> bool:
+    """آیا باید store را خواند؟ (ماندگار، نه در کش داغ، نه حذف‌شده، نه اخیراً غایب)"""
+    return (
+        _persistent
+        and user_id not in _states
+        and user_id not in _deleted
+        and not _absent.get(str(user_id))
+    )
+
+
+def _read_store(user_id: int) -> Optional[Tuple[Dict, float]]:
+    global _store_errors
+    try:
+        return state_store.load(user_id)
+    except Exception as e:
+        _store_errors += 1
+        logger.error(f"State store read failed for user {user_id}: {e}")
+        return None
 
-def _cleanup_old_states():
-    """پاکسازی state های منقضی شده"""
-    now = datetime.now()
-    expired_users = []
-
-    for user_id, timestamp in _state_timestamps.items():
-        if now - timestamp > timedelta(minutes=STATE_TTL_MINUTES):
-            expired_users.append(user_id)
-
-    for user_id in expired_users:
-        if user_id in _states:
-            del _states[user_id]
-        if user_id in _state_timestamps:
-            del _state_timestamps[user_id]
-        logger.info(f"[STATE EXPIRED] user_id={user_id}")
-
-
-def get_state(user_id: int) -> Dict:
-    """دریافت state کاربر"""
-    _cleanup_old_states()
-    return _states.get(user_id, {})
 
+def _apply_loaded(user_id: int, record: Optional[Tuple[Dict, float]]) -> Optional[ConversationSession]:
+    """قرار دادن رکورد خوانده‌شده در کش داغ؛ اگر در این فاصله session ساخته شده، همان معتبر است"""
+    global _store_loads
+    if user_id in _states:
+        return _states[user_id]
+    if record is None:
+        _absent.set(str(user_id), True)
+        return None
 
-def set_state(user_id: int, new_state: Dict) -> Dict:
+    data, expires_at = record
+    _store_loads += 1
+    session = _states[user_id] = ConversationSession.from_dict(user_id, data)
+    _set_expiry(user_id, time.monotonic() + (expires_at - time.time()))
+    logger.info(f"[STATE RESTORED] user_id={user_id} from {state_store.name}")
+    return session
+
+
+async def load_state(user_id: int):
+    """
+    گرم کردن کش داغ برای کاربر قبل از پردازش آپدیت
+    خواندن store (مثلاً redis) در thread جدا انجام می‌شود تا event loop معطل شبکه/دیسک نشود.
+    """
+    _expire_if_stale(user_id)
+    if _needs_load(user_id):
+        _apply_loaded(user_id, await asyncio.to_thread(_read_store, user_id))
+
+
+def _hot(user_id: int) -> Optional[ConversationSession]:
+    """session کاربر از کش داغ (یا store)؛ None اگر وجود ندارد"""
+    _expire_if_stale(user_id)
+    session = _states.get(user_id)
+    if session is None and _needs_load(user_id):
+        # مسیرهای ورودی load_state را صدا می‌زنند؛ این فقط تور ایمنی است
+        logger.warning(f"State for user {user_id} read on the event loop; call load_state() first")
+        session = _apply_loaded(user_id, _read_store(user_id))
+    return session
+
+
+def _ensure(user_id: int) -> ConversationSession:
+    """session کاربر؛ اگر نبود ساخته می‌شود (بدون بازنویسی نسخه ماندگار)"""
+    session = _hot(user_id)
+    if session is None:
+        session = _states[user_id] = ConversationSession(user_id)
+    return session
+
+
+def _take_pending() -> Tuple[List[Tuple[int, str, float]], List[int]]:
+    """برداشتن تغییرات در event loop (سریال‌سازی قبل از رفتن به thread)"""
+    wall_offset = time.time() - time.monotonic()
+    records = [
+        (user_id, dump_state(_states[user_id].to_dict()), _expires_at[user_id] + wall_offset)
+        for user_id in _dirty
+        if user_id in _states and user_id in _expires_at
+    ]
+    deleted = list(_deleted)
+    _dirty.clear()
+    _deleted.clear()
+    return records, deleted
+
+
+async def flush_states():
+    """نوشتن دسته‌ای تغییرات در store (خارج از event loop)"""
+    global _store_errors
+    if not _persistent or not (_dirty or _deleted):
+        return
+
+    records, deleted = _take_pending()
+    try:
+        if deleted:
+            await asyncio.to_thread(state_store.delete_many, deleted)
+        if records:
+            await asyncio.to_thread(state_store.save_many, records)
+    except Exception as e:
+        _store_errors += 1
+        logger.error(f"State store write failed ({len(records)} states): {e}")
+        # تلاش دوباره در flush بعدی (مگر در این فاصله تغییر کرده باشند)
+        for user_id in deleted:
+            if user_id not in _states:
+                _deleted.add(user_id)
+        for user_id, _, _ in records:
+            if user_id not in _deleted:
+                _dirty.add(user_id)
+
+
+async def run_state_flusher(interval: float = STATE_FLUSH_INTERVAL_SECONDS):
+    """task پس‌زمینه write-behind"""
+    while True:
+        await asyncio.sleep(interval)
+        await flush_states()
+
+
+async def close_state_store():
+    """نوشتن آخرین تغییرات و بستن store هنگام خروج"""
+    await flush_states()
+    state_store.close()
+
+
+def _collect_snapshot() -> List[Tuple[int, float, bytes]]:
+    """در event loop: سریال‌سازی فقط session های تغییرکرده از snapshot قبلی"""
+    for user_id in _snapshot_dirty:
+        session = _states.get(user_id)
+        if session is None:
+            _snapshot_payloads.pop(user_id, None)
+        else:
+            _snapshot_payloads[user_id] = dump_state(session.to_dict()).encode("utf-8")
+    _snapshot_dirty.clear()
+
+    wall_offset = time.time() - time.monotonic()
+    return [
+        (user_id, _expires_at[user_id] + wall_offset, payload)
+        for user_id, payload in _snapshot_payloads.items()
+        if user_id in _expires_at
+    ]
+
+
+async def save_state_snapshot():
+    """نوشتن snapshot (خارج از event loop)؛ اگر از snapshot قبلی تغییری نبوده کاری نمی‌کند"""
+    if not STATE_SNAPSHOT_PATH or not _snapshot_dirty:
+        return
+
+    records = _collect_snapshot()
+    try:
+        size = await asyncio.to_thread(write_snapshot, STATE_SNAPSHOT_PATH, records)
+    except Exception as e:
+        _snapshot_stats["errors"] += 1
+        logger.error(f"State snapshot failed: {e}")
+        _snapshot_dirty.update(user_id for user_id, _, _ in records)
+        return
+
+    _snapshot_stats["snapshots"] += 1
+    _snapshot_stats["bytes"] = size
+    logger.debug(f"💾 State snapshot: {len(records)} session(s), {size} bytes")
+
+
+async def run_state_snapshotter(interval: float = STATE_SNAPSHOT_INTERVAL_SECONDS):
+    """task پس‌زمینه snapshot دوره‌ای"""
+    while True:
+        await asyncio.sleep(interval)
+        await save_state_snapshot()
+
+
+def restore_state_snapshot() -> int:
+    """
+    بازیابی session ها از snapshot هنگام شروع ربات
+    session های منقضی‌شده رد می‌شوند و TTL باقی‌مانده بقیه حفظ می‌شود.
+    """
+    if not STATE_SNAPSHOT_PATH:
+        return 0
+
+    now_wall, now_mono = time.time(), time.monotonic()
+    restored = 0
+    try:
+        for user_id, expires_at, payload in read_snapshot(STATE_SNAPSHOT_PATH):
+            if expires_at <= now_wall or user_id in _states:
+                continue
+            _states[user_id] = ConversationSession.from_dict(user_id, json.loads(payload))
+            _set_expiry(user_id, now_mono + (expires_at - now_wall))
+            _snapshot_payloads[user_id] = payload
+            restored += 1
+    except Exception as e:
+        _snapshot_stats["errors"] += 1
+        logger.error(f"State snapshot restore failed: {e}")
+
+    _snapshot_stats["restored"] += restored
+    if restored:
+        logger.info(f"♻️ Restored {restored} conversation(s) from {STATE_SNAPSHOT_PATH}")
+    return restored
+
+
+def sweep_expired_states() -> int:
+    """حذف state های منقضی شده از سر heap؛ فقط به اندازه موارد منقضی کار می‌کند"""
+    now = time.monotonic()
+    evicted = 0
+    while _expiry_heap and _expiry_heap[0][0] <= now:
+        expires_at, user_id = heapq.heappop(_expiry_heap)
+        if _expires_at.get(user_id) == expires_at:
+            _evict(user_id)
+            evicted += 1
+    return evicted
+
+
+async def run_state_sweeper(interval: float = STATE_SWEEP_INTERVAL_SECONDS):
+    """task پس‌زمینه برای پاکسازی دوره‌ای state ها"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            evicted = sweep_expired_states()
+            if evicted:
+                logger.info(f"🧹 State sweeper evicted {evicted} expired session(s)")
+        except Exception as e:
+            logger.error(f"State sweeper failed: {e}")
+
+
+def get_session(user_id: int) -> Optional[ConversationSession]:
+    """session کاربر (فقط برای خواندن meta؛ تغییرات از طریق توابع همین ماژول)"""
+    return _hot(user_id)
+
+
+def get_state(user_id: int) -> Mapping[str, Any]:
+    """فیلدهای آگهی کاربر (snapshot فقط‌خواندنی، بدون کلیدهای داخلی)"""
+    session = _hot(user_id)
+    return session.snapshot() if session is not None else EMPTY_FIELDS
+
+
+def set_state(user_id: int, new_state: Dict) -> Mapping[str, Any]:
     """تنظیم کامل state کاربر"""
-    _cleanup_old_states()
-    _states[user_id] = new_state
-    _state_timestamps[user_id] = datetime.now()
-    return _states[user_id]
+    session = _states[user_id] = ConversationSession.from_dict(user_id, new_state)
+    _touch(user_id)
+    return session.snapshot()
 
 
-def merge_state(user_id: int, new_data: Dict) -> Dict:
+def merge_state(user_id: int, new_data: Dict) -> Mapping[str, Any]:
     """ادغام داده جدید با state موجود"""
-    _cleanup_old_states()
-
-    if user_id not in _states:
-        _states[user_id] = {}
-
-    _state_timestamps[user_id] = datetime.now()
-
-    for key, value in new_data.items():
-        if value is not None:
-            _states[user_id][key] = value
-
-    return _states[user_id]
+    session = _ensure(user_id)
+    session.update(new_data)
+    _touch(user_id)
+    return session.snapshot()
 
 
 def clear_state(user_id: int):
     """پاک کردن state کاربر"""
     if user_id in _states:
         del _states[user_id]
-    if user_id in _state_timestamps:
-        del _state_timestamps[user_id]
+    # ورودی heap کهنه می‌شود و در sweep رد می‌شود
+    _expires_at.pop(user_id, None)
+    if STATE_SNAPSHOT_PATH:
+        _snapshot_dirty.add(user_id)
+    if _persistent:
+        _dirty.discard(user_id)
+        _deleted.add(user_id)
     logger.info(f"[STATE CLEARED] user_id={user_id}")
 
 
 # ✅ Confirmation Mode
 def set_confirmation_mode(user_id: int, enabled: bool):
-    if user_id not in _states:
-        _states[user_id] = {}
+    meta = _ensure(user_id).meta
 
     # 🔑 Idempotency Token – فقط یک بار ساخته می‌شود
-    if enabled and "confirmation_token" not in _states[user_id]:
-        _states[user_id]["confirmation_token"] = uuid4().hex
+    if enabled and not meta.confirmation_token:
+        meta.confirmation_token = uuid4().hex
 
-    _states[user_id]["_confirmation_mode"] = enabled
-    _state_timestamps[user_id] = datetime.now()
+    meta.confirmation_mode = enabled
+    _touch(user_id)
 
 
+def is_confirmation_mode(user_id: int) -> bool:
+    session = _hot(user_id)
+    return session is not None and session.meta.confirmation_mode
 
 
-def is_confirmation_mode(user_id: int) -> bool:
-    if user_id not in _states:
-        return False
-    return _states[user_id].get("_confirmation_mode", False)
+def get_confirmation_token(user_id: int) -> Optional[str]:
+    session = _hot(user_id)
+    return session.meta.confirmation_token if session is not None else None
 
 
 # ✅ Editing Field
 def set_editing_field(user_id: int, field: Optional[str]):
-    if user_id not in _states:
-        _states[user_id] = {}
-    _states[user_id]["_editing_field"] = field
-    _state_timestamps[user_id] = datetime.now()
+    _ensure(user_id).meta.editing_field = field
+    _touch(user_id)
 
 
 def get_editing_field(user_id: int) -> Optional[str]:
-    if user_id not in _states:
-        return None
-    return _states[user_id].get("_editing_field")
+    session = _hot(user_id)
+    return session.meta.editing_field if session is not None else None
 
 
 # ✅ Pending Field (برای Rule Engine)
 def set_pending_field(user_id: int, field_name: Optional[str]):
-    if user_id not in _states:
-        _states[user_id] = {}
-    _states[user_id]["_pending_field"] = field_name
-    _state_timestamps[user_id] = datetime.now()
+    _ensure(user_id).meta.pending_field = field_name
+    _touch(user_id)
 
     if field_name:
         logger.info(f"⏳ Set pending field: {field_name} for user {user_id}")
@@ -118,57 +387,53 @@ def set_pending_field(user_id: int, field_name: Optional[str]):
 
 
 def get_pending_field(user_id: int) -> Optional[str]:
-    if user_id not in _states:
-        return None
-    return _states[user_id].get("_pending_field")
+    session = _hot(user_id)
+    return session.meta.pending_field if session is not None else None
 
 
 # ✅ Waiting For Field
 def set_waiting_for(user_id: int, field: Optional[str]):
     """تنظیم فیلدی که منتظر پاسخ آن هستیم"""
-    if user_id not in _states:
-        _states[user_id] = {}
-    _states[user_id]["waiting_for"] = field
-    _state_timestamps[user_id] = datetime.now()
+    _ensure(user_id).meta.waiting_for = field
+    _touch(user_id)
 
 
 def get_waiting_for(user_id: int) -> Optional[str]:
     """دریافت فیلدی که منتظر پاسخ آن هستیم"""
-    if user_id not in _states:
-        return None
-    return _states[user_id].get("waiting_for")
+    session = _hot(user_id)
+    return session.meta.waiting_for if session is not None else None
 
 
-# ✅ Data Management
-def get_data(user_id: int) -> Dict:
+# ✅ Data Management (همان فیلدهای آگهی state)
+def get_data(user_id: int) -> Mapping[str, Any]:
     """دریافت داده‌های ملک کاربر"""
-    state = get_state(user_id)
-    return state.get("data", {})
+    return get_state(user_id)
 
 
 def set_data(user_id: int, data: Dict):
     """تنظیم داده‌های ملک کاربر"""
-    if user_id not in _states:
-        _states[user_id] = {}
-    _states[user_id]["data"] = data
-    _state_timestamps[user_id] = datetime.now()
+    _ensure(user_id).replace(data)
+    _touch(user_id)
 
 
 def update_data(user_id: int, field: str, value: Any):
     """به‌روزرسانی یک فیلد خاص"""
-    if user_id not in _states:
-        _states[user_id] = {"data": {}}
-    if "data" not in _states[user_id]:
-        _states[user_id]["data"] = {}
-    _states[user_id]["data"][field] = value
-    _state_timestamps[user_id] = datetime.now()
+    _ensure(user_id).set_field(field, value)
+    _touch(user_id)
 
 
 def get_state_statistics() -> Dict:
     """آمار state ها"""
-    _cleanup_old_states()
+    sweep_expired_states()
     return {
         "total_users": len(_states),
         "ttl_minutes": STATE_TTL_MINUTES,
-        "active_users": list(_states.keys())
+        "active_users": list(_states.keys()),
+        "expired_evictions": _evicted_total,
+        "expiry_heap_size": len(_expiry_heap),
+        "store_backend": state_store.name,
+        "store_loads": _store_loads,
+        "store_errors": _store_errors,
+        "pending_writes": len(_dirty) + len(_deleted),
+        "snapshot": dict(_snapshot_stats),
     }
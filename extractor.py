@@ -1,185 +1,549 @@
 # extractor.py - COMPLETE VERSION (FIXED)
 import os
+import re
 import json
+import asyncio
+import hashlib
 import logging
-from typing import Dict
-from openai import OpenAI
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
 
+from services.cache import LRUCache, SQLiteCache, TieredCache
+from services.circuit_breaker import CircuitOpenError
+from services.llm_router import build_router
+from services.prompt_builder import (
+    TokenMeter,
+    build_system_prompt,
+    build_user_prompt,
+    compress_text,
+    estimate_tokens,
+    split_segments,
+)
+from utils import normalize_price
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-# اتصال به AvalAI
-client = OpenAI(
-    api_key=os.getenv("AVALAIGPT_API_KEY"),
-    base_url="https://api.avalai.ir/v1",
-    timeout=15.0
+# محدودیت زمان هر درخواست و تعداد درخواست‌های هم‌زمان به LLM
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "15"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# providerهای LLM (پیش‌فرض AvalAI) با مسیریابی بر اساس تأخیر و hedge
+llm_router = build_router(LLM_TIMEOUT_SECONDS)
+
+_llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+# کش نتایج استخراج (حافظه + SQLite اختیاری)
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "1024"))
+EXTRACTION_CACHE_DB = os.getenv("EXTRACTION_CACHE_DB")  # خالی = فقط حافظه
+EXTRACTION_CACHE_TTL_SECONDS = float(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", "86400"))
+EXTRACTION_CACHE_DB_MAX_ITEMS = int(os.getenv("EXTRACTION_CACHE_DB_MAX_ITEMS", "20000"))
+
+extraction_cache = TieredCache(
+    "extraction",
+    LRUCache(EXTRACTION_CACHE_SIZE, EXTRACTION_CACHE_TTL_SECONDS),
+    SQLiteCache(EXTRACTION_CACHE_DB, EXTRACTION_CACHE_TTL_SECONDS, EXTRACTION_CACHE_DB_MAX_ITEMS)
+    if EXTRACTION_CACHE_DB else None,
 )
 
 # پرامپت اصلی استخراج اطلاعات ملک
-EXTRACTOR_SYSTEM_ROLE = "You are a Persian real estate data extractor. Extract data and return ONLY valid JSON."
-
-EXTRACTOR_PROMPT_TEMPLATE = """Extract real estate info from Persian text:
-"{text}"
-
-Return ONLY valid JSON with these fields (use null if not found):
-{{
-  "transaction_type": "فروش" or "رهن و اجاره" or "پیش‌فروش",
-  "property_type": "آپارتمان" or "ویلا" or "زمین" or "مغازه",
-  "usage_type": "مسکونی" or "تجاری" or "اداری",
-  "area": number (متراژ),
-  "bedroom_count": number (تعداد اتاق/خواب),
-  "total_floors": number (تعداد کل طبقات ساختمان),
-  "floor": number (واحد در طبقه چندم است),
-  "unit_count": number (هر طبقه چند واحد دارد),
-  "has_elevator": boolean (آسانسور),
-  "build_year": number (سال ساخت),
-  "price_total": number (قیمت کل یا رهن),
-  "rent": number (اجاره ماهیانه),
-  "deposit": number (ودیعه),
-  "neighborhood": "string" (محله),
-  "city": "string" (شهر),
-  "owner_name": "string" (نام مالک),
-  "owner_phone": "string" (شماره تلفن),
-  "has_parking": boolean,
-  "has_storage": boolean,
-  "additional_features": "string" (امکانات مثل: لابی، استخر، سونا، نگهبان)
-}}
-
-IMPORTANT: 
+EXTRACTOR_SYSTEM_ROLE = "You are a Persian real estate data extractor. Extract data and return ONLY a JSON object."
+
+# اسکیمای واحد استخراج (فیلدهای اصلی + امکانات)
+# همین جدول هم پرامپت و JSON Schema را می‌سازد و هم خروجی LLM را اعتبارسنجی می‌کند
+EXTRACTION_SCHEMA = {
+    "transaction_type": {"type": "string", "enum": ["فروش", "رهن و اجاره", "پیش‌فروش"]},
+    "property_type": {"type": "string", "enum": ["آپارتمان", "ویلا", "زمین", "مغازه"]},
+    "usage_type": {"type": "string", "enum": ["مسکونی", "تجاری", "اداری"]},
+    "area": {"type": "number", "description": "متراژ"},
+    "bedroom_count": {"type": "number", "description": "تعداد اتاق/خواب"},
+    "total_floors": {"type": "number", "description": "تعداد کل طبقات ساختمان"},
+    "floor": {"type": "number", "description": "واحد در طبقه چندم است"},
+    "unit_count": {"type": "number", "description": "هر طبقه چند واحد دارد"},
+    "has_elevator": {"type": "boolean", "description": "آسانسور"},
+    "build_year": {"type": "number", "description": "سال ساخت"},
+    "price_total": {"type": "number", "description": "قیمت کل یا رهن"},
+    "rent": {"type": "number", "description": "اجاره ماهیانه"},
+    "deposit": {"type": "number", "description": "ودیعه"},
+    "neighborhood": {"type": "string", "description": "محله"},
+    "city": {"type": "string", "description": "شهر"},
+    "owner_name": {"type": "string", "description": "نام مالک"},
+    "owner_phone": {"type": "string", "description": "شماره تلفن"},
+    "has_parking": {"type": "boolean"},
+    "has_storage": {"type": "boolean"},
+    # === امکانات ===
+    "has_lobby": {"type": "boolean", "description": "لابی"},
+    "has_pool": {"type": "boolean", "description": "استخر"},
+    "has_sauna": {"type": "boolean", "description": "سونا"},
+    "has_gym": {"type": "boolean", "description": "باشگاه"},
+    "has_guard": {"type": "boolean", "description": "نگهبان"},
+    "has_central_vacuum": {"type": "boolean", "description": "جاروی مرکزی"},
+    "has_balcony": {"type": "boolean", "description": "بالکن"},
+    "has_terrace": {"type": "boolean", "description": "تراس"},
+    "has_roof_garden": {"type": "boolean", "description": "روف گاردن"},
+    "has_video_intercom": {"type": "boolean", "description": "آیفون تصویری"},
+    "has_central_antenna": {"type": "boolean", "description": "آنتن مرکزی"},
+    "view_type": {"type": "string", "description": "ویو"},
+    "floor_material": {"type": "string", "description": "کف‌پوش"},
+    "cabinet_type": {"type": "string", "description": "کابینت"},
+    "cooling_system": {"type": "string", "description": "سرمایش"},
+    "heating_system": {"type": "string", "description": "گرمایش"},
+    "additional_features": {"type": "string", "description": "سایر امکاناتی که در فیلدهای بالا نیامده"},
+}
+
+# فیلدهای امکانات (همان خروجی قبلی extract_additional_features)
+AMENITY_FIELDS = [
+    "has_lobby", "has_pool", "has_sauna", "has_gym", "has_guard",
+    "has_central_vacuum", "has_balcony", "has_terrace", "has_roof_garden",
+    "has_video_intercom", "has_central_antenna", "view_type", "floor_material",
+    "cabinet_type", "cooling_system", "heating_system", "additional_features",
+]
+
+# حالت استریم: فیلدها در حین دریافت پاسخ LLM قابل استفاده می‌شوند
+LLM_STREAMING = os.getenv("LLM_STREAMING", "0") == "1"
+
+# structured output: "json_schema" (پیش‌فرض) یا "json_object" برای providerهایی که اسکیمای strict ندارند
+LLM_RESPONSE_FORMAT = os.getenv("LLM_RESPONSE_FORMAT", "json_schema")
+
+# بودجه توکن متن کاربر در هر فراخوانی؛ متن بلندتر فشرده و قطعه‌قطعه استخراج می‌شود
+LLM_TEXT_TOKEN_BUDGET = int(os.getenv("LLM_TEXT_TOKEN_BUDGET", "400"))
+LLM_MAX_SEGMENTS = int(os.getenv("LLM_MAX_SEGMENTS", "4"))
+
+EXTRACTOR_RULES = """Rules:
+- The user message lists "Known" fields (already filled) and "Wanted" fields; return ONLY the Wanted fields, use null if not mentioned.
+- Use Known values only as context (e.g. transaction type decides price_total vs rent/deposit).
 - "واحد در طبقه: 3" means unit_count=3 (3 units per floor)
 - "طبقه: 8" or "واحد در طبقه 8" means floor=8
-- "امکانات: سونا" means additional_features="سونا"
+- Amenities like "استخر" or "سونا" go to their has_* field; put other amenities in additional_features
 """
 
+# بخش ثابت پرامپت (نقش + مرجع همه فیلدها + قوانین)؛ بین همه فراخوانی‌ها مشترک است
+# و provider می‌تواند prefix آن را کش کند
+EXTRACTOR_SYSTEM_PROMPT = build_system_prompt(EXTRACTOR_SYSTEM_ROLE, EXTRACTION_SCHEMA, EXTRACTOR_RULES)
 
+token_meter = TokenMeter()
 
-# پرامپت استخراج امکانات اضافی
-FEATURES_SYSTEM_ROLE = "You are a Persian real estate feature extractor. Extract amenities and return ONLY valid JSON."
-
-FEATURES_PROMPT_TEMPLATE = """Extract amenities from this Persian text:
-"{text}"
-
-Return JSON with these fields (true/false or null if not mentioned):
-{{
-  "has_lobby": bool,
-  "has_pool": bool,
-  "has_sauna": bool,
-  "has_gym": bool,
-  "has_guard": bool,
-  "has_central_vacuum": bool,
-  "has_balcony": bool,
-  "has_terrace": bool,
-  "has_roof_garden": bool,
-  "has_video_intercom": bool,
-  "has_central_antenna": bool,
-  "view_type": "string or null",
-  "floor_material": "string or null",
-  "cabinet_type": "string or null",
-  "cooling_system": "string or null",
-  "heating_system": "string or null",
-  "additional_features": ["list of other features not in above fields"]
-}}"""
-
-# کاراکتر بک‌تیک برای حذف markdown
-BACKTICK = chr(96)
-TRIPLE_BACKTICK = BACKTICK * 3
-
-
-def clean_markdown_response(text: str) -> str:
-    """حذف markdown code blocks از پاسخ LLM"""
-    if text.startswith(TRIPLE_BACKTICK):
-        lines = text.split("\n")
-        clean_lines = []
-        for line in lines:
-            stripped = line.strip()
-            if not stripped.startswith(TRIPLE_BACKTICK) and stripped != "json":
-                clean_lines.append(line)
-        return "\n".join(clean_lines)
-    return text
-
-
-def extract_json(text: str) -> Dict:
-    """Extract property data from text using LLM"""
-    prompt = EXTRACTOR_PROMPT_TEMPLATE.replace("{text}", text[:500])
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": EXTRACTOR_SYSTEM_ROLE},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=600
+def _requested_fields(exclude_fields=()) -> List[str]:
+    return [name for name in EXTRACTION_SCHEMA if name not in exclude_fields]
+
+
+def _known_fields(known: Optional[Dict]) -> Dict:
+    """فقط فیلدهای اسکیمای پرشده به عنوان context فرستاده می‌شوند"""
+    if not known:
+        return {}
+    return {
+        k: v for k, v in known.items()
+        if k in EXTRACTION_SCHEMA and v is not None and v != ""
+    }
+
+
+def build_extractor_messages(text: str, exclude_fields=(), known: Optional[Dict] = None) -> List[Dict]:
+    """پیام‌های استخراج: system ثابت + user شامل state فعلی، فیلدهای لازم و متن"""
+    return [
+        {"role": "system", "content": EXTRACTOR_SYSTEM_PROMPT},
+        {"role": "user", "content": build_user_prompt(text, _requested_fields(exclude_fields), known)},
+    ]
+
+
+def _text_segments(text: str) -> List[str]:
+    """فشرده‌سازی متن و تقسیم آن در بودجه توکن (حداکثر LLM_MAX_SEGMENTS قطعه)"""
+    compact = compress_text(text) or text.strip()
+    budget = max(LLM_TEXT_TOKEN_BUDGET, -(-estimate_tokens(compact) // LLM_MAX_SEGMENTS))
+    segments = split_segments(compact, budget)
+    # بسته‌بندی حریصانه ممکن است یک قطعه اضافه بسازد؛ بودجه را کمی بزرگ‌تر کن
+    while len(segments) > LLM_MAX_SEGMENTS:
+        budget = int(budget * 1.1) + 1
+        segments = split_segments(compact, budget)
+    return segments
+
+
+def _merge_segments(results: List[Dict]) -> Dict:
+    """ادغام نتایج قطعه‌ها به ترتیب متن؛ اولین مقدار هر فیلد می‌ماند، امکانات متنی الحاق می‌شوند"""
+    merged: Dict = {}
+    for result in results:
+        for key, value in result.items():
+            if key not in merged:
+                merged[key] = value
+            elif key == "additional_features" and value not in merged[key]:
+                merged[key] = f"{merged[key]}، {value}"
+    return merged
+
+
+def build_response_format(exclude_fields=()) -> Dict:
+    """ساخت response_format برای JSON mode یا structured output"""
+    if LLM_RESPONSE_FORMAT != "json_schema":
+        return {"type": "json_object"}
+
+    properties = {}
+    for name in _requested_fields(exclude_fields):
+        spec = EXTRACTION_SCHEMA[name]
+        prop = {"type": [spec["type"], "null"]}
+        if "enum" in spec:
+            prop["enum"] = spec["enum"] + [None]
+        properties[name] = prop
+
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "property_extraction",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def _coerce_field(spec: Dict, value):
+    """تبدیل مقدار به نوع اسکیمای فیلد؛ مقدار نامعتبر -> None"""
+    if value is None:
+        return None
+
+    if spec["type"] == "number":
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, str):
+            value = normalize_price(value)
+            if value is None:
+                return None
+        if isinstance(value, (int, float)):
+            return int(value) if float(value).is_integer() else value
+        return None
+
+    if spec["type"] == "boolean":
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+            return value.strip().lower() == "true"
+        return None
+
+    if isinstance(value, list):
+        value = "، ".join(str(v) for v in value if v)
+    if not isinstance(value, (str, int, float)):
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    if "enum" in spec and value not in spec["enum"]:
+        return None
+    return value
+
+
+def validate_extraction(data, exclude_fields=()) -> Dict:
+    """اعتبارسنجی خروجی LLM با EXTRACTION_SCHEMA (فیلدهای ناشناخته و null حذف می‌شوند)"""
+    if not isinstance(data, dict):
+        return {}
+
+    cleaned = {}
+    for name in _requested_fields(exclude_fields):
+        value = _coerce_field(EXTRACTION_SCHEMA[name], data.get(name))
+        if value is not None:
+            cleaned[name] = value
+    return cleaned
+
+
+# نسخه پرامپت؛ با تغییر متن پرامپت، کلیدهای کش قبلی خودبه‌خود باطل می‌شوند
+PROMPT_VERSION = hashlib.sha256(
+    (
+        EXTRACTOR_SYSTEM_PROMPT + LLM_RESPONSE_FORMAT + json.dumps(EXTRACTION_SCHEMA, sort_keys=True)
+    ).encode("utf-8")
+).hexdigest()[:12]
+
+_DIGIT_FOLD = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩يك", "01234567890123456789یک")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_cache_text(text: str) -> str:
+    """نرمال‌سازی متن برای کلید کش (ارقام فارسی/عربی، ی/ک عربی، فاصله‌ها)"""
+    text = text.replace("\u200c", " ").translate(_DIGIT_FOLD)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def _cache_key(text: str, exclude_fields=(), known: Optional[Dict] = None) -> str:
+    excluded = ",".join(sorted(exclude_fields))
+    context = json.dumps(known or {}, ensure_ascii=False, sort_keys=True, default=str)
+    raw = f"{PROMPT_VERSION}\n{excluded}\n{context}\n{normalize_cache_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_extraction_cache_stats() -> Dict:
+    """آمار hit/miss کش استخراج"""
+    return extraction_cache.stats()
+
+
+def get_llm_router_stats() -> Dict:
+    """آمار تأخیر و سلامت providerهای LLM"""
+    return llm_router.stats()
+
+
+def llm_available() -> bool:
+    """آیا حداقل یک provider با مدار بسته داریم؟ (در غیر این صورت فراخوانی فوراً رد می‌شود)"""
+    return llm_router.available()
+
+
+def get_token_stats() -> Dict:
+    """مجموع توکن‌های مصرفی فراخوانی‌های استخراج"""
+    return token_meter.stats()
+
+
+async def _chat_completion(messages: List[Dict], max_tokens: int, response_format: Dict = None) -> str:
+    """
+    ارسال یک درخواست به LLM با محدودیت هم‌زمانی و timeout
+    لغو coroutine فراخواننده (CancelledError) درخواست را هم لغو می‌کند.
+    """
+    async with _llm_semaphore:
+        response = await asyncio.wait_for(
+            llm_router.chat(
+                messages=messages,
+                temperature=0.1,
+                max_tokens=max_tokens,
+                response_format=response_format or {"type": "json_object"}
+            ),
+            timeout=LLM_TIMEOUT_SECONDS
         )
+    token_meter.record(getattr(response, "usage", None), "extract")
+    return response.choices[0].message.content.strip()
+
+
+async def _extract_segment(text: str, exclude_fields, known: Dict) -> Dict:
+    """استخراج از یک قطعه متن (بدون کش)"""
+    result = await _chat_completion(
+        build_extractor_messages(text, exclude_fields, known),
+        max_tokens=700,
+        response_format=build_response_format(exclude_fields)
+    )
+    # JSON mode / structured output همیشه JSON معتبر برمی‌گرداند؛ انواع با اسکیما چک می‌شوند
+    return validate_extraction(json.loads(result), exclude_fields)
+
 
-        result = response.choices[0].message.content.strip()
-        result = clean_markdown_response(result)
+async def extract_json(text: str, exclude_fields=(), known: Optional[Dict] = None) -> Dict:
+    """
+    Extract property data from text using LLM
+    exclude_fields: فیلدهایی که قبلاً (مثلاً با استخراج محلی) پر شده‌اند و از LLM پرسیده نمی‌شوند
+    known: state فعلی کاربر؛ به عنوان context فرستاده می‌شود و فیلدهایش دوباره پرسیده نمی‌شوند
+    """
+    known = _known_fields(known)
+    exclude_fields = tuple(sorted(set(exclude_fields) | set(known)))
+    if not _requested_fields(exclude_fields):
+        return {}
+
+    cache_key = _cache_key(text, exclude_fields, known)
+    cached = await extraction_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Extraction cache hit: {list(cached.keys())}")
+        return dict(cached)
 
-        data = json.loads(result)
+    segments = _text_segments(text)
+    if len(segments) > 1:
+        logger.info(f"✂️ Long text ({estimate_tokens(text)} tokens est.) split into {len(segments)} segments")
 
-        # حذف مقادیر null
-        cleaned = {k: v for k, v in data.items() if v is not None}
+    try:
+        results = await asyncio.gather(
+            *(_extract_segment(segment, exclude_fields, known) for segment in segments)
+        )
+        cleaned = _merge_segments(results)
         logger.info(f"Extracted fields: {list(cleaned.keys())}")
-        return cleaned
+
+        if cleaned:
+            await extraction_cache.set(cache_key, cleaned)
+        return dict(cleaned)
 
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode failed: {e}")
         return {}
-    except TimeoutError:
-        logger.error("AvalAI request timed out after 15s")
+    except CircuitOpenError as e:
+        logger.warning(f"Extraction skipped: {e}")
+        return {}
+    except (TimeoutError, asyncio.TimeoutError):
+        logger.error(f"LLM request timed out after {LLM_TIMEOUT_SECONDS:.0f}s")
         return {}
     except Exception as e:
         logger.error(f"Extraction failed: {e}")
         return {}
 
 
-def extract_additional_features(text: str) -> Dict:
-    """Extract additional amenities from free text using LLM"""
-    
-    # اگر کاربر گفت ندارد
-    clean_text = text.strip().lower()
-    if clean_text in ["ندارد", "نداره", "خیر", "نه", "no", "none", "-"]:
-        return {}
+_NUMBER_CONTINUATION = frozenset(".eE+-0123456789")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class IncrementalJSONParser:
+    """
+    پارسر تدریجی یک آبجکت JSON تخت
+    هر بار که یک جفت key/value سطح اول کامل شد (و جداکننده بعدی آن رسید) آن را برمی‌گرداند.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self.done = False
+
+    def _skip_ws(self, i: int) -> int:
+        while i < len(self._buffer) and self._buffer[i] in " \t\r\n":
+            i += 1
+        return i
 
-    prompt = FEATURES_PROMPT_TEMPLATE.replace("{text}", text[:500])
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self._buffer += chunk
+        pairs = []
+
+        while not self.done:
+            i = self._skip_ws(self._pos)
+            if i >= len(self._buffer):
+                break
+
+            if not self._started:
+                if self._buffer[i] != "{":
+                    raise ValueError("JSON object expected")
+                self._started = True
+                self._pos = i + 1
+                continue
+
+            if self._buffer[i] == ",":
+                self._pos = i + 1
+                continue
+            if self._buffer[i] == "}":
+                self.done = True
+                break
+
+            try:
+                key, i = self._decoder.raw_decode(self._buffer, i)
+                i = self._skip_ws(i)
+                if i >= len(self._buffer):
+                    break
+                if self._buffer[i] != ":":
+                    raise ValueError("':' expected after key")
+                value, i = self._decoder.raw_decode(self._buffer, self._skip_ws(i + 1))
+            except json.JSONDecodeError:
+                break  # هنوز کامل نرسیده
+
+            # عدد ممکن است ناقص باشد ("85." یا "1e")؛ تا رسیدن جداکننده صبر کن
+            if i >= len(self._buffer):
+                break
+            if _is_number(value) and self._buffer[i] in _NUMBER_CONTINUATION:
+                break
+            i = self._skip_ws(i)
+            if i >= len(self._buffer):
+                break
+            if self._buffer[i] not in ",}":
+                raise ValueError("',' or '}' expected after value")
+
+            pairs.append((key, value))
+            self._pos = i
+
+        return pairs
+
+
+async def extract_json_stream(
+    text: str, exclude_fields=(), known: Optional[Dict] = None
+) -> AsyncIterator[Tuple[Dict, Set[str]]]:
+    """
+    نسخه استریم extract_json
+    هر بار که فیلد جدیدی کامل شد (fields, seen) را yield می‌کند:
+    fields = فیلدهای معتبر تا این لحظه، seen = کلیدهایی که LLM درباره‌شان تصمیم گرفته (حتی null)
+    """
+    known = _known_fields(known)
+    exclude_fields = tuple(sorted(set(exclude_fields) | set(known)))
+    requested = set(_requested_fields(exclude_fields))
+
+    segments = _text_segments(text) if requested else []
+    if len(segments) != 1:
+        # متن بلند (چند قطعه هم‌زمان) یا چیزی برای پرسیدن نیست: یک نتیجه نهایی
+        yield (await extract_json(text, exclude_fields, known) if segments else {}), requested
+        return
+
+    cache_key = _cache_key(text, exclude_fields, known)
+    cached = await extraction_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Extraction cache hit: {list(cached.keys())}")
+        yield dict(cached), requested
+        return
+
+    parser = IncrementalJSONParser()
+    fields: Dict = {}
+    seen: Set[str] = set()
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": FEATURES_SYSTEM_ROLE},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=500
-        )
+        # اسلات هم‌زمانی تا پایان مصرف استریم نگه داشته می‌شود تا تعداد استریم‌های باز محدود بماند
+        async with _llm_semaphore:
+            stream = await asyncio.wait_for(
+                llm_router.stream(
+                    messages=build_extractor_messages(segments[0], exclude_fields, known),
+                    temperature=0.1,
+                    max_tokens=700,
+                    response_format=build_response_format(exclude_fields),
+                    stream_options={"include_usage": True}
+                ),
+                timeout=LLM_TIMEOUT_SECONDS
+            )
+            try:
+                deadline = asyncio.get_running_loop().time() + LLM_TIMEOUT_SECONDS
 
-        result = response.choices[0].message.content.strip()
-        result = clean_markdown_response(result)
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout=max(remaining, 0.001))
+                    except StopAsyncIteration:
+                        break
 
-        data = json.loads(result)
+                    # آخرین chunk فقط usage دارد (choices خالی)
+                    if getattr(chunk, "usage", None):
+                        token_meter.record(chunk.usage, "extract-stream")
+                    if parser.done or not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
 
-        # حذف مقادیر null و false و خالی
-        cleaned = {}
-        for k, v in data.items():
-            if v is not None and v is not False:
-                if isinstance(v, list) and len(v) == 0:
-                    continue
-                if isinstance(v, str) and v == "":
-                    continue
-                cleaned[k] = v
+                    new_fields = {}
+                    for key, value in parser.feed(chunk.choices[0].delta.content):
+                        seen.add(key)
+                        new_fields.update(validate_extraction({key: value}, exclude_fields))
 
-        logger.info(f"Extracted additional features: {list(cleaned.keys())}")
-        return cleaned
+                    if new_fields:
+                        fields.update(new_fields)
+                        yield dict(fields), set(seen)
+            finally:
+                await stream.aclose()
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Features JSON decode failed: {e}")
-        return {"additional_features": [text.strip()]}
-    except TimeoutError:
-        logger.error("Features request timed out")
-        return {"additional_features": [text.strip()]}
+        logger.info(f"Extracted fields (stream): {list(fields.keys())}")
+        if parser.done and fields:
+            await extraction_cache.set(cache_key, fields)
+
+    except CircuitOpenError as e:
+        logger.warning(f"Streaming extraction skipped: {e}")
+    except (TimeoutError, asyncio.TimeoutError):
+        logger.error(f"LLM stream timed out after {LLM_TIMEOUT_SECONDS:.0f}s")
+    except ValueError as e:
+        logger.error(f"Stream JSON parse failed: {e}")
     except Exception as e:
-        logger.error(f"Features extraction failed: {e}")
-        return {"additional_features": [text.strip()]}
+        logger.error(f"Streaming extraction failed: {e}")
+
+    # در انتها همه فیلدهای درخواستی قطعی شده‌اند (حتی اگر استریم قطع شده باشد)
+    yield dict(fields), requested
+
+
+async def extract_additional_features(text: str) -> Dict:
+    """
+    Extract additional amenities from free text using LLM
+    (از همان فراخوانی واحد extract_json استفاده می‌کند)
+    """
+    
+    # اگر کاربر گفت ندارد
+    clean_text = text.strip().lower()
+    if clean_text in ["ندارد", "نداره", "خیر", "نه", "no", "none", "-"]:
+        return {}
+
+    extracted = await extract_json(text)
+    features = {
+        k: v for k, v in extracted.items()
+        if k in AMENITY_FIELDS and v is not False
+    }
+    logger.info(f"Extracted additional features: {list(features.keys())}")
+    return features
@@ -3,11 +3,9 @@ NocoDB Client - ماژول ارتباط با دیتابیس
 Facade Layer
 """
 
-import os
 import httpx
 from typing import Optional
 from datetime import datetime
-from dotenv import load_dotenv
 
 # ✅ سیستم اعتبار جدید (Core)
 from services.nocodb.credit import (
@@ -15,16 +13,14 @@ from services.nocodb.credit import (
     charge_credit,
     consume_credit,
 )
-
-load_dotenv()
+# ✅ کلاینت HTTP مشترک (اتصال‌ها بین درخواست‌ها حفظ می‌شوند)
+from services.nocodb.base import get_client
+from services.nocodb.users import get_user_by_telegram_id
 
 # ═══════════════════════════════════════════════════════════
 # تنظیمات اتصال
 # ═══════════════════════════════════════════════════════════
 
-NOCODB_URL = os.getenv("NOCODB_URL", "http://localhost:8080")
-NOCODB_TOKEN = os.getenv("NOCODB_TOKEN")
-
 TABLES = {
     "users": "mckjx30dsuf2nrf",         # ✅ جدید
     "properties": "m99miticq7yjzjs",    # ✅ جدید
@@ -36,15 +32,12 @@ TABLES = {
 
 # ═══════════════════════════════════════════════════════════
 
-def _headers():
-    return {"xc-token": NOCODB_TOKEN}
-
-
 def _table_url(table_name: str) -> str:
+    """مسیر نسبی به base_url کلاینت مشترک (.../api/v2)"""
     table_id = TABLES.get(table_name)
     if not table_id:
         raise ValueError(f"Table '{table_name}' not found")
-    return f"{NOCODB_URL}/api/v2/tables/{table_id}/records"
+    return f"/tables/{table_id}/records"
 
 
 # ═══════════════════════════════════════════════════════════
@@ -52,16 +45,11 @@ def _table_url(table_name: str) -> str:
 # ═══════════════════════════════════════════════════════════
 
 async def get_user(telegram_id: int) -> Optional[dict]:
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            _table_url("users"),
-            headers=_headers(),
-            params={"where": f"(telegram_id,eq,{telegram_id})"},
-        )
-        if resp.status_code == 200:
-            records = resp.json().get("list", [])
-            return records[0] if records else None
-    return None
+    # ✅ از کش کاربران (read-through، single-flight)
+    try:
+        return await get_user_by_telegram_id(telegram_id)
+    except httpx.HTTPStatusError:
+        return None
 
 
 async def create_user(
@@ -82,8 +70,8 @@ async def create_user(
         "created_at": datetime.now().isoformat(),
     }
 
-    async with httpx.AsyncClient() as client:
-        await client.post(_table_url("users"), headers=_headers(), json=payload)
+    client = get_client()
+    await client.post(_table_url("users"), json=payload)
 
     return await get_user(telegram_id)
 
@@ -145,14 +133,13 @@ async def create_property(user_telegram_id: int, property_data: dict, confirmati
         payload["confirmation_token"] = confirmation_token
     payload["user_id"] = user_telegram_id
     
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            _table_url("properties"),
-            headers=_headers(),
-            json={k: v for k, v in payload.items() if v is not None},
-        )
-        resp.raise_for_status()
-        return resp.json()
+    client = get_client()
+    resp = await client.post(
+        _table_url("properties"),
+        json={k: v for k, v in payload.items() if v is not None},
+    )
+    resp.raise_for_status()
+    return resp.json()
 
 
 
@@ -162,14 +149,13 @@ async def create_property(user_telegram_id: int, property_data: dict, confirmati
 
 async def create_transaction(**payload) -> dict:
     payload["created_at"] = datetime.now().isoformat()
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            _table_url("transactions"),
-            headers=_headers(),
-            json={k: v for k, v in payload.items() if v is not None},
-        )
-        resp.raise_for_status()
-        return resp.json() if resp.text else {"status": "created"}
+    client = get_client()
+    resp = await client.post(
+        _table_url("transactions"),
+        json={k: v for k, v in payload.items() if v is not None},
+    )
+    resp.raise_for_status()
+    return resp.json() if resp.text else {"status": "created"}
 
 
 # ═══════════════════════════════════════════════════════════
@@ -177,25 +163,23 @@ async def create_transaction(**payload) -> dict:
 # ═══════════════════════════════════════════════════════════
 
 async def get_active_packages() -> list:
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            _table_url("packages"),
-            headers=_headers(),
-            params={"where": "(is_active,eq,1)"},
-        )
-        return resp.json().get("list", []) if resp.status_code == 200 else []
+    client = get_client()
+    resp = await client.get(
+        _table_url("packages"),
+        params={"where": "(is_active,eq,1)"},
+    )
+    return resp.json().get("list", []) if resp.status_code == 200 else []
 
 
 async def get_ai_config(model_name: str) -> Optional[dict]:
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            _table_url("ai_config"),
-            headers=_headers(),
-            params={"where": f"(model_name,eq,{model_name})"},
-        )
-        if resp.status_code == 200:
-            items = resp.json().get("list", [])
-            return items[0] if items else None
+    client = get_client()
+    resp = await client.get(
+        _table_url("ai_config"),
+        params={"where": f"(model_name,eq,{model_name})"},
+    )
+    if resp.status_code == 200:
+        items = resp.json().get("list", [])
+        return items[0] if items else None
     return None
 
 
@@ -249,35 +233,34 @@ async def is_confirmation_token_used(confirmation_token: str) -> bool:
     if not confirmation_token:
         return False
 
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(
-                _table_url("properties"),
-                headers=_headers(),
-                params={
-                    "where": f"(confirmation_token,eq,{confirmation_token})",
-                    "limit": 1,
-                },
-            )
-
-            # ✅ اگر فیلد وجود نداشت یا خطای دیگر، اجازه ثبت بده
-            if resp.status_code == 422:
-                # فیلد confirmation_token در DB نیست - اجازه ثبت بده
-                import logging
-                logging.warning(f"⚠️ confirmation_token field may not exist in properties table")
-                return False  # ← تغییر از True به False
-            
-            if resp.status_code != 200:
-                return False  # ← تغییر: اجازه ثبت بده
-
-            records = resp.json().get("list", [])
-            return len(records) > 0
+    client = get_client()
+    try:
+        resp = await client.get(
+            _table_url("properties"),
+            params={
+                "where": f"(confirmation_token,eq,{confirmation_token})",
+                "limit": 1,
+            },
+        )
 
-        except Exception as e:
+        # ✅ اگر فیلد وجود نداشت یا خطای دیگر، اجازه ثبت بده
+        if resp.status_code == 422:
+            # فیلد confirmation_token در DB نیست - اجازه ثبت بده
             import logging
-            logging.error(f"❌ is_confirmation_token_used error: {e}")
+            logging.warning(f"⚠️ confirmation_token field may not exist in properties table")
+            return False  # ← تغییر از True به False
+            
+        if resp.status_code != 200:
             return False  # ← تغییر: اجازه ثبت بده
 
+        records = resp.json().get("list", [])
+        return len(records) > 0
+
+    except Exception as e:
+        import logging
+        logging.error(f"❌ is_confirmation_token_used error: {e}")
+        return False  # ← تغییر: اجازه ثبت بده
+
 
 async def test_connection():
     packages = await get_active_packages()
@@ -2,7 +2,7 @@
 """Rule Engine for Property Data Collection"""
 
 import logging
-from typing import Dict, Any
+from typing import Any, Dict, Mapping, Optional
 from conversation_state import set_pending_field
 
 logger = logging.getLogger(__name__)
@@ -114,11 +114,11 @@ def _is_field_filled(data: Dict, field: str) -> bool:
     return bool(value)
 
 
-def run_rule_engine(data: Dict) -> Dict[str, Any]:
+def run_rule_engine(data: Mapping[str, Any], user_id: Optional[int] = None) -> Dict[str, Any]:
     """
     بررسی وضعیت داده‌ها و تعیین سوال بعدی
+    user_id: اگر داده شود، فیلد بعدی به عنوان pending field کاربر ثبت می‌شود
     """
-    user_id = data.get("_user_id")
     required_fields = _get_required_fields(data)
     
     logger.debug(f"Required fields: {required_fields}")
@@ -0,0 +1,172 @@
+# services/audio_preprocess.py
+"""
+پیش‌پردازش صدا قبل از ارسال به STT
+- حذف سکوت ابتدا و انتها
+- تبدیل به mono و نرخ نمونه 16kHz (همان ورودی Whisper)
+- کدگذاری مجدد با Opus کم‌حجم
+- تقسیم صداهای بلند در نقاط سکوت برای تبدیل موازی
+کار CPU در ProcessPoolExecutor انجام می‌شود؛ در صورت نبود pydub/ffmpeg یا هر خطا، صدای اصلی ارسال می‌شود.
+"""
+
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pydub import AudioSegment
+    from pydub.silence import detect_leading_silence, detect_silence
+except ImportError:  # pydub اختیاری است
+    AudioSegment = None
+
+STT_PREPROCESS = os.getenv("STT_PREPROCESS", "1") == "1"
+STT_PREPROCESS_WORKERS = int(os.getenv("STT_PREPROCESS_WORKERS", "2"))
+STT_TARGET_SAMPLE_RATE = int(os.getenv("STT_TARGET_SAMPLE_RATE", "16000"))
+STT_TARGET_BITRATE = os.getenv("STT_TARGET_BITRATE", "24k")
+# آستانه سکوت نسبت به بلندی میانگین کل صدا (dB)
+STT_SILENCE_OFFSET_DB = float(os.getenv("STT_SILENCE_OFFSET_DB", "16"))
+STT_SILENCE_PADDING_MS = int(os.getenv("STT_SILENCE_PADDING_MS", "200"))
+
+# صدای بلندتر از این آستانه در سکوت‌ها به قطعه‌های حداکثر STT_CHUNK_MAX_SECONDS تقسیم می‌شود
+STT_CHUNK_THRESHOLD_SECONDS = float(os.getenv("STT_CHUNK_THRESHOLD_SECONDS", "45"))
+STT_CHUNK_MAX_SECONDS = float(os.getenv("STT_CHUNK_MAX_SECONDS", "30"))
+STT_CHUNK_MIN_SECONDS = float(os.getenv("STT_CHUNK_MIN_SECONDS", "5"))
+STT_CHUNK_MIN_SILENCE_MS = int(os.getenv("STT_CHUNK_MIN_SILENCE_MS", "400"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+_stats = {"processed": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def _trim_silence(audio):
+    threshold = audio.dBFS - STT_SILENCE_OFFSET_DB
+    start = detect_leading_silence(audio, silence_threshold=threshold)
+    end = len(audio) - detect_leading_silence(audio.reverse(), silence_threshold=threshold)
+    if end - start <= 0:
+        return audio  # کل صدا زیر آستانه است؛ دست نزن
+    return audio[max(0, start - STT_SILENCE_PADDING_MS):min(len(audio), end + STT_SILENCE_PADDING_MS)]
+
+
+def _normalize(data: bytes, source_format: str):
+    audio = AudioSegment.from_file(io.BytesIO(data), format=source_format)
+    return _trim_silence(audio).set_channels(1).set_frame_rate(STT_TARGET_SAMPLE_RATE)
+
+
+def _export(audio) -> bytes:
+    out = io.BytesIO()
+    audio.export(out, format="ogg", codec="libopus", bitrate=STT_TARGET_BITRATE)
+    return out.getvalue()
+
+
+def _preprocess_sync(data: bytes, source_format: str) -> bytes:
+    """اجرا در process جدا"""
+    return _export(_normalize(data, source_format))
+
+
+def _chunk_bounds(length_ms: int, silences: List[List[int]]) -> List[int]:
+    """نقاط برش: وسط آخرین سکوت قبل از سقف طول قطعه (یا خود سقف اگر سکوتی نبود)"""
+    max_ms = int(STT_CHUNK_MAX_SECONDS * 1000)
+    min_ms = int(STT_CHUNK_MIN_SECONDS * 1000)
+    bounds = [0]
+    while length_ms - bounds[-1] > max_ms:
+        start = bounds[-1]
+        candidates = [
+            (s + e) // 2 for s, e in silences
+            if start + min_ms < (s + e) // 2 <= start + max_ms
+        ]
+        bounds.append(candidates[-1] if candidates else start + max_ms)
+    if len(bounds) > 1 and length_ms - bounds[-1] < min_ms:
+        bounds.pop()  # دنباله خیلی کوتاه به قطعه قبلی می‌چسبد
+    bounds.append(length_ms)
+    return bounds
+
+
+def _split_sync(data: bytes, source_format: str) -> List[bytes]:
+    """اجرا در process جدا: پیش‌پردازش و تقسیم در سکوت‌ها"""
+    audio = _normalize(data, source_format)
+    if len(audio) <= STT_CHUNK_THRESHOLD_SECONDS * 1000:
+        return [_export(audio)]
+
+    silences = detect_silence(
+        audio,
+        min_silence_len=STT_CHUNK_MIN_SILENCE_MS,
+        silence_thresh=audio.dBFS - STT_SILENCE_OFFSET_DB,
+        seek_step=10,
+    )
+    bounds = _chunk_bounds(len(audio), silences)
+    return [_export(audio[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=STT_PREPROCESS_WORKERS)
+    return _executor
+
+
+def preprocess_enabled() -> bool:
+    return STT_PREPROCESS and AudioSegment is not None
+
+
+async def preprocess_audio(data: bytes, source_format: str = "ogg") -> bytes:
+    """
+    پیش‌پردازش صدا در process pool
+    خروجی فقط اگر کوچک‌تر باشد جایگزین می‌شود؛ هر خطا -> همان data
+    """
+    if not preprocess_enabled() or not data:
+        return data
+
+    try:
+        loop = asyncio.get_running_loop()
+        processed = await loop.run_in_executor(_get_executor(), _preprocess_sync, data, source_format)
+    except Exception as e:
+        _stats["failed"] += 1
+        logger.warning(f"Audio preprocessing failed, sending original: {e!r}")
+        return data
+
+    if not processed or len(processed) >= len(data):
+        processed = data
+
+    _stats["processed"] += 1
+    _stats["bytes_in"] += len(data)
+    _stats["bytes_out"] += len(processed)
+    saved = len(data) - len(processed)
+    logger.info(f"🎚 Audio preprocessed: {len(data)} -> {len(processed)} bytes (saved {saved}, {saved / len(data):.0%})")
+    return processed
+
+
+async def split_audio(data: bytes, source_format: str = "ogg") -> Optional[List[bytes]]:
+    """
+    پیش‌پردازش + تقسیم صدای بلند به قطعه‌های مرتب (در process pool)
+    None یعنی تقسیم ممکن نبود و باید صدای اصلی یکجا ارسال شود.
+    """
+    if not preprocess_enabled() or not data:
+        return None
+
+    try:
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(_get_executor(), _split_sync, data, source_format)
+    except Exception as e:
+        _stats["failed"] += 1
+        logger.warning(f"Audio splitting failed, sending original: {e!r}")
+        return None
+
+    _stats["processed"] += 1
+    _stats["bytes_in"] += len(data)
+    _stats["bytes_out"] += sum(len(c) for c in chunks)
+    logger.info(f"✂️ Long voice split into {len(chunks)} chunks")
+    return chunks
+
+
+def get_preprocess_stats() -> Dict:
+    return {**_stats, "bytes_saved": _stats["bytes_in"] - _stats["bytes_out"]}
+
+
+def shutdown_preprocess_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
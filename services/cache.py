@@ -0,0 +1,200 @@
+# services/cache.py
+"""
+کش دو لایه: LRU در حافظه + لایه اختیاری SQLite روی دیسک
+مقادیر باید قابل تبدیل به JSON باشند.
+لایه SQLite در thread جدا اجرا می‌شود تا event loop معطل دیسک نشود.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """کش LRU در حافظه با TTL اختیاری"""
+
+    def __init__(self, max_items: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+
+        value, stored_at = item
+        if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+            del self._items[key]
+            return None
+
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._items[key] = (value, time.monotonic())
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def delete(self, key: str):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SQLiteCache:
+    """
+    کش ماندگار روی SQLite با TTL و حذف قدیمی‌ترین رکوردها بعد از رسیدن به سقف
+    خواندن فقط SELECT است؛ زمان دسترسی در حافظه جمع و همراه نوشتن بعدی ثبت می‌شود.
+    سقف هر evict_every درج یک بار بررسی می‌شود (تا evict_every رکورد بیش از سقف مجاز است).
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 86400, max_items: int = 20000, evict_every: int = 100):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.evict_every = max(1, evict_every)
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._sets_since_evict = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            # رکورد منقضی در evict بعدی حذف می‌شود
+            if row is None or now - row[1] > self.ttl_seconds:
+                return None
+            self._touched[key] = now
+
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._flush_touched()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, payload, now, now),
+            )
+            self._sets_since_evict += 1
+            if self._sets_since_evict >= self.evict_every:
+                self._sets_since_evict = 0
+                self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._touched.pop(key, None)
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?",
+                [(at, key) for key, at in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM cache WHERE stored_at < ?", (now - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        overflow = count - self.max_items
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN"
+                " (SELECT key FROM cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return count
+
+
+class TieredCache:
+    """
+    ترکیب LRU حافظه و SQLite
+    ابتدا حافظه، سپس دیسک (و ارتقای رکورد به حافظه)
+    """
+
+    def __init__(self, name: str, memory: LRUCache, disk: Optional[SQLiteCache] = None):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        if self.disk is not None:
+            try:
+                value = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                logger.error(f"[{self.name}] disk cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value)
+            except sqlite3.Error as e:
+                logger.error(f"[{self.name}] disk cache write failed: {e}")
+
+    async def delete(self, key: str):
+        self.memory.delete(key)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, key)
+
+    def stats(self) -> Dict:
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "name": self.name,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "memory_items": len(self.memory),
+        }
@@ -0,0 +1,230 @@
+# services/circuit_breaker.py
+"""
+Circuit breaker با timeout تطبیقی برای providerهای خارجی (LLM، STT)
+- closed: درخواست‌ها عبور می‌کنند؛ شکست یا کندی پشت‌سرهم مدار را باز می‌کند
+- open: درخواست‌ها بلافاصله با CircuitOpenError رد می‌شوند
+- half_open: یک probe در پس‌زمینه (یا یک درخواست آزمایشی) وضعیت provider را می‌سنجد
+timeout هر درخواست از میانگین و انحراف نمایی تأخیرها (مثل RTO در TCP) محاسبه می‌شود.
+آستانه کندی ثابت است (slow_call_seconds یا نزدیکی به max_timeout)، نه timeout تطبیقی:
+با تأخیر یکنواخت rttvar کوچک می‌شود و timeout تطبیقی به srtt می‌چسبد.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# بدون slow_call_seconds: درخواستی که بیش از این کسر از max_timeout طول بکشد کند است
+SLOW_CALL_RATIO = 0.8
+
+
+class CircuitOpenError(Exception):
+    """provider در دسترس نیست (مدار باز است)"""
+
+    def __init__(self, name: str):
+        super().__init__(f"Circuit '{name}' is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    units: مقدار کار هر درخواست (مثلاً ثانیه‌های صوت)؛ تأخیر به ازای هر واحد سنجیده می‌شود
+    تا درخواست‌های بزرگ‌تر timeout متناسب بگیرند.
+    slow_call_seconds: درخواست کندتر از این (به ازای هر واحد) کند شمرده می‌شود؛
+    None = کندتر از SLOW_CALL_RATIO * max_timeout (نزدیک قطع شدن)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        slow_call_threshold: int = 3,
+        slow_call_seconds: Optional[float] = None,
+        recovery_timeout: float = 30.0,
+        max_recovery_timeout: float = 300.0,
+        min_timeout: float = 3.0,
+        max_timeout: float = 15.0,
+        ewma_alpha: float = 0.125,
+        probe: Optional[Callable[[], Awaitable]] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.base_recovery_timeout = recovery_timeout
+        self.recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.ewma_alpha = ewma_alpha
+        self.probe = probe
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.consecutive_slow_calls = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._srtt: Optional[float] = None
+        self._rttvar = 0.0
+        self._trial_in_flight = False
+        self._probe_task: Optional[asyncio.Task] = None
+
+    # === timeout تطبیقی ===
+
+    def timeout(self, units: float = 1.0) -> float:
+        """srtt + 4 * rttvar (به ازای هر واحد)، محدود به [min_timeout, max_timeout]"""
+        if self._srtt is None:
+            return self.max_timeout
+        adaptive = (self._srtt + 4 * self._rttvar) * max(units, 1.0)
+        return min(self.max_timeout, max(self.min_timeout, adaptive))
+
+    def _is_slow(self, latency: float, units: float) -> bool:
+        if self.slow_call_seconds is not None:
+            return latency >= self.slow_call_seconds * max(units, 1.0)
+        return latency >= SLOW_CALL_RATIO * self.max_timeout
+
+    def _observe_latency(self, latency: float, units: float):
+        sample = latency / max(units, 1.0)
+        if self._srtt is None:
+            self._srtt = sample
+            self._rttvar = sample / 2
+            return
+        self._rttvar = (1 - self.ewma_alpha / 2) * self._rttvar + (self.ewma_alpha / 2) * abs(self._srtt - sample)
+        self._srtt = (1 - self.ewma_alpha) * self._srtt + self.ewma_alpha * sample
+
+    # === وضعیت ===
+
+    def allow_request(self) -> bool:
+        if self.state == CLOSED:
+            return True
+
+        if self.state == OPEN:
+            if self.probe is None and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+                logger.info(f"🟡 Circuit {self.name} half-open (trial request)")
+            else:
+                return False
+
+        # half_open بدون probe: فقط یک درخواست آزمایشی
+        if self.probe is None and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self, latency: Optional[float] = None, units: float = 1.0):
+        if latency is not None:
+            self._observe_latency(latency, units)
+            self.consecutive_slow_calls = self.consecutive_slow_calls + 1 if self._is_slow(latency, units) else 0
+        self.consecutive_failures = 0
+
+        if self.state != CLOSED:
+            self._close()
+        elif self.consecutive_slow_calls >= self.slow_call_threshold:
+            logger.warning(f"🐢 {self.name}: {self.consecutive_slow_calls} slow calls in a row")
+            self._open()
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._open(backoff=True)
+        elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self, backoff: bool = False):
+        if backoff:
+            self.recovery_timeout = min(self.max_recovery_timeout, self.recovery_timeout * 2)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self.consecutive_slow_calls = 0
+        self._trial_in_flight = False
+        logger.warning(f"🔴 Circuit {self.name} open for {self.recovery_timeout:.0f}s")
+        self._schedule_probe()
+
+    def _close(self):
+        logger.info(f"🟢 Circuit {self.name} closed")
+        self.state = CLOSED
+        self.recovery_timeout = self.base_recovery_timeout
+        self.consecutive_failures = 0
+        self.consecutive_slow_calls = 0
+        self._trial_in_flight = False
+
+    # === probe پس‌زمینه ===
+
+    def _schedule_probe(self):
+        if self.probe is None or (self._probe_task and not self._probe_task.done()):
+            return
+        try:
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_loop())
+        except RuntimeError:
+            # بیرون از event loop: probe انجام نمی‌شود، مدار با درخواست آزمایشی بسته می‌شود
+            self.probe = None
+
+    async def _probe_loop(self):
+        while self.state == OPEN:
+            await asyncio.sleep(self.recovery_timeout)
+            self.state = HALF_OPEN
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self.probe(), timeout=self.timeout())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.info(f"Circuit {self.name} probe failed: {e}")
+                self._open(backoff=True)
+                continue
+            logger.info(f"Circuit {self.name} probe ok in {time.monotonic() - started:.2f}s")
+            self._close()
+
+    # === اجرای درخواست ===
+
+    async def call(self, func: Callable[..., Awaitable], *args, units: float = 1.0, **kwargs):
+        """اجرای func با timeout تطبیقی؛ در مدار باز بلافاصله CircuitOpenError"""
+        if not self.allow_request():
+            self.rejected += 1
+            raise CircuitOpenError(self.name)
+
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout=self.timeout(units))
+        except asyncio.CancelledError:
+            self._trial_in_flight = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(time.monotonic() - started, units)
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "timeout": round(self.timeout(), 2),
+            "srtt": round(self._srtt, 3) if self._srtt is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str, **config) -> CircuitBreaker:
+    """breaker مشترک با نام ثابت (مثلاً llm:avalai یا stt:avalai)"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name, **config)
+    return breaker
+
+
+def get_breaker_stats() -> Dict:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
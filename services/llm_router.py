@@ -0,0 +1,271 @@
+# services/llm_router.py
+"""
+چند provider سازگار با OpenAI برای LLM
+- انتخاب سریع‌ترین provider سالم بر اساس p50 تأخیر اخیر
+- ارسال درخواست تکراری (hedge) به provider دیگر اگر پاسخ از صدک تأخیر دیرتر شد (LLM_HEDGE_ENABLED)
+- سلامت و timeout هر provider با circuit breaker (services.circuit_breaker)
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+from services.circuit_breaker import CircuitOpenError, get_breaker, CLOSED
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDERS = [
+    {
+        "name": "avalai",
+        "base_url": "https://api.avalai.ir/v1",
+        "api_key_env": "AVALAIGPT_API_KEY",
+        "model": "gpt-4o-mini",
+    }
+]
+
+# مثال: LLM_PROVIDERS='[{"name": "avalai", "base_url": "...", "api_key_env": "AVALAIGPT_API_KEY", "model": "gpt-4o-mini"}, ...]'
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS")
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "50"))
+# hedge فقط به provider دیگر (با یک provider فقط بار و هزینه را دو برابر می‌کند)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# تا این تعداد نمونه، صدک قابل اعتماد نیست و LLM_HEDGE_DEFAULT_DELAY استفاده می‌شود
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "4"))
+LLM_FAILURE_COOLDOWN_SECONDS = float(os.getenv("LLM_FAILURE_COOLDOWN_SECONDS", "30"))
+LLM_MAX_CONSECUTIVE_FAILURES = int(os.getenv("LLM_MAX_CONSECUTIVE_FAILURES", "3"))
+# کف timeout تطبیقی؛ سقف آن timeout هر provider است
+LLM_MIN_TIMEOUT_SECONDS = float(os.getenv("LLM_MIN_TIMEOUT_SECONDS", "4"))
+# پاسخ کندتر از این کند شمرده می‌شود (چند پاسخ کند پشت‌سرهم مدار را باز می‌کند)؛ 0 = 80٪ timeout provider
+LLM_SLOW_CALL_SECONDS = float(os.getenv("LLM_SLOW_CALL_SECONDS", "0")) or None
+
+
+def _percentile(samples, p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LLMProvider:
+    """یک endpoint سازگار با OpenAI به همراه آمار تأخیر و سلامت"""
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str, timeout: float = 15.0):
+        self.name = name
+        self.model = model
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout)
+        self.latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        # تأخیر اولین chunk استریم‌ها؛ جدا از latencies و timeout تطبیقی breaker که برای پاسخ کامل‌اند
+        self.first_chunk_latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.breaker = get_breaker(
+            f"llm:{name}",
+            failure_threshold=LLM_MAX_CONSECUTIVE_FAILURES,
+            recovery_timeout=LLM_FAILURE_COOLDOWN_SECONDS,
+            slow_call_seconds=LLM_SLOW_CALL_SECONDS,
+            min_timeout=LLM_MIN_TIMEOUT_SECONDS,
+            max_timeout=timeout,
+            probe=self._probe,
+        )
+
+    async def _probe(self):
+        """درخواست سبک برای بررسی بازگشت provider (در حالت half-open)"""
+        await self.client.models.list()
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.state == CLOSED
+
+    def percentile(self, p: float) -> Optional[float]:
+        return _percentile(self.latencies, p)
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "healthy": self.healthy,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "samples": len(self.latencies),
+            "stream_first_chunk_p50": _percentile(self.first_chunk_latencies, 50),
+            "circuit": self.breaker.stats(),
+        }
+
+
+class LLMRouter:
+    """مسیریابی درخواست‌های chat بین providerها"""
+
+    def __init__(self, providers: List[LLMProvider], hedge_enabled: bool = LLM_HEDGE_ENABLED):
+        if not providers:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = providers
+        self.hedge_enabled = hedge_enabled
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+
+    def ranked(self) -> List[LLMProvider]:
+        """providerهای سالم (مدار بسته) به ترتیب p50؛ بدون آمار = اول، برای نمونه‌برداری"""
+        def key(p: LLMProvider):
+            p50 = p.percentile(50)
+            return p50 if p50 is not None else 0.0
+        return sorted((p for p in self.providers if p.healthy), key=key)
+
+    @staticmethod
+    def hedge_delay(provider: LLMProvider) -> float:
+        """صدک تأخیر provider؛ با نمونه‌های کم مقدار پیش‌فرض"""
+        if len(provider.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return provider.percentile(LLM_HEDGE_PERCENTILE)
+
+    def available(self) -> bool:
+        return any(p.healthy for p in self.providers)
+
+    async def _call(self, provider: LLMProvider, kwargs: Dict):
+        """فراخوانی از طریق circuit breaker provider (timeout تطبیقی)"""
+        started = time.monotonic()
+        response = await provider.breaker.call(
+            provider.client.chat.completions.create, model=provider.model, **kwargs
+        )
+        provider.latencies.append(time.monotonic() - started)
+        return response
+
+    async def chat(self, **kwargs):
+        """
+        ارسال chat completion به سریع‌ترین provider
+        اگر پاسخ از صدک LLM_HEDGE_PERCENTILE دیرتر شد، یک درخواست موازی به provider بعدی
+        ارسال می‌شود و اولین پاسخ موفق برنده است (بدون provider دوم hedge انجام نمی‌شود).
+        """
+        ranked = self.ranked()
+        if not ranked:
+            raise CircuitOpenError("llm")
+        primary = ranked[0]
+        fallback = ranked[1] if len(ranked) > 1 else None
+
+        if not self.hedge_enabled or fallback is None:
+            try:
+                return await self._call(primary, kwargs)
+            except Exception as e:
+                if fallback is None:
+                    raise
+                logger.warning(f"LLM provider {primary.name} failed ({e}); falling back to {fallback.name}")
+                return await self._call(fallback, kwargs)
+
+        hedge_delay = self.hedge_delay(primary)
+        primary_task = asyncio.create_task(self._call(primary, kwargs))
+        tasks = [primary_task]
+        hedge_task = None
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+
+            if not done:
+                # پاسخ دیر شده: درخواست تکراری
+                self.hedged_requests += 1
+                logger.info(f"🔀 Hedging LLM request: {primary.name} > {hedge_delay:.2f}s, duplicate to {fallback.name}")
+                hedge_task = asyncio.create_task(self._call(fallback, kwargs))
+                tasks.append(hedge_task)
+            elif primary_task.exception() is not None:
+                logger.warning(f"LLM provider {primary.name} failed ({primary_task.exception()}); falling back to {fallback.name}")
+                tasks.append(asyncio.create_task(self._call(fallback, kwargs)))
+
+            last_error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _open_stream(self, provider: LLMProvider, kwargs: Dict):
+        """ارسال درخواست استریم و انتظار برای اولین chunk"""
+        response = await provider.client.chat.completions.create(
+            model=provider.model, stream=True, **kwargs
+        )
+        try:
+            first = await response.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await response.close()
+            raise
+        return response, first
+
+    @staticmethod
+    async def _iterate_stream(response, first):
+        try:
+            if first is not None:
+                yield first
+            async for chunk in response:
+                yield chunk
+        finally:
+            await response.close()
+
+    async def stream(self, **kwargs):
+        """
+        chat completion استریم روی سریع‌ترین provider سالم (بدون hedge)
+        تا رسیدن اولین chunk صبر می‌کند و یک async generator از chunkها برمی‌گرداند؛
+        مصرف‌کننده باید در پایان aclose() را صدا بزند.
+        تأخیر اولین chunk جداگانه (first_chunk_latencies) ثبت می‌شود؛ breaker فقط موفقیت را می‌بیند
+        چون timeout تطبیقی و آمار p50/p95 آن برای پاسخ کامل غیراستریم است.
+        """
+        provider = next((p for p in self.ranked() if p.breaker.allow_request()), None)
+        if provider is None:
+            raise CircuitOpenError("llm")
+
+        started = time.monotonic()
+        try:
+            response, first = await asyncio.wait_for(
+                self._open_stream(provider, kwargs),
+                timeout=provider.breaker.timeout(),
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            provider.breaker.record_failure()
+            raise
+        provider.first_chunk_latencies.append(time.monotonic() - started)
+        provider.breaker.record_success()
+        return self._iterate_stream(response, first)
+
+    def stats(self) -> Dict:
+        return {
+            "providers": [p.stats() for p in self.providers],
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def _load_providers(timeout: float) -> List[LLMProvider]:
+    configs = json.loads(LLM_PROVIDERS) if LLM_PROVIDERS else DEFAULT_PROVIDERS
+    providers = []
+    for cfg in configs:
+        api_key = cfg.get("api_key") or os.getenv(cfg.get("api_key_env", "AVALAIGPT_API_KEY"))
+        providers.append(
+            LLMProvider(
+                name=cfg["name"],
+                base_url=cfg["base_url"],
+                api_key=api_key,
+                model=cfg.get("model", "gpt-4o-mini"),
+                timeout=float(cfg.get("timeout", timeout)),
+            )
+        )
+    return providers
+
+
+def build_router(timeout: float) -> LLMRouter:
+    """ساخت router از روی LLM_PROVIDERS (یا AvalAI پیش‌فرض)"""
+    return LLMRouter(_load_providers(timeout))
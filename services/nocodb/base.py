@@ -1,13 +1,69 @@
+"""
+کلاینت HTTP مشترک NocoDB
+یک AsyncClient برای کل برنامه: اتصال‌ها (keep-alive) بین درخواست‌ها دوباره استفاده می‌شوند
+و در صورت نصب بودن h2 از HTTP/2 استفاده می‌شود.
+"""
+
+import importlib.util
+import logging
+import os
+from typing import Optional
+
 import httpx
 from config import NOCODB_URL, NOCODB_TOKEN
 
+logger = logging.getLogger(__name__)
+
+NOCODB_TIMEOUT_SECONDS = float(os.getenv("NOCODB_TIMEOUT_SECONDS", "30"))
+NOCODB_MAX_CONNECTIONS = int(os.getenv("NOCODB_MAX_CONNECTIONS", "20"))
+NOCODB_MAX_KEEPALIVE = int(os.getenv("NOCODB_MAX_KEEPALIVE", "10"))
+NOCODB_KEEPALIVE_EXPIRY = float(os.getenv("NOCODB_KEEPALIVE_EXPIRY", "30"))
+NOCODB_HTTP2 = os.getenv("NOCODB_HTTP2", "1") == "1"
 
-def get_client():
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _create_client() -> httpx.AsyncClient:
+    http2 = NOCODB_HTTP2 and importlib.util.find_spec("h2") is not None
+    logger.info(
+        f"NocoDB client: http2={http2}, max_connections={NOCODB_MAX_CONNECTIONS}, "
+        f"keepalive={NOCODB_MAX_KEEPALIVE}"
+    )
     return httpx.AsyncClient(
         base_url=f"{NOCODB_URL}/api/v2",
         headers={
             "xc-token": NOCODB_TOKEN,
             "Content-Type": "application/json"
         },
-        timeout=30
+        timeout=NOCODB_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=NOCODB_MAX_CONNECTIONS,
+            max_keepalive_connections=NOCODB_MAX_KEEPALIVE,
+            keepalive_expiry=NOCODB_KEEPALIVE_EXPIRY,
+        ),
+        http2=http2,
     )
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    کلاینت مشترک (در اولین استفاده ساخته می‌شود)
+    ⚠️ با async with استفاده نشود؛ بستن فقط با close_nocodb_client
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def init_nocodb_client():
+    """ساخت کلاینت هنگام شروع ربات"""
+    get_client()
+
+
+async def close_nocodb_client():
+    """بستن اتصال‌ها هنگام خروج"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,501 @@
+"""
+دفتر کل اعتبار (ledger)
+تغییر موجودی به صورت اتمیک و بدون read-modify-write روی balance.
+
+- nocodb: جدول transactions منبع حقیقت است. هر ردیف ledger نسخه بعدی موجودی کاربر است و
+  ستون یکتای ledger_key = "{telegram_id}:{version}" نقش compare-and-set را دارد:
+  دو درخواست هم‌زمان روی یک نسخه، فقط یکی ثبت می‌شود و دیگری با backoff دوباره تلاش می‌کند.
+  ⚠️ ستون ledger_key باید در NocoDB یکتا (unique) باشد (setup_transactions.py)؛
+  بعد از راه‌اندازی جدول‌ها با `python verify_ledger.py` (یک درج تکراری آزمایشی) بررسی شود.
+  هنگام شروع ربات فقط وجود ستون‌ها بررسی می‌شود (check، بدون نوشتن).
+- sqlite: ledger محلی با UPDATE شرطی در یک تراکنش (اجرای تک‌سرور و تست)
+
+در هر دو حالت موجودی اولیه (نسخه 0) از users.balance خوانده می‌شود و بعد از هر تغییر
+balance و balance_version در users نوشته (materialize) و کش کاربران به‌روز می‌شود.
+اگر users.balance بیرون از ledger تغییر کرده باشد (ویرایش ادمین در NocoDB) و balance_version
+همان نسخه ledger باشد، اختلاف به صورت یک ردیف adjustment وارد ledger می‌شود و بازنویسی نمی‌شود.
+
+LEDGER_BACKEND: nocodb (پیش‌فرض) | sqlite
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from services.cache import LRUCache
+from .base import get_client
+from .tables import TRANSACTIONS_TABLE_ID, USERS_TABLE_ID
+from .users import get_user_by_telegram_id, invalidate_user, update_cached_user
+
+logger = logging.getLogger(__name__)
+
+LEDGER_BACKEND = os.getenv("LEDGER_BACKEND", "nocodb")
+LEDGER_DB = os.getenv("LEDGER_DB", "credit_ledger.db")
+LEDGER_MAX_RETRIES = int(os.getenv("LEDGER_MAX_RETRIES", "5"))
+LEDGER_BACKOFF_SECONDS = float(os.getenv("LEDGER_BACKOFF_SECONDS", "0.05"))
+# آخرین نسخه شناخته‌شده هر کاربر؛ کهنه بودن آن فقط یک conflict و یک تلاش دوباره هزینه دارد
+LEDGER_HEAD_TTL_SECONDS = float(os.getenv("LEDGER_HEAD_TTL_SECONDS", "300"))
+
+# ستون‌هایی که ledger به آن‌ها نیاز دارد (setup_transactions.py / setup_users.py)
+LEDGER_COLUMNS = {"balance_after", "ledger_version", "ledger_key", "ledger_entry"}
+USER_LEDGER_COLUMNS = {"balance", "balance_version"}
+
+# فقط این پاسخ‌ها «نسخه را کس دیگری گرفته» هستند؛ بقیه خطاها (ستون ناموجود، نوع غلط) بالا می‌روند
+_CONFLICT_STATUSES = (409, 422)
+_UNIQUE_VIOLATION_RE = re.compile(r"unique|duplicate|already exists", re.I)
+# نوع ردیف آزمایشی verify (ledger_version=0؛ در محاسبه موجودی دیده نمی‌شود)
+_PROBE_TYPE = "ledger_probe"
+
+
+class UnknownUser(ValueError):
+    """کاربر در NocoDB وجود ندارد"""
+
+
+class LedgerConflict(Exception):
+    """بعد از LEDGER_MAX_RETRIES تلاش، نسخه موجودی همچنان توسط درخواست دیگری تغییر می‌کرد"""
+
+
+class LedgerMisconfigured(RuntimeError):
+    """جدول‌های NocoDB شرایط compare-and-set را ندارند؛ ledger نباید روی آن‌ها اجرا شود"""
+
+
+def _result(success: bool, current: int, new: int, transaction_id=None) -> Dict:
+    return {
+        "success": success,
+        "current_balance": current,
+        "new_balance": new,
+        "transaction_id": transaction_id,
+    }
+
+
+def _user_balance(user: dict) -> int:
+    return int(user.get("balance", 0) or 0)
+
+
+class Ledger:
+    name = "base"
+
+    async def check(self):
+        """بررسی فقط‌خواندنی پیش‌نیازها (هنگام شروع ربات)؛ Raises: LedgerMisconfigured"""
+
+    async def verify(self):
+        """بررسی کامل پیش‌نیازها (دستور راه‌اندازی verify_ledger.py)؛ Raises: LedgerMisconfigured"""
+        await self.check()
+
+    async def _head(self, telegram_id: int, user: dict, refresh: bool = False) -> Tuple[int, int]:
+        """(version, balance)؛ بدون ردیف ledger -> نسخه 0 با users.balance"""
+        raise NotImplementedError
+
+    async def _apply(
+        self, telegram_id: int, user: dict, amount: int, tx_type: str, description: str,
+        require_funds: bool, reference_id: Optional[str], extra: Dict,
+        expected_version: Optional[int] = None,
+    ) -> Tuple[Dict, int]:
+        """
+        (نتیجه, نسخه جدید)
+        expected_version: فقط یک تلاش روی همین نسخه (بدون retry)؛ اگر جلو رفته بود success=False
+        """
+        raise NotImplementedError
+
+    async def _materialize(self, telegram_id: int, user: dict, new_balance: int, version: int):
+        """نوشتن balance در users (نسخه مشتق‌شده؛ خطا فقط log می‌شود)"""
+        try:
+            client = get_client()
+            res = await client.patch(
+                f"/tables/{USERS_TABLE_ID}/records",
+                json={"Id": user["Id"], "balance": new_balance, "balance_version": version},
+            )
+            res.raise_for_status()
+            update_cached_user(telegram_id, balance=new_balance, balance_version=version)
+        except Exception as e:
+            invalidate_user(telegram_id)
+            logger.warning(f"Ledger: materializing balance of {telegram_id} failed: {e}")
+
+    async def _reconcile(self, telegram_id: int, user: dict):
+        """
+        تغییر users.balance بیرون از ledger (ویرایش ادمین، اسکریپت قدیمی) را وارد ledger کن
+        فقط وقتی balance_version همان نسخه فعلی ledger است مطمئنیم اختلاف از بیرون آمده؛
+        نسخه عقب‌تر یعنی materialize هنوز نرسیده (یا شکست خورده) و users.balance معتبر نیست.
+        """
+        marker = user.get("balance_version")
+        if marker in (None, ""):
+            return
+
+        version, current = await self._head(telegram_id, user)
+        external = _user_balance(user)
+        if int(marker) != version or external == current:
+            return
+
+        logger.warning(
+            f"Ledger: balance of {telegram_id} changed outside the ledger "
+            f"({current} -> {external}); recording an adjustment"
+        )
+        result, new_version = await self._apply(
+            telegram_id, user, external - current, "adjustment", "external balance edit",
+            False, None, {}, expected_version=version,
+        )
+        if result["success"]:
+            await self._materialize(telegram_id, user, result["new_balance"], new_version)
+
+    async def _user(self, telegram_id: int) -> dict:
+        user = await get_user_by_telegram_id(telegram_id)  # معمولاً از کش
+        if not user:
+            raise UnknownUser(f"User {telegram_id} not found")
+        return user
+
+    async def balance(self, telegram_id: int) -> int:
+        telegram_id = int(telegram_id)
+        user = await self._user(telegram_id)
+        await self._reconcile(telegram_id, user)
+        _, balance = await self._head(telegram_id, user)
+        return balance
+
+    async def apply(
+        self,
+        telegram_id: int,
+        amount: int,
+        tx_type: str,
+        description: str,
+        require_funds: bool = False,
+        reference_id: Optional[str] = None,
+        **extra,
+    ) -> Dict:
+        """
+        اعمال تغییر موجودی (amount منفی = کسر)
+        require_funds: اگر موجودی کافی نباشد هیچ تغییری ثبت نمی‌شود و success=False
+        Returns: {"success", "current_balance", "new_balance", "transaction_id"}
+        Raises: UnknownUser
+        """
+        telegram_id = int(telegram_id)
+        user = await self._user(telegram_id)
+        await self._reconcile(telegram_id, user)
+
+        extra = {k: v for k, v in extra.items() if v is not None}
+        result, version = await self._apply(
+            telegram_id, user, amount, tx_type, description, require_funds, reference_id, extra
+        )
+        if result["success"]:
+            await self._materialize(telegram_id, user, result["new_balance"], version)
+        return result
+
+
+# ═══════════════════════════════════════════════════════════
+# NocoDB
+# ═══════════════════════════════════════════════════════════
+
+def _is_conflict(res: httpx.Response) -> bool:
+    return res.status_code in _CONFLICT_STATUSES and bool(_UNIQUE_VIOLATION_RE.search(res.text))
+
+
+class NocoDBLedger(Ledger):
+    name = "nocodb"
+
+    def __init__(self, max_retries: int = LEDGER_MAX_RETRIES, backoff: float = LEDGER_BACKOFF_SECONDS):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # telegram_id -> (version, balance)
+        self._heads = LRUCache(10000, LEDGER_HEAD_TTL_SECONDS)
+        self.conflicts = 0
+
+    # === بررسی هنگام شروع ===
+
+    async def _columns(self, table_id: str) -> set:
+        client = get_client()
+        res = await client.get(f"/meta/tables/{table_id}")
+        res.raise_for_status()
+        return {c.get("title") for c in res.json().get("columns", [])}
+
+    async def check(self):
+        """ستون‌های ledger در transactions و users وجود دارند (بدون نوشتن)"""
+        missing = LEDGER_COLUMNS - await self._columns(TRANSACTIONS_TABLE_ID)
+        missing |= USER_LEDGER_COLUMNS - await self._columns(USERS_TABLE_ID)
+        if missing:
+            raise LedgerMisconfigured(f"credit ledger columns missing in NocoDB: {sorted(missing)}")
+
+    async def _delete_probes(self):
+        """ردیف‌های آزمایشی باقی‌مانده از اجرای ناتمام قبلی"""
+        client = get_client()
+        res = await client.get(
+            f"/tables/{TRANSACTIONS_TABLE_ID}/records",
+            params={"where": f"(type,eq,{_PROBE_TYPE})", "limit": 100},
+        )
+        res.raise_for_status()
+        ids = [{"Id": row["Id"]} for row in res.json().get("list", [])]
+        if ids:
+            res = await client.request("DELETE", f"/tables/{TRANSACTIONS_TABLE_ID}/records", json=ids)
+            res.raise_for_status()
+            logger.info(f"Credit ledger: removed {len(ids)} leftover probe row(s)")
+
+    async def verify(self):
+        """
+        علاوه بر check، یکتا بودن ledger_key: یک ردیف آزمایشی (ledger_version=0، در head دیده نمی‌شود)
+        دو بار درج می‌شود و درج دوم باید به عنوان تکراری (409/422) رد شود؛ سپس ردیف‌ها پاک می‌شوند.
+        فقط از دستور راه‌اندازی (verify_ledger.py) اجرا شود، نه هنگام هر شروع ربات.
+        """
+        await self.check()
+        await self._delete_probes()
+
+        client = get_client()
+        probe = {
+            "user_id": 0,
+            "amount": 0,
+            "type": _PROBE_TYPE,
+            "description": "ledger_key uniqueness check",
+            "ledger_version": 0,
+            "ledger_key": f"probe:{uuid.uuid4().hex}",
+        }
+        created = []
+        try:
+            for _ in range(2):
+                res = await client.post(f"/tables/{TRANSACTIONS_TABLE_ID}/records", json=probe)
+                if _is_conflict(res):
+                    break
+                res.raise_for_status()
+                created.append(res.json().get("Id"))
+        finally:
+            if created:
+                await self._delete_probes()
+
+        if len(created) > 1:
+            raise LedgerMisconfigured(
+                "transactions.ledger_key is not unique in NocoDB; concurrent credit changes "
+                "could double-spend (see setup_transactions.py)"
+            )
+        logger.info("✅ Credit ledger: ledger_key uniqueness verified")
+
+    # === head ===
+
+    async def _fetch_head(self, telegram_id: int, user: dict) -> Tuple[int, int]:
+        """(version, balance) از transactions؛ بدون ردیف ledger -> نسخه 0 با balance فعلی users"""
+        client = get_client()
+        res = await client.get(
+            f"/tables/{TRANSACTIONS_TABLE_ID}/records",
+            params={
+                "where": f"(user_id,eq,{telegram_id})~and(ledger_version,gt,0)",
+                "sort": "-ledger_version",
+                "limit": 1,
+            },
+        )
+        res.raise_for_status()
+        rows = res.json().get("list", [])
+        if rows:
+            return int(rows[0]["ledger_version"]), int(rows[0].get("balance_after") or 0)
+        return 0, _user_balance(user)
+
+    async def _head(self, telegram_id: int, user: dict, refresh: bool = False) -> Tuple[int, int]:
+        head = None if refresh else self._heads.get(str(telegram_id))
+        if head is None:
+            head = await self._fetch_head(telegram_id, user)
+            self._heads.set(str(telegram_id), head)
+        return tuple(head)
+
+    # === درج ===
+
+    async def _insert(self, row: Dict) -> Optional[dict]:
+        """ثبت ردیف ledger؛ None = ledger_key تکراری (نسخه را کس دیگری گرفته)"""
+        client = get_client()
+        res = await client.post(f"/tables/{TRANSACTIONS_TABLE_ID}/records", json=row)
+        if _is_conflict(res):
+            return None
+        res.raise_for_status()
+        return res.json() if res.text else {}
+
+    async def _committed(self, entry_id: str) -> Optional[dict]:
+        """بعد از خطای شبکه: آیا ردیف ما با وجود خطا ثبت شده است؟"""
+        client = get_client()
+        res = await client.get(
+            f"/tables/{TRANSACTIONS_TABLE_ID}/records",
+            params={"where": f"(ledger_entry,eq,{entry_id})", "limit": 1},
+        )
+        res.raise_for_status()
+        rows = res.json().get("list", [])
+        return rows[0] if rows else None
+
+    async def _commit(self, telegram_id: int, row: Dict) -> Optional[dict]:
+        """درج با تشخیص نتیجه نامعلوم (timeout / 5xx) از روی ledger_entry"""
+        try:
+            return await self._insert(row)
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                raise  # درخواست نامعتبر؛ تلاش دوباره فایده ندارد
+            self._heads.delete(str(telegram_id))
+            created = await self._committed(row["ledger_entry"])
+            if created is None:
+                raise
+            return created
+
+    async def _apply(
+        self, telegram_id: int, user: dict, amount: int, tx_type: str, description: str,
+        require_funds: bool, reference_id: Optional[str], extra: Dict,
+        expected_version: Optional[int] = None,
+    ) -> Tuple[Dict, int]:
+        entry_id = uuid.uuid4().hex
+        version, current = await self._head(telegram_id, user)
+        fresh = False
+        if expected_version is not None and version != expected_version:
+            return _result(False, current, current), version
+
+        for attempt in range(self.max_retries + 1):
+            new_balance = current + amount
+            if require_funds and new_balance < 0:
+                if fresh:
+                    return _result(False, current, current), version
+                # شاید head کش‌شده کهنه باشد
+                version, current = await self._head(telegram_id, user, refresh=True)
+                fresh = True
+                continue
+
+            row = {
+                "user_id": telegram_id,
+                "amount": amount,
+                "type": tx_type,
+                "description": description,
+                "balance_after": new_balance,
+                "ledger_version": version + 1,
+                "ledger_key": f"{telegram_id}:{version + 1}",
+                "ledger_entry": entry_id,
+                "created_at": datetime.utcnow().isoformat(),
+                **extra,
+            }
+            if reference_id:
+                row["reference_id"] = reference_id
+
+            created = await self._commit(telegram_id, row)
+            if created is not None:
+                self._heads.set(str(telegram_id), (version + 1, new_balance))
+                return _result(True, current, new_balance, created.get("Id")), version + 1
+
+            # compare-and-set ناموفق؟ نسخه جدید را بخوان؛ اگر جلو نرفته بود، درج به دلیل دیگری رد شده است
+            latest_version, latest = await self._head(telegram_id, user, refresh=True)
+            if latest_version <= version:
+                raise RuntimeError(f"credit ledger insert rejected for {telegram_id} (check ledger_* columns)")
+
+            self.conflicts += 1
+            if expected_version is not None:
+                return _result(False, latest, latest), latest_version
+
+            logger.info(f"Ledger conflict for {telegram_id} at version {version + 1}; retrying")
+            version, current, fresh = latest_version, latest, True
+            await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+        raise LedgerConflict(f"credit ledger of {telegram_id}: {self.max_retries} retries exhausted")
+
+
+# ═══════════════════════════════════════════════════════════
+# SQLite
+# ═══════════════════════════════════════════════════════════
+
+class SQLiteLedger(Ledger):
+    """
+    ledger محلی: UPDATE شرطی و درج ردیف در یک تراکنش (BEGIN IMMEDIATE)
+    فقط برای یک process؛ موجودی اولیه از users.balance و نتیجه دوباره در users نوشته می‌شود.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = LEDGER_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS balances ("
+            " telegram_id INTEGER PRIMARY KEY,"
+            " balance INTEGER NOT NULL,"
+            " version INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " telegram_id INTEGER NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " amount INTEGER NOT NULL,"
+            " balance_after INTEGER NOT NULL,"
+            " type TEXT NOT NULL,"
+            " description TEXT,"
+            " reference_id TEXT,"
+            " extra TEXT,"
+            " created_at TEXT NOT NULL,"
+            " UNIQUE (telegram_id, version))"
+        )
+
+    def _head_sync(self, telegram_id: int, seed: int) -> Tuple[int, int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, balance FROM balances WHERE telegram_id = ?", (telegram_id,)
+            ).fetchone()
+        return tuple(row) if row else (0, seed)
+
+    def _apply_sync(
+        self, telegram_id, seed, amount, tx_type, description, require_funds, reference_id, extra, expected_version
+    ) -> Tuple[Dict, int]:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR IGNORE INTO balances (telegram_id, balance, version) VALUES (?, ?, 0)",
+                    (telegram_id, seed),
+                )
+                cursor = conn.execute(
+                    "UPDATE balances SET balance = balance + ?, version = version + 1"
+                    " WHERE telegram_id = ? AND (? = 0 OR balance + ? >= 0) AND (? IS NULL OR version = ?)",
+                    (amount, telegram_id, int(require_funds), amount, expected_version, expected_version),
+                )
+                new_balance, version = conn.execute(
+                    "SELECT balance, version FROM balances WHERE telegram_id = ?", (telegram_id,)
+                ).fetchone()
+
+                if cursor.rowcount == 0:
+                    conn.execute("ROLLBACK")
+                    return _result(False, new_balance, new_balance), version
+
+                tx = conn.execute(
+                    "INSERT INTO ledger (telegram_id, version, amount, balance_after, type, description,"
+                    " reference_id, extra, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        telegram_id, version, amount, new_balance, tx_type, description, reference_id,
+                        json.dumps(extra, ensure_ascii=False) if extra else None,
+                        datetime.utcnow().isoformat(),
+                    ),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return _result(True, new_balance - amount, new_balance, tx.lastrowid), version
+
+    async def _head(self, telegram_id: int, user: dict, refresh: bool = False) -> Tuple[int, int]:
+        return await asyncio.to_thread(self._head_sync, telegram_id, _user_balance(user))
+
+    async def _apply(
+        self, telegram_id: int, user: dict, amount: int, tx_type: str, description: str,
+        require_funds: bool, reference_id: Optional[str], extra: Dict,
+        expected_version: Optional[int] = None,
+    ) -> Tuple[Dict, int]:
+        return await asyncio.to_thread(
+            self._apply_sync, telegram_id, _user_balance(user), amount, tx_type, description,
+            require_funds, reference_id, extra, expected_version,
+        )
+
+
+def build_ledger(name: str = LEDGER_BACKEND) -> Ledger:
+    if name == "sqlite":
+        return SQLiteLedger(LEDGER_DB)
+    if name != "nocodb":
+        logger.warning(f"Unknown LEDGER_BACKEND '{name}'; using nocodb ledger")
+    return NocoDBLedger()
+
+
+ledger = build_ledger()
@@ -1,6 +1,6 @@
 import asyncio
 
-from .base import get_client
+from .base import close_nocodb_client, get_client
 from .tables import USERS_TABLE_ID
 
 
@@ -35,7 +35,8 @@ COLUMNS = [
 
 
 async def main():
-    async with get_client() as client:
+    client = get_client()
+    try:
         for col in COLUMNS:
             res = await client.post(
                 f"/meta/tables/{USERS_TABLE_ID}/columns",
@@ -46,6 +47,8 @@ async def main():
                 print(f"❌ Error creating column '{col['title']}': {res.text}")
             else:
                 print(f"✅ Created column: {col['title']}")
+    finally:
+        await close_nocodb_client()
 
 
 if __name__ == "__main__":
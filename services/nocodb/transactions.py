@@ -4,13 +4,13 @@ from .tables import TRANSACTIONS_TABLE_ID
 
 
 async def create_transaction(payload: dict):
-    async with get_client() as client:
-        res = await client.post(
-            f"/tables/{TRANSACTIONS_TABLE_ID}/records",
-            json={
-                **payload,
-                "created_at": datetime.utcnow().isoformat()
-            }
-        )
-        res.raise_for_status()
-        return res.json()
+    client = get_client()
+    res = await client.post(
+        f"/tables/{TRANSACTIONS_TABLE_ID}/records",
+        json={
+            **payload,
+            "created_at": datetime.utcnow().isoformat()
+        }
+    )
+    res.raise_for_status()
+    return res.json()
@@ -1,18 +1,119 @@
+"""
+کاربران NocoDB با کش read-through
+- رکورد هر telegram_id تا USER_CACHE_TTL_SECONDS در حافظه می‌ماند
+- درخواست‌های هم‌زمان برای یک کاربر فقط یک درخواست به NocoDB می‌فرستند (single-flight)
+- نوشتن‌های خود ربات (مثل تغییر balance) کش را در جا به‌روز یا باطل می‌کنند
+کاربر پیدا نشده کش نمی‌شود (ساخت کاربر بلافاصله دیده شود).
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+from services.cache import LRUCache
 from .base import get_client
 from .tables import USERS_TABLE_ID
 
-async def get_user_by_telegram_id(telegram_id: int):
-    async with get_client() as client:
-        res = await client.get(
-            f"/tables/{USERS_TABLE_ID}/records",
-            params={
-                "where": f"(telegram_id,eq,{telegram_id})",
-                "limit": 1
-            }
-        )
-        res.raise_for_status()
+logger = logging.getLogger(__name__)
+
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+
+_user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "updates": 0, "invalidations": 0}
+
+
+class _Fetch:
+    __slots__ = ("task", "stale")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.stale = False  # در حین درخواست نوشتنی انجام شد؛ نتیجه کش نشود
+
+
+_inflight: Dict[int, _Fetch] = {}
+
+
+async def _fetch_user(telegram_id: int) -> Optional[dict]:
+    client = get_client()
+    res = await client.get(
+        f"/tables/{USERS_TABLE_ID}/records",
+        params={
+            "where": f"(telegram_id,eq,{telegram_id})",
+            "limit": 1
+        }
+    )
+    res.raise_for_status()
 
     data = res.json().get("list", [])
     return data[0] if data else None
 
 
+async def _load(telegram_id: int, fetch: _Fetch) -> Optional[dict]:
+    try:
+        user = await _fetch_user(telegram_id)
+        if user is not None and not fetch.stale:
+            _user_cache.set(str(telegram_id), user)
+        return user
+    finally:
+        if _inflight.get(telegram_id) is fetch:
+            del _inflight[telegram_id]
+
+
+async def get_user_by_telegram_id(telegram_id: int) -> Optional[dict]:
+    """رکورد کاربر (کپی؛ تغییر آن روی کش اثری ندارد)"""
+    telegram_id = int(telegram_id)
+    user = _user_cache.get(str(telegram_id))
+    if user is not None:
+        _stats["hits"] += 1
+        return dict(user)
+
+    fetch = _inflight.get(telegram_id)
+    if fetch is None:
+        _stats["misses"] += 1
+        fetch = _Fetch(None)
+        fetch.task = asyncio.create_task(_load(telegram_id, fetch))
+        _inflight[telegram_id] = fetch
+    else:
+        _stats["coalesced"] += 1
+
+    # shield: لغو یکی از منتظرها درخواست مشترک را لغو نمی‌کند
+    user = await asyncio.shield(fetch.task)
+    return dict(user) if user is not None else None
+
+
+def _detach_inflight(telegram_id: int):
+    """درخواست در جریان (شروع‌شده قبل از نوشتن) نه کش می‌شود و نه خواننده جدید می‌گیرد"""
+    fetch = _inflight.pop(telegram_id, None)
+    if fetch is not None:
+        fetch.stale = True
+
+
+def update_cached_user(telegram_id: int, **fields):
+    """اعمال نوشتن موفق روی رکورد کش‌شده (اگر در کش باشد)"""
+    telegram_id = int(telegram_id)
+    _detach_inflight(telegram_id)
+
+    user = _user_cache.get(str(telegram_id))
+    if user is not None:
+        _user_cache.set(str(telegram_id), {**user, **fields})
+        _stats["updates"] += 1
+
+
+def invalidate_user(telegram_id: int):
+    """حذف کاربر از کش (مثلاً بعد از نوشتن ناموفق یا با نتیجه نامعلوم)"""
+    telegram_id = int(telegram_id)
+    _detach_inflight(telegram_id)
+    _user_cache.delete(str(telegram_id))
+    _stats["invalidations"] += 1
+
+
+def get_user_cache_stats() -> Dict:
+    lookups = _stats["hits"] + _stats["misses"] + _stats["coalesced"]
+    return {
+        **_stats,
+        "size": len(_user_cache),
+        "inflight": len(_inflight),
+        "hit_rate": round((_stats["hits"] + _stats["coalesced"]) / lookups, 3) if lookups else 0.0,
+    }
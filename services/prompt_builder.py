@@ -0,0 +1,142 @@
+# services/prompt_builder.py
+"""
+ساخت پرامپت استخراج با بودجه توکن
+- بخش ثابت (نقش + مرجع فیلدها + قوانین) در system message تا provider بتواند prefix را کش کند
+- بخش متغیر (state فعلی، فیلدهای خواسته‌شده، متن) در user message
+- متن‌های بلند فشرده و قطعه‌قطعه می‌شوند به جای بریدن
+"""
+
+import json
+import re
+import logging
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ایموجی، علائم تزئینی و کاراکترهای کنترلی که اطلاعاتی برای استخراج ندارند
+_DECORATION_RE = re.compile(
+    "["
+    "\U0001F000-\U0001FAFF"
+    "☀-➿"
+    "⬀-⯿"
+    "️‍"
+    "─-◿"
+    "*#~_=|•●▪️➖"
+    "]+"
+)
+_SPACES_RE = re.compile(r"[ \t ]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!؟?\n،,؛])")
+
+
+def estimate_tokens(text: str) -> int:
+    """تخمین تعداد توکن (حدود ۴ بایت UTF-8 برای هر توکن)"""
+    return max(1, len(text.encode("utf-8")) // 4) if text else 0
+
+
+def build_system_prompt(role: str, schema: Dict, rules: str) -> str:
+    """بخش ثابت پرامپت؛ برای همه فراخوانی‌ها یکسان است"""
+    lines = [role, "", "Field reference:"]
+    for name, spec in schema.items():
+        if "enum" in spec:
+            kind = " or ".join(f'"{v}"' for v in spec["enum"])
+        else:
+            kind = spec["type"]
+        description = f" ({spec['description']})" if spec.get("description") else ""
+        lines.append(f"- {name}: {kind}{description}")
+    lines.extend(["", rules.strip()])
+    return "\n".join(lines)
+
+
+def build_user_prompt(text: str, wanted_fields: Iterable[str], known: Optional[Dict] = None) -> str:
+    """بخش متغیر پرامپت: state فعلی، فیلدهای لازم و متن کاربر"""
+    parts = []
+    if known:
+        parts.append("Known: " + json.dumps(known, ensure_ascii=False))
+    parts.append("Wanted: " + ", ".join(wanted_fields))
+    parts.append(f'Text:\n"""{text}"""')
+    return "\n".join(parts)
+
+
+def compress_text(text: str) -> str:
+    """حذف ایموجی/تزئینات، فاصله‌ها و خطوط تکراری"""
+    text = _DECORATION_RE.sub(" ", text)
+    text = _SPACES_RE.sub(" ", text)
+    text = _BLANK_LINES_RE.sub("\n", text)
+
+    seen = set()
+    lines = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if line and line not in seen:
+            seen.add(line)
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def split_segments(text: str, max_tokens: int) -> List[str]:
+    """تقسیم متن در مرز جمله/خط به قطعه‌هایی که هر کدام در بودجه توکن جا شوند"""
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    segments = []
+    current = ""
+    for piece in _SENTENCE_END_RE.split(text):
+        if not piece:
+            continue
+        if current and estimate_tokens(current + piece) > max_tokens:
+            segments.append(current.strip())
+            current = ""
+        # جمله‌ای که به تنهایی از بودجه بزرگ‌تر است در مرز کلمه شکسته می‌شود
+        while estimate_tokens(piece) > max_tokens:
+            words = piece.split(" ")
+            head = ""
+            while words and estimate_tokens(head + " " + words[0]) <= max_tokens:
+                head = (head + " " + words.pop(0)).strip()
+            if not head:
+                head = words.pop(0)
+            segments.append(head)
+            piece = " ".join(words)
+        current += piece
+
+    if current.strip():
+        segments.append(current.strip())
+    return segments
+
+
+class TokenMeter:
+    """شمارنده مصرف توکن فراخوانی‌های LLM"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, usage, label: str = "llm") -> Dict:
+        if usage is None:
+            return {}
+
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+
+        self.calls += 1
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.cached_tokens += cached
+
+        logger.info(f"🧮 [{label}] tokens: prompt={prompt} (cached={cached}) completion={completion}")
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "cached_tokens": cached}
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "avg_tokens_per_call": round(
+                (self.prompt_tokens + self.completion_tokens) / self.calls, 1
+            ) if self.calls else 0.0,
+        }
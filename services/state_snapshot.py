@@ -0,0 +1,67 @@
+# services/state_snapshot.py
+"""
+snapshot باینری session ها برای restart بدون از دست رفتن گفتگوها
+قالب فایل:
+    header: magic (6 بایت) | version (1 بایت) | تعداد رکورد (uint32)
+    record: user_id (int64) | expires_at wall-clock (float64) | طول payload (uint32) | payload (JSON utf-8)
+نوشتن اتمیک است: فایل موقت + fsync + os.replace (فایل قبلی هیچ‌وقت نیمه‌کاره نمی‌شود).
+"""
+
+import logging
+import os
+import struct
+from typing import Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PBSNAP"
+VERSION = 1
+_HEADER = struct.Struct(">6sBI")
+_RECORD = struct.Struct(">qdI")
+
+# (user_id, expires_at, payload)
+SnapshotRecord = Tuple[int, float, bytes]
+
+
+def write_snapshot(path: str, records: List[SnapshotRecord]) -> int:
+    """نوشتن اتمیک همه رکوردها؛ Returns: حجم فایل (بایت)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(records)))
+        for user_id, expires_at, payload in records:
+            f.write(_RECORD.pack(user_id, expires_at, len(payload)))
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def read_snapshot(path: str) -> Iterator[SnapshotRecord]:
+    """خواندن رکوردها؛ فایل نبود/ناسازگار -> هیچ رکوردی، رکورد ناقص آخر -> توقف"""
+    if not os.path.exists(path):
+        return
+
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            logger.warning(f"State snapshot {path} is empty or truncated")
+            return
+
+        magic, version, count = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            logger.warning(f"State snapshot {path} has unknown format (version {version}); ignoring")
+            return
+
+        for index in range(count):
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                logger.warning(f"State snapshot {path} truncated at record {index}/{count}")
+                return
+            user_id, expires_at, length = _RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                logger.warning(f"State snapshot {path} truncated at record {index}/{count}")
+                return
+            yield user_id, expires_at, payload
@@ -0,0 +1,171 @@
+# services/state_store.py
+"""
+ذخیره‌سازی ماندگار state گفتگوها
+- memory: فقط حافظه process (رفتار قبلی؛ با restart پاک می‌شود)
+- sqlite: فایل محلی با WAL؛ نوشتن‌ها دسته‌ای در یک تراکنش
+- redis: هر سرور سازگار با پروتکل Redis (Redis/KeyDB/Valkey)؛ برای اجرای چند process
+کش داغ و write-behind در conversation_state است؛ این کلاس‌ها فقط load/save دسته‌ای انجام می‌دهند.
+state ها قبل از رسیدن به این لایه به JSON تبدیل شده‌اند (dump_state). زمان انقضا wall-clock (time.time) است.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # redis اختیاری است
+    redis = None
+
+# (user_id, state JSON, expires_at)
+StateRecord = Tuple[int, str, float]
+
+
+def dump_state(state: Dict) -> str:
+    return json.dumps(state, ensure_ascii=False, default=str)
+
+
+class StateStore:
+    name = "base"
+
+    def load(self, user_id: int) -> Optional[Tuple[Dict, float]]:
+        """(state, expires_at) یا None اگر نبود/منقضی شده بود"""
+        raise NotImplementedError
+
+    def save_many(self, records: List[StateRecord]):
+        raise NotImplementedError
+
+    def delete_many(self, user_ids: Iterable[int]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """بدون ماندگاری: کش داغ conversation_state تنها نسخه است"""
+
+    name = "memory"
+
+    def load(self, user_id: int) -> Optional[Tuple[Dict, float]]:
+        return None
+
+    def save_many(self, records: List[StateRecord]):
+        pass
+
+    def delete_many(self, user_ids: Iterable[int]):
+        pass
+
+
+class SQLiteStateStore(StateStore):
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS states ("
+            " user_id INTEGER PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_states_expires ON states(expires_at)")
+        self._conn.commit()
+
+    def load(self, user_id: int) -> Optional[Tuple[Dict, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, expires_at FROM states WHERE user_id = ? AND expires_at > ?",
+                (user_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def save_many(self, records: List[StateRecord]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO states (user_id, state, expires_at) VALUES (?, ?, ?)", records
+            )
+            self._conn.execute("DELETE FROM states WHERE expires_at <= ?", (time.time(),))
+
+    def delete_many(self, user_ids: Iterable[int]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM states WHERE user_id = ?", [(uid,) for uid in user_ids])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisStateStore(StateStore):
+    """
+    هر کلید با TTL باقی‌مانده (PX)؛ انقضا را خود سرور انجام می‌دهد
+    client: کلاینت آماده با API redis-py (مثلاً fakeredis در تست‌ها)؛ در غیر این صورت از url ساخته می‌شود
+    """
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, prefix: str = "property-bot:state:", client=None):
+        self.prefix = prefix
+        self._client = client or redis.Redis.from_url(url, socket_timeout=2.0, socket_connect_timeout=2.0)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def load(self, user_id: int) -> Optional[Tuple[Dict, float]]:
+        key = self._key(user_id)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        raw, pttl = pipe.execute()
+        if raw is None or pttl is None or pttl <= 0:
+            return None
+        return json.loads(raw), time.time() + pttl / 1000
+
+    def save_many(self, records: List[StateRecord]):
+        now = time.time()
+        pipe = self._client.pipeline(transaction=False)
+        for user_id, payload, expires_at in records:
+            ttl_ms = int((expires_at - now) * 1000)
+            if ttl_ms > 0:
+                pipe.set(self._key(user_id), payload, px=ttl_ms)
+        pipe.execute()
+
+    def delete_many(self, user_ids: Iterable[int]):
+        keys = [self._key(uid) for uid in user_ids]
+        if keys:
+            self._client.delete(*keys)
+
+    def close(self):
+        self._client.close()
+
+
+def build_state_store(name: Optional[str] = None) -> StateStore:
+    """STATE_BACKEND: memory (پیش‌فرض) | sqlite | redis"""
+    name = name or os.getenv("STATE_BACKEND", "memory")
+
+    if name == "sqlite":
+        return SQLiteStateStore(os.getenv("STATE_DB", "conversation_state.db"))
+
+    if name == "redis":
+        if redis is None:
+            logger.error("STATE_BACKEND=redis but the redis package is not installed; using memory state")
+            return MemoryStateStore()
+        return RedisStateStore(
+            os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0"),
+            os.getenv("STATE_REDIS_PREFIX", "property-bot:state:"),
+        )
+
+    if name != "memory":
+        logger.warning(f"Unknown STATE_BACKEND '{name}'; using memory state")
+    return MemoryStateStore()
@@ -0,0 +1,186 @@
+# services/stt_backends.py
+"""
+backendهای قابل تعویض STT
+- remote: Whisper از طریق API سازگار با OpenAI (AvalAI) پشت circuit breaker
+- local: faster-whisper روی CPU در process pool (مدل یک بار در هر process بارگذاری و گرم نگه داشته می‌شود)
+- local_fallback: local و در صورت خطا/نبود نتیجه، remote
+"""
+
+import asyncio
+import importlib.util
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from services.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+STT_LOCAL_MODEL = os.getenv("STT_LOCAL_MODEL", "small")
+STT_LOCAL_COMPUTE_TYPE = os.getenv("STT_LOCAL_COMPUTE_TYPE", "int8")
+STT_LOCAL_WORKERS = int(os.getenv("STT_LOCAL_WORKERS", "1"))
+STT_LOCAL_THREADS = int(os.getenv("STT_LOCAL_THREADS", "4"))
+STT_LOCAL_TIMEOUT_SECONDS = float(os.getenv("STT_LOCAL_TIMEOUT_SECONDS", "120"))
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "fa")
+
+
+def _read_bytes(audio) -> bytes:
+    if isinstance(audio, (bytes, bytearray)):
+        return bytes(audio)
+    audio.seek(0)
+    return audio.read()
+
+
+class STTBackend:
+    name = "base"
+
+    def available(self) -> bool:
+        return True
+
+    async def transcribe(self, audio, units: float = 1.0) -> str:
+        raise NotImplementedError
+
+    async def warm_up(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class RemoteWhisperBackend(STTBackend):
+    """Whisper روی API سازگار با OpenAI"""
+
+    name = "remote"
+
+    def __init__(self, client, breaker: CircuitBreaker, model: str = "whisper-1"):
+        self.client = client
+        self.breaker = breaker
+        self.model = model
+
+    def available(self) -> bool:
+        return self.breaker.allow_request()
+
+    async def _request(self, audio) -> str:
+        if hasattr(audio, "seek"):
+            audio.seek(0)  # ممکن است backend قبلی (fallback) فایل را خوانده باشد
+        transcription = await self.client.audio.transcriptions.create(
+            model=self.model,
+            file=("voice.ogg", audio)
+        )
+        return transcription.text.strip()
+
+    async def transcribe(self, audio, units: float = 1.0) -> str:
+        return await self.breaker.call(self._request, audio, units=units)
+
+
+# === local (اجرا در process جدا) ===
+
+_local_model = None
+
+
+def _load_local_model():
+    """initializer هر process: مدل فقط یک بار بارگذاری می‌شود"""
+    global _local_model
+    from faster_whisper import WhisperModel
+
+    _local_model = WhisperModel(
+        STT_LOCAL_MODEL,
+        device="cpu",
+        compute_type=STT_LOCAL_COMPUTE_TYPE,
+        cpu_threads=STT_LOCAL_THREADS,
+    )
+
+
+def _local_ping() -> bool:
+    return _local_model is not None
+
+
+def _local_transcribe(data: bytes) -> str:
+    segments, _ = _local_model.transcribe(io.BytesIO(data), language=STT_LANGUAGE or None, vad_filter=True)
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class LocalWhisperBackend(STTBackend):
+    """faster-whisper روی CPU"""
+
+    name = "local"
+
+    def __init__(self, workers: int = STT_LOCAL_WORKERS, timeout: float = STT_LOCAL_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @staticmethod
+    def installed() -> bool:
+        return importlib.util.find_spec("faster_whisper") is not None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_load_local_model)
+        return self._executor
+
+    async def warm_up(self):
+        """بارگذاری مدل در همه processها قبل از اولین پیام صوتی"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _local_ping) for _ in range(self.workers)))
+        logger.info(f"🎙 Local STT model '{STT_LOCAL_MODEL}' loaded in {self.workers} process(es)")
+
+    async def transcribe(self, audio, units: float = 1.0) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_executor(), _local_transcribe, _read_bytes(audio))
+        return await asyncio.wait_for(future, timeout=self.timeout * max(units, 1.0))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class FallbackBackend(STTBackend):
+    """اول primary؛ خطا یا متن خالی -> fallback"""
+
+    def __init__(self, primary: STTBackend, fallback: STTBackend):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def available(self) -> bool:
+        return self.primary.available() or self.fallback.available()
+
+    async def transcribe(self, audio, units: float = 1.0) -> str:
+        if self.primary.available():
+            try:
+                text = await self.primary.transcribe(audio, units)
+                if text:
+                    return text
+                logger.warning(f"STT {self.primary.name} returned no text; trying {self.fallback.name}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"STT {self.primary.name} failed ({e!r}); trying {self.fallback.name}")
+        return await self.fallback.transcribe(audio, units)
+
+    async def warm_up(self):
+        await self.primary.warm_up()
+        await self.fallback.warm_up()
+
+    def shutdown(self):
+        self.primary.shutdown()
+        self.fallback.shutdown()
+
+
+def build_backend(name: str, remote: RemoteWhisperBackend) -> STTBackend:
+    """STT_BACKEND: remote (پیش‌فرض) | local | local_fallback"""
+    if name in ("local", "local_fallback"):
+        if not LocalWhisperBackend.installed():
+            logger.error(f"STT_BACKEND={name} but faster-whisper is not installed; using remote STT")
+            return remote
+        local = LocalWhisperBackend()
+        return local if name == "local" else FallbackBackend(local, remote)
+
+    if name != "remote":
+        logger.warning(f"Unknown STT_BACKEND '{name}'; using remote STT")
+    return remote
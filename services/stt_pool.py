@@ -0,0 +1,152 @@
+# services/stt_pool.py
+"""
+صف اولویت‌دار و worker pool محدود برای تبدیل صدا
+- صداهای کوتاه‌تر زودتر پردازش می‌شوند (اولویت = مدت صدا، سپس ترتیب ورود)
+- هر درخواست timeout کلی (انتظار در صف + پردازش) دارد
+- پیام صوتی جدیدتر همان کاربر، درخواست قبلی او را لغو می‌کند
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class STTQueueFull(Exception):
+    """صف تبدیل صدا پر است"""
+
+
+class STTSuperseded(Exception):
+    """درخواست با پیام صوتی جدیدتر همان کاربر لغو شد"""
+
+
+class _Job:
+    __slots__ = ("user_id", "func", "future", "deadline", "enqueued_at", "task", "superseded")
+
+    def __init__(self, user_id: int, func: Callable[[], Awaitable], future: asyncio.Future, deadline: float):
+        self.user_id = user_id
+        self.func = func
+        self.future = future
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.superseded = False
+
+
+class STTWorkerPool:
+    def __init__(self, workers: int = 3, max_queue: int = 100, timeout: float = 120.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._active: Dict[int, _Job] = {}
+        self._closing = False
+        self.completed = 0
+        self.cancelled = 0
+        self.timed_out = 0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(self.max_queue)
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.workers:
+            self._workers.append(asyncio.create_task(self._worker(len(self._workers))))
+
+    def cancel_user(self, user_id: int) -> bool:
+        """لغو درخواست در حال انتظار/اجرای کاربر"""
+        job = self._active.pop(user_id, None)
+        if job is None or job.future.done():
+            return False
+        job.superseded = True
+        job.future.cancel()
+        self.cancelled += 1
+        logger.info(f"🛑 STT job of user {user_id} cancelled")
+        return True
+
+    async def submit(self, user_id: int, duration: float, func: Callable[[], Awaitable]):
+        """
+        افزودن درخواست به صف و انتظار برای نتیجه (event loop آزاد می‌ماند)
+        Raises: STTQueueFull, asyncio.TimeoutError, STTSuperseded
+        """
+        self._ensure_started()
+        self.cancel_user(user_id)
+
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(user_id, func, future, time.monotonic() + self.timeout)
+        future.add_done_callback(lambda f, job=job: self._on_done(job))
+        try:
+            self._queue.put_nowait((duration or 0, next(self._seq), job))
+        except asyncio.QueueFull:
+            raise STTQueueFull()
+        self._active[user_id] = job
+
+        try:
+            return await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        except asyncio.CancelledError:
+            if job.superseded:
+                raise STTSuperseded() from None
+            raise
+
+    def _on_done(self, job: _Job):
+        if self._active.get(job.user_id) is job:
+            del self._active[job.user_id]
+        if job.future.cancelled() and job.task and not job.task.done():
+            job.task.cancel()
+
+    async def _worker(self, index: int):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                if job.future.done():
+                    continue  # لغو شده در صف
+                if time.monotonic() >= job.deadline:
+                    job.future.cancel()
+                    continue
+
+                waited = time.monotonic() - job.enqueued_at
+                logger.debug(f"STT worker {index} picked user {job.user_id} after {waited:.2f}s in queue")
+
+                job.task = asyncio.create_task(job.func())
+                try:
+                    result = await job.task
+                except asyncio.CancelledError:
+                    if self._closing:
+                        raise  # خود worker لغو شده (shutdown)
+                    continue
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    continue
+
+                if not job.future.done():
+                    job.future.set_result(result)
+                    self.completed += 1
+            finally:
+                self._queue.task_done()
+
+    async def shutdown(self):
+        self._closing = True
+        for job in list(self._active.values()):
+            job.future.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> Dict:
+        return {
+            "workers": len([w for w in self._workers if not w.done()]),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "active_users": len(self._active),
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "timed_out": self.timed_out,
+        }
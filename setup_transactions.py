@@ -13,6 +13,12 @@ fields = [
     {'title': 'description', 'uidt': 'SingleLineText'},
     {'title': 'reference_id', 'uidt': 'SingleLineText'},
     {'title': 'status', 'uidt': 'SingleLineText'},
+    # credit ledger (services/nocodb/ledger.py)
+    {'title': 'balance_after', 'uidt': 'Number'},
+    {'title': 'ledger_version', 'uidt': 'Number'},
+    # must be unique: acts as compare-and-set for concurrent balance changes (check with verify_ledger.py)
+    {'title': 'ledger_key', 'uidt': 'SingleLineText', 'meta': {'unique': True}, 'unique': True},
+    {'title': 'ledger_entry', 'uidt': 'SingleLineText'},
 ]
 
 for f in fields:
@@ -13,6 +13,9 @@ fields = [
     {'title': 'last_name', 'uidt': 'SingleLineText'},
     {'title': 'phone', 'uidt': 'SingleLineText'},
     {'title': 'credit', 'uidt': 'Number'},
+    {'title': 'balance', 'uidt': 'Number'},
+    # ledger version already written into balance; lets the ledger detect manual balance edits
+    {'title': 'balance_version', 'uidt': 'Number'},
     {'title': 'total_charged', 'uidt': 'Number'},
     {'title': 'is_admin', 'uidt': 'Checkbox'},
     {'title': 'is_active', 'uidt': 'Checkbox'},
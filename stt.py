@@ -1,37 +1,234 @@
 # stt.py - UPDATED FOR AvalAI
+import asyncio
+import hashlib
+import logging
 import tempfile
 import os
-from openai import OpenAI
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from openai import AsyncOpenAI
 from config import AVALAIGPT_API_KEY  # ✅ تغییر نام
+from services.cache import LRUCache, SQLiteCache, TieredCache
+from services.circuit_breaker import CircuitOpenError, get_breaker
+from services.stt_pool import STTWorkerPool
+from services.stt_backends import RemoteWhisperBackend, build_backend
+from services.audio_preprocess import (
+    STT_CHUNK_THRESHOLD_SECONDS,
+    preprocess_audio,
+    preprocess_enabled,
+    split_audio,
+)
+
+logger = logging.getLogger(__name__)
+
+# سقف timeout تبدیل صدا؛ timeout واقعی از تأخیرهای اخیر (به ازای هر STT_UNIT_SECONDS ثانیه صوت) تطبیق می‌یابد
+STT_TIMEOUT_SECONDS = float(os.getenv("STT_TIMEOUT_SECONDS", "60"))
+STT_MIN_TIMEOUT_SECONDS = float(os.getenv("STT_MIN_TIMEOUT_SECONDS", "8"))
+STT_UNIT_SECONDS = float(os.getenv("STT_UNIT_SECONDS", "15"))
+# صدا در حافظه نگه داشته می‌شود؛ فقط فایل‌های بزرگ‌تر از این اندازه روی دیسک می‌روند
+STT_SPOOL_MAX_BYTES = int(os.getenv("STT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+# تعداد قطعه‌های هم‌زمان یک صدای بلند
+STT_CHUNK_CONCURRENCY = int(os.getenv("STT_CHUNK_CONCURRENCY", "3"))
+
+# دریافت متن هر قطعه به ترتیب، به محض آماده شدن
+PartialCallback = Callable[[str], Awaitable]
+
+# کش متن صداها (فوروارد یک صدا = همان file_unique_id)؛ خالی بودن STT_CACHE_DB = فقط حافظه
+STT_CACHE_SIZE = int(os.getenv("STT_CACHE_SIZE", "2048"))
+STT_CACHE_DB = os.getenv("STT_CACHE_DB", "stt_cache.db")
+STT_CACHE_TTL_SECONDS = float(os.getenv("STT_CACHE_TTL_SECONDS", str(30 * 86400)))
+STT_CACHE_DB_MAX_ITEMS = int(os.getenv("STT_CACHE_DB_MAX_ITEMS", "50000"))
+
+transcript_cache = TieredCache(
+    "transcripts",
+    LRUCache(STT_CACHE_SIZE, STT_CACHE_TTL_SECONDS),
+    SQLiteCache(STT_CACHE_DB, STT_CACHE_TTL_SECONDS, STT_CACHE_DB_MAX_ITEMS)
+    if STT_CACHE_DB else None,
+)
+
+
+async def get_cached_transcript(file_unique_id: Optional[str]) -> Optional[str]:
+    """متن ذخیره‌شده برای file_unique_id تلگرام (قبل از get_file/دانلود)"""
+    if not file_unique_id:
+        return None
+    return await transcript_cache.get(f"uid:{file_unique_id}")
+
+
+async def _store_transcript(text: str, file_unique_id: Optional[str], content_hash: str):
+    if not text:
+        return
+    await transcript_cache.set(f"sha:{content_hash}", text)
+    if file_unique_id:
+        await transcript_cache.set(f"uid:{file_unique_id}", text)
+
 
-client = OpenAI(
+def get_transcript_cache_stats():
+    return transcript_cache.stats()
+
+
+client = AsyncOpenAI(
     api_key=AVALAIGPT_API_KEY,  # ✅ تغییر نام
-    base_url="https://api.avalai.ir/v1"  # ✅ آدرس جدید
+    base_url="https://api.avalai.ir/v1",  # ✅ آدرس جدید
+    timeout=STT_TIMEOUT_SECONDS
+)
+
+
+async def _probe():
+    """درخواست سبک برای بررسی بازگشت سرویس STT"""
+    await client.models.list()
+
+
+stt_breaker = get_breaker(
+    "stt:avalai",
+    failure_threshold=int(os.getenv("STT_MAX_CONSECUTIVE_FAILURES", "3")),
+    recovery_timeout=float(os.getenv("STT_FAILURE_COOLDOWN_SECONDS", "30")),
+    min_timeout=STT_MIN_TIMEOUT_SECONDS,
+    max_timeout=STT_TIMEOUT_SECONDS,
+    probe=_probe,
 )
 
-async def voice_to_text(voice_file) -> str:
+
+# backend انتخابی: remote (پیش‌فرض)، local (faster-whisper) یا local_fallback
+STT_BACKEND = os.getenv("STT_BACKEND", "remote")
+
+remote_backend = RemoteWhisperBackend(client, stt_breaker)
+stt_backend = build_backend(STT_BACKEND, remote_backend)
+
+
+async def _transcribe_chunks(
+    chunks: List[bytes], duration: Optional[int], on_partial: Optional[PartialCallback]
+) -> Tuple[str, bool]:
+    """
+    تبدیل موازی قطعه‌ها و چسباندن به ترتیب
+    متن هر قطعه به محض اینکه خودش و همه قطعه‌های قبلی آماده شدند به on_partial داده می‌شود.
+    Returns: (متن کامل, همه قطعه‌ها موفق بودند)
+    """
+    semaphore = asyncio.Semaphore(STT_CHUNK_CONCURRENCY)
+    units = (duration or 0) / len(chunks) / STT_UNIT_SECONDS
+
+    async def one(index: int, chunk: bytes) -> str:
+        async with semaphore:
+            try:
+                return await stt_backend.transcribe(chunk, units)
+            except Exception as e:
+                logger.error(f"STT chunk {index} failed: {e!r}")
+                return ""
+
+    tasks = [asyncio.create_task(one(i, chunk)) for i, chunk in enumerate(chunks)]
+    texts = []
+    complete = True
+    try:
+        for task in tasks:
+            text = await task
+            if not text:
+                complete = False
+                continue
+            texts.append(text)
+            if on_partial:
+                await on_partial(text)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return " ".join(texts), complete
+
+
+async def voice_to_text(voice_file, duration: Optional[int] = None, on_partial: Optional[PartialCallback] = None) -> str:
     """
     Download telegram voice file and convert to text via Whisper
+    دانلود مستقیم در حافظه (SpooledTemporaryFile فقط بالای STT_SPOOL_MAX_BYTES روی دیسک می‌رود)
+    duration: طول صدا (ثانیه) برای timeout متناسب
+    on_partial: برای صداهای بلند (چند قطعه)، متن قطعه‌ها به ترتیب به این callback داده می‌شود
+    Raises: CircuitOpenError اگر سرویس STT موقتاً در دسترس نباشد
     """
+    if not stt_backend.available():
+        raise CircuitOpenError(stt_breaker.name)
 
-    with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_audio:
-        temp_path = temp_audio.name
+    # فایل spill شده بدون نام ساخته می‌شود و حتی با crash در /tmp باقی نمی‌ماند
+    with tempfile.SpooledTemporaryFile(max_size=STT_SPOOL_MAX_BYTES) as audio:
+        try:
+            await voice_file.download_to_memory(audio)
+            audio.seek(0)
 
-    # ✅ async download
-    await voice_file.download_to_drive(temp_path)
+            # کش بر اساس محتوای صدا (file_unique_id متفاوت ولی همان فایل)
+            file_unique_id = getattr(voice_file, "file_unique_id", None)
+            content_hash = _hash_audio(audio)
+            cached = await transcript_cache.get(f"sha:{content_hash}")
+            if cached is not None:
+                logger.info("🎧 Transcript cache hit (content hash)")
+                await _store_transcript(cached, file_unique_id, content_hash)
+                return cached
 
-    try:
-        with open(temp_path, "rb") as audio:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio
-            )
-        return transcription.text.strip()
+            text, complete = await _transcribe_audio(audio, duration, on_partial)
+            if complete:
+                await _store_transcript(text, file_unique_id, content_hash)
+            return text
+
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"STT ERROR: {e!r}")
+            return ""
+
+
+def _hash_audio(audio) -> str:
+    digest = hashlib.sha256()
+    for block in iter(lambda: audio.read(64 * 1024), b""):
+        digest.update(block)
+    audio.seek(0)
+    return digest.hexdigest()
+
+
+async def _transcribe_audio(
+    audio, duration: Optional[int], on_partial: Optional[PartialCallback]
+) -> Tuple[str, bool]:
+    """پیش‌پردازش (و در صورت نیاز تقسیم) و ارسال به Whisper؛ Returns: (متن, قابل کش)"""
+    # حذف سکوت، mono و 16kHz (در process pool) برای آپلود کوچک‌تر
+    if not preprocess_enabled():
+        payload = audio
+    elif (duration or 0) > STT_CHUNK_THRESHOLD_SECONDS:
+        # صدای بلند: تقسیم در سکوت‌ها و تبدیل موازی
+        data = audio.read()
+        chunks = await split_audio(data) or [data]
+        if len(chunks) > 1:
+            return await _transcribe_chunks(chunks, duration, on_partial)
+        payload = chunks[0]
+    else:
+        payload = await preprocess_audio(audio.read())
 
+    units = (duration or 0) / STT_UNIT_SECONDS
+    return await stt_backend.transcribe(payload, units), True
+
+
+# === صف و worker pool ===
+STT_MAX_WORKERS = int(os.getenv("STT_MAX_WORKERS", "3"))
+STT_QUEUE_MAX = int(os.getenv("STT_QUEUE_MAX", "100"))
+# سقف کل هر درخواست (انتظار در صف + دانلود + تبدیل)
+STT_REQUEST_TIMEOUT_SECONDS = float(os.getenv("STT_REQUEST_TIMEOUT_SECONDS", "120"))
+
+stt_pool = STTWorkerPool(STT_MAX_WORKERS, STT_QUEUE_MAX, STT_REQUEST_TIMEOUT_SECONDS)
+
+
+async def transcribe(
+    user_id: int, voice_file, duration: Optional[int] = None, on_partial: Optional[PartialCallback] = None
+) -> str:
+    """
+    تبدیل صدا از طریق صف اولویت‌دار (صدای کوتاه‌تر زودتر)
+    Raises: STTQueueFull, STTSuperseded, asyncio.TimeoutError, CircuitOpenError
+    """
+    if not stt_backend.available():
+        raise CircuitOpenError(stt_breaker.name)
+    return await stt_pool.submit(user_id, duration or 0, lambda: voice_to_text(voice_file, duration, on_partial))
+
+
+async def warm_up_stt():
+    """بارگذاری مدل محلی (در صورت انتخاب) هنگام شروع ربات"""
+    logger.info(f"STT backend: {stt_backend.name}")
+    try:
+        await stt_backend.warm_up()
     except Exception as e:
-        print("STT ERROR:", e)
-        return ""
+        logger.error(f"STT warm-up failed: {e!r}")
 
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+
+def shutdown_stt_backend():
+    stt_backend.shutdown()
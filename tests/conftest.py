@@ -0,0 +1,16 @@
+# tests/conftest.py
+"""تنظیمات مشترک تست‌ها: env ساختگی قبل از import ماژول‌های ربات"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+for _name in ("BOT_TOKEN", "AVALAIGPT_API_KEY", "NOCODB_TOKEN"):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("NOCODB_URL", "http://127.0.0.1:9")
+# کش‌ها و snapshot فقط در حافظه؛ تست‌ها فایلی در ریشه repo نمی‌سازند
+for _name in ("EXTRACTION_CACHE_DB", "STT_CACHE_DB", "STATE_SNAPSHOT_PATH"):
+    os.environ.setdefault(_name, "")
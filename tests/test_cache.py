@@ -0,0 +1,49 @@
+# tests/test_cache.py
+"""تست‌های کش دو لایه (services/cache.py)"""
+
+import asyncio
+
+from services.cache import LRUCache, SQLiteCache, TieredCache
+
+
+def test_sqlite_get_does_not_write(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.db"))
+    disk.set("k", {"a": 1})
+    changes = disk._conn.total_changes
+
+    assert disk.get("k") == {"a": 1}
+    assert disk.get("missing") is None
+    assert disk._conn.total_changes == changes
+
+
+def test_sqlite_access_time_is_written_with_next_set(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.db"), max_items=2, evict_every=1)
+    disk.set("old", 1)
+    disk.set("new", 2)
+    disk.get("old")  # «old» اخیراً استفاده شده؛ «new» باید حذف شود
+    disk.set("newest", 3)
+
+    assert disk.get("old") == 1
+    assert disk.get("new") is None
+    assert len(disk) == 2
+
+
+def test_sqlite_expired_entries_are_not_returned(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.db"), ttl_seconds=-1)
+    disk.set("k", "v")
+    assert disk.get("k") is None
+
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    async def run():
+        path = str(tmp_path / "cache.db")
+        await TieredCache("t", LRUCache(8), SQLiteCache(path)).set("k", "v")
+
+        cache = TieredCache("t", LRUCache(8), SQLiteCache(path))
+        assert await cache.get("k") == "v"
+        assert await cache.get("k") == "v"
+        assert await cache.get("missing") is None
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
@@ -0,0 +1,35 @@
+# tests/test_circuit_breaker.py
+"""تست‌های circuit breaker: timeout تطبیقی و آستانه کندی"""
+
+import random
+
+from services.circuit_breaker import CLOSED, OPEN, CircuitBreaker
+
+
+def test_steady_latency_never_opens_the_breaker():
+    breaker = CircuitBreaker("test:steady", min_timeout=4.0, max_timeout=15.0)
+    rng = random.Random(7)
+    for _ in range(300):
+        breaker.record_success(rng.uniform(4.5, 5.0))
+
+    assert breaker.state == CLOSED
+    assert breaker.times_opened == 0
+
+
+def test_calls_near_the_timeout_cap_open_the_breaker():
+    breaker = CircuitBreaker("test:slow", min_timeout=4.0, max_timeout=15.0, slow_call_threshold=3)
+    for _ in range(3):
+        breaker.record_success(13.0)
+
+    assert breaker.state == OPEN
+
+
+def test_configured_slow_call_seconds_scales_with_units():
+    breaker = CircuitBreaker("test:units", slow_call_seconds=2.0, slow_call_threshold=2, max_timeout=60.0)
+    for _ in range(5):
+        breaker.record_success(15.0, units=10)  # 1.5s per unit
+    assert breaker.state == CLOSED
+
+    for _ in range(2):
+        breaker.record_success(25.0, units=10)
+    assert breaker.state == OPEN
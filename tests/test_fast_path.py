@@ -0,0 +1,48 @@
+# tests/test_fast_path.py
+"""تست‌های مسیر سریع پاسخ به فیلد pending (بدون LLM)"""
+
+import pytest
+
+from bot_processor_core.processor import _try_fast_path
+
+
+@pytest.mark.parametrize("pending, text, expected", [
+    ("transaction_type", "فروش", "فروش"),
+    ("transaction_type", "رهن و اجاره", "رهن و اجاره"),
+    ("transaction_type", "🏗 پیش‌فروش", "پیش‌فروش"),
+    ("property_type", "آپارتمان", "آپارتمان"),
+    ("property_type", "دفتر کار", "دفتر کار"),
+    ("usage_type", "مسکونی", "مسکونی"),
+    ("has_parking", "بله", True),
+    ("has_parking", "پارکینگ دارد", True),
+    ("neighborhood", "گلسار", "گلسار"),
+    ("owner_name", "آقای رضایی", "آقای رضایی"),
+    ("area", "۱۲۰ متر", 120),
+    ("area", "120", 120),
+    ("bedroom_count", "۳ خواب", 3),
+    ("floor", "۴ طبقه", 4),
+    ("total_floors", "۵ طبقه", 5),
+    ("price_total", "۵ میلیارد", 5_000_000_000),
+])
+def test_single_value_takes_fast_path(pending, text, expected):
+    assert _try_fast_path(pending, text) == (True, expected)
+
+
+@pytest.mark.parametrize("pending, text", [
+    ("transaction_type", "فروش آپارتمان"),
+    ("property_type", "آپارتمان مسکونی"),
+    ("property_type", "ویلا فروشی"),
+    ("usage_type", "مسکونی تجاری"),
+    ("has_parking", "آسانسور ندارد"),
+    ("owner_name", "رضایی فروش آپارتمان"),
+    # واحد نامربوط با فیلد pending
+    ("bedroom_count", "۱۲۰ متر"),
+    ("area", "۳ خواب"),
+    ("floor", "۸۵ متری"),
+    ("build_year", "۵ سال"),
+    # خارج از بازه منطقی
+    ("bedroom_count", "۴۵"),
+    ("area", "۳"),
+])
+def test_extra_information_falls_through_to_extraction(pending, text):
+    assert _try_fast_path(pending, text) == (False, None)
@@ -0,0 +1,328 @@
+# tests/test_ledger.py
+"""تست‌های ledger اعتبار روی یک NocoDB جعلی (httpx.MockTransport) و ledger محلی SQLite"""
+
+import asyncio
+import json
+import re
+
+import httpx
+import pytest
+
+import services.nocodb.base as nocodb_base
+import services.nocodb.credit as credit
+import services.nocodb.users as users
+from services.nocodb.ledger import LedgerMisconfigured, NocoDBLedger, SQLiteLedger
+from services.nocodb.tables import TRANSACTIONS_TABLE_ID, USERS_TABLE_ID
+
+_WHERE_RE = re.compile(r"\((\w+),(eq|gt),([^)]*)\)")
+
+
+class FakeNocoDB:
+    """فقط بخشی از API v2 که ledger و کش کاربران استفاده می‌کنند"""
+
+    def __init__(self, unique_ledger_key: bool = True):
+        self.unique_ledger_key = unique_ledger_key
+        self.tables = {USERS_TABLE_ID: [], TRANSACTIONS_TABLE_ID: []}
+        self.columns = {
+            USERS_TABLE_ID: ["Id", "telegram_id", "balance", "balance_version"],
+            TRANSACTIONS_TABLE_ID: ["Id", "user_id", "amount", "type", "description", "balance_after",
+                                    "ledger_version", "ledger_key", "ledger_entry", "reference_id"],
+        }
+        self.next_id = 1
+        self.posts = 0
+        self.fail_after_commit = 0  # تعداد درج‌هایی که ثبت می‌شوند ولی پاسخ آن‌ها timeout می‌شود
+        self.reject_insert = None  # (status, body)
+
+    def add_user(self, telegram_id: int, balance: int, **fields) -> dict:
+        user = {"Id": self.next_id, "telegram_id": telegram_id, "balance": balance, **fields}
+        self.next_id += 1
+        self.tables[USERS_TABLE_ID].append(user)
+        return user
+
+    def user(self, telegram_id: int) -> dict:
+        return next(u for u in self.tables[USERS_TABLE_ID] if u["telegram_id"] == telegram_id)
+
+    def ledger_rows(self, telegram_id: int) -> list:
+        return [
+            r for r in self.tables[TRANSACTIONS_TABLE_ID]
+            if r.get("user_id") == telegram_id and (r.get("ledger_version") or 0) > 0
+        ]
+
+    def _select(self, table_id: str, params) -> list:
+        rows = self.tables[table_id]
+        for field, op, value in _WHERE_RE.findall(params.get("where", "")):
+            if op == "eq":
+                rows = [r for r in rows if str(r.get(field)) == value]
+            else:
+                rows = [r for r in rows if (r.get(field) or 0) > float(value)]
+        sort = params.get("sort")
+        if sort:
+            field = sort.lstrip("-")
+            rows = sorted(rows, key=lambda r: r.get(field) or 0, reverse=sort.startswith("-"))
+        return rows[: int(params.get("limit", 25))]
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0)  # درخواست‌های هم‌زمان در هم تنیده شوند
+        path = request.url.path.removeprefix("/api/v2")
+
+        meta = re.fullmatch(r"/meta/tables/(\w+)", path)
+        if meta:
+            return httpx.Response(200, json={"columns": [{"title": c} for c in self.columns[meta.group(1)]]})
+
+        table_id = re.fullmatch(r"/tables/(\w+)/records", path).group(1)
+        rows = self.tables[table_id]
+
+        if request.method == "GET":
+            return httpx.Response(200, json={"list": self._select(table_id, request.url.params)})
+
+        body = json.loads(request.content)
+        if request.method == "PATCH":
+            next(r for r in rows if r["Id"] == body["Id"]).update(body)
+            return httpx.Response(200, json={"Id": body["Id"]})
+
+        if request.method == "DELETE":
+            ids = {item["Id"] for item in body}
+            self.tables[table_id] = [r for r in rows if r["Id"] not in ids]
+            return httpx.Response(200, json=body)
+
+        self.posts += 1
+        if self.reject_insert:
+            status, text = self.reject_insert
+            return httpx.Response(status, json={"msg": text})
+        if self.unique_ledger_key and any(r.get("ledger_key") == body.get("ledger_key") for r in rows):
+            return httpx.Response(409, json={"msg": "Duplicate entry for ledger_key"})
+        row = {"Id": self.next_id, **body}
+        self.next_id += 1
+        rows.append(row)
+        if self.fail_after_commit:
+            self.fail_after_commit -= 1
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(200, json={"Id": row["Id"]})
+
+
+def _run(fake: FakeNocoDB, monkeypatch, scenario):
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler), base_url="http://nocodb/api/v2")
+        monkeypatch.setattr(nocodb_base, "_client", client)
+        try:
+            return await scenario()
+        finally:
+            await client.aclose()
+
+    users._user_cache.clear()
+    users._inflight.clear()
+    return asyncio.run(run())
+
+
+@pytest.fixture(params=["nocodb", "sqlite"])
+def make_ledger(request, tmp_path):
+    def make():
+        if request.param == "sqlite":
+            return SQLiteLedger(str(tmp_path / "ledger.db"))
+        return NocoDBLedger(max_retries=10, backoff=0)
+    return make
+
+
+def test_concurrent_consumes_never_overdraw(make_ledger, monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5001, 100)
+    ledger = make_ledger()
+
+    async def scenario():
+        return await asyncio.gather(*(
+            ledger.apply(5001, -40, "consume", "usage", require_funds=True) for _ in range(5)
+        ))
+
+    results = _run(fake, monkeypatch, scenario)
+    assert sum(r["success"] for r in results) == 2
+    assert sorted(r["new_balance"] for r in results if r["success"]) == [20, 60]
+    assert fake.user(5001)["balance"] == 20
+    if isinstance(ledger, NocoDBLedger):
+        assert ledger.conflicts > 0
+        assert [r["balance_after"] for r in sorted(fake.ledger_rows(5001), key=lambda r: r["ledger_version"])] == [60, 20]
+
+
+def test_require_funds_rejection_writes_nothing(make_ledger, monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5002, 30)
+    ledger = make_ledger()
+
+    async def scenario():
+        return await ledger.apply(5002, -50, "consume", "usage", require_funds=True)
+
+    result = _run(fake, monkeypatch, scenario)
+    assert result == {"success": False, "current_balance": 30, "new_balance": 30, "transaction_id": None}
+    assert fake.ledger_rows(5002) == []
+    assert fake.user(5002)["balance"] == 30
+
+
+def test_balance_is_seeded_from_users_and_materialized(make_ledger, monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5003, 500)
+    ledger = make_ledger()
+
+    async def scenario():
+        await ledger.apply(5003, 250, "charge", "top-up")
+        return await users.get_user_by_telegram_id(5003), await ledger.balance(5003)
+
+    cached, balance = _run(fake, monkeypatch, scenario)
+    assert balance == 750
+    assert fake.user(5003)["balance"] == 750
+    assert fake.user(5003)["balance_version"] == 1
+    assert cached["balance"] == 750
+
+
+def test_timeout_after_commit_is_not_applied_twice(monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5004, 100)
+    fake.fail_after_commit = 1
+    ledger = NocoDBLedger(backoff=0)
+
+    async def scenario():
+        return await ledger.apply(5004, -30, "consume", "usage", require_funds=True)
+
+    result = _run(fake, monkeypatch, scenario)
+    assert result["success"] and result["new_balance"] == 70
+    assert len(fake.ledger_rows(5004)) == 1
+    assert fake.user(5004)["balance"] == 70
+
+
+def test_retry_with_same_ledger_key_is_rejected(monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5005, 100)
+    ledger = NocoDBLedger(backoff=0)
+
+    async def scenario():
+        row = {"user_id": 5005, "amount": -10, "balance_after": 90, "ledger_version": 1, "ledger_key": "5005:1"}
+        return await ledger._insert(row), await ledger._insert(dict(row))
+
+    first, second = _run(fake, monkeypatch, scenario)
+    assert first is not None
+    assert second is None
+    assert len(fake.ledger_rows(5005)) == 1
+
+
+def test_rollback_by_transaction_id_restores_balance(make_ledger, monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5006, 100)
+    ledger = make_ledger()
+    monkeypatch.setattr(credit, "ledger", ledger)
+
+    async def scenario():
+        consumed = await credit.consume_credit(5006, 30, "extraction")
+        balance = await credit.charge_credit(5006, 30, "rollback", ref_transaction_id=consumed["transaction_id"])
+        return consumed, balance
+
+    consumed, balance = _run(fake, monkeypatch, scenario)
+    assert consumed["success"] and consumed["new_balance"] == 70
+    assert balance == 100
+    assert fake.user(5006)["balance"] == 100
+    if isinstance(ledger, NocoDBLedger):
+        refund = max(fake.ledger_rows(5006), key=lambda r: r["ledger_version"])
+        assert refund["reference_id"] == consumed["transaction_id"]
+
+
+def test_external_balance_edit_is_reconciled(make_ledger, monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5007, 100)
+    ledger = make_ledger()
+
+    async def scenario():
+        await ledger.apply(5007, -20, "consume", "usage")
+        fake.user(5007)["balance"] = 1080  # ادمین در NocoDB 1000 اضافه کرد
+        users.invalidate_user(5007)
+        return await ledger.apply(5007, -30, "consume", "usage", require_funds=True)
+
+    result = _run(fake, monkeypatch, scenario)
+    assert result["success"]
+    assert result["new_balance"] == 1050
+    assert fake.user(5007)["balance"] == 1050
+    if isinstance(ledger, NocoDBLedger):
+        types = [r["type"] for r in sorted(fake.ledger_rows(5007), key=lambda r: r["ledger_version"])]
+        assert types == ["consume", "adjustment", "consume"]
+
+
+def test_stale_materialized_balance_is_not_treated_as_edit(monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5008, 100)
+    ledger = NocoDBLedger(backoff=0)
+
+    async def scenario():
+        await ledger.apply(5008, -20, "consume", "usage")
+        # materialize نسخه 1 نرسیده است: balance_version عقب‌تر از ledger
+        fake.user(5008).update({"balance": 100, "balance_version": 0})
+        users.invalidate_user(5008)
+        return await ledger.balance(5008)
+
+    assert _run(fake, monkeypatch, scenario) == 80
+    assert len(fake.ledger_rows(5008)) == 1
+
+
+def test_validation_error_is_raised_without_retry(monkeypatch):
+    fake = FakeNocoDB()
+    fake.add_user(5009, 100)
+    fake.reject_insert = (400, "Column 'ledger_entry' not found")
+    ledger = NocoDBLedger(backoff=0)
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await ledger.apply(5009, -10, "consume", "usage")
+
+    _run(fake, monkeypatch, scenario)
+    assert fake.posts == 1
+    assert fake.user(5009)["balance"] == 100
+
+
+def test_verify_accepts_unique_ledger_key(monkeypatch):
+    fake = FakeNocoDB()
+
+    async def scenario():
+        await NocoDBLedger().verify()
+
+    _run(fake, monkeypatch, scenario)
+    assert fake.tables[TRANSACTIONS_TABLE_ID] == []  # ردیف آزمایشی پاک شده است
+
+
+def test_verify_refuses_non_unique_ledger_key(monkeypatch):
+    fake = FakeNocoDB(unique_ledger_key=False)
+
+    async def scenario():
+        with pytest.raises(LedgerMisconfigured):
+            await NocoDBLedger().verify()
+
+    _run(fake, monkeypatch, scenario)
+    assert fake.tables[TRANSACTIONS_TABLE_ID] == []
+
+
+def test_verify_refuses_missing_columns(monkeypatch):
+    fake = FakeNocoDB()
+    fake.columns[USERS_TABLE_ID].remove("balance_version")
+
+    async def scenario():
+        with pytest.raises(LedgerMisconfigured):
+            await NocoDBLedger().verify()
+
+    _run(fake, monkeypatch, scenario)
+
+
+def test_check_is_read_only(monkeypatch):
+    fake = FakeNocoDB(unique_ledger_key=False)
+
+    async def scenario():
+        await NocoDBLedger().check()
+
+    _run(fake, monkeypatch, scenario)
+    assert fake.posts == 0
+
+
+def test_verify_removes_leftover_probe_rows(monkeypatch):
+    fake = FakeNocoDB()
+    fake.tables[TRANSACTIONS_TABLE_ID].append(
+        {"Id": 999, "user_id": 0, "type": "ledger_probe", "ledger_version": 0, "ledger_key": "probe:old"}
+    )
+
+    async def scenario():
+        await NocoDBLedger().verify()
+
+    _run(fake, monkeypatch, scenario)
+    assert fake.tables[TRANSACTIONS_TABLE_ID] == []
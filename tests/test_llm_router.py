@@ -0,0 +1,54 @@
+# tests/test_llm_router.py
+"""تست‌های hedge در LLMRouter"""
+
+import asyncio
+from types import SimpleNamespace
+
+import services.llm_router as llm_router
+from services.llm_router import LLMProvider, LLMRouter
+
+
+def _provider(name: str, delay: float, calls: list) -> LLMProvider:
+    provider = LLMProvider(name, "http://llm.invalid/v1", "test", "test-model")
+
+    async def create(**kwargs):
+        calls.append(name)
+        await asyncio.sleep(delay)
+        return name
+
+    provider.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return provider
+
+
+def test_single_provider_is_never_hedged(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_DEFAULT_DELAY", 0.01)
+    calls = []
+    router = LLMRouter([_provider("hedge-single", 0.05, calls)], hedge_enabled=True)
+
+    assert asyncio.run(router.chat(messages=[])) == "hedge-single"
+    assert calls == ["hedge-single"]
+    assert router.hedged_requests == 0
+
+
+def test_slow_primary_is_hedged_to_another_provider(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_DEFAULT_DELAY", 0.01)
+    calls = []
+    slow = _provider("hedge-slow", 0.2, calls)
+    fast = _provider("hedge-fast", 0.0, calls)
+    router = LLMRouter([slow, fast], hedge_enabled=True)
+    monkeypatch.setattr(router, "ranked", lambda: [slow, fast])
+
+    assert asyncio.run(router.chat(messages=[])) == "hedge-fast"
+    assert calls == ["hedge-slow", "hedge-fast"]
+    assert router.hedge_wins == 1
+
+
+def test_hedge_delay_needs_enough_samples(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_MIN_SAMPLES", 5)
+    provider = _provider("hedge-samples", 0.0, [])
+    provider.latencies.extend([0.1, 0.2])
+    assert LLMRouter.hedge_delay(provider) == llm_router.LLM_HEDGE_DEFAULT_DELAY
+
+    provider.latencies.extend([0.3, 0.4, 0.5])
+    assert LLMRouter.hedge_delay(provider) == 0.5
+
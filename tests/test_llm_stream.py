@@ -0,0 +1,75 @@
+# tests/test_llm_stream.py
+"""تست‌های استریم LLM: آمار تأخیر جدا از breaker و نگه داشتن اسلات هم‌زمانی"""
+
+import asyncio
+from types import SimpleNamespace
+
+import extractor
+from services.llm_router import LLMProvider, LLMRouter
+
+
+class _FakeStream:
+    def __init__(self, pieces):
+        self._chunks = [
+            SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=p))])
+            for p in pieces
+        ]
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if not self._chunks:
+            raise StopAsyncIteration
+        return self._chunks.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+
+def _router(name: str, pieces):
+    provider = LLMProvider(name, "http://llm.invalid/v1", "test", "test-model")
+    streams = []
+
+    async def create(**kwargs):
+        streams.append(_FakeStream(list(pieces)))
+        return streams[-1]
+
+    provider.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return LLMRouter([provider], hedge_enabled=False), provider, streams
+
+
+def test_stream_first_chunk_latency_does_not_feed_the_breaker():
+    router, provider, streams = _router("stream-ttft", ['{"area"', ": 85}"])
+
+    async def run():
+        stream = await router.stream(messages=[])
+        return [chunk async for chunk in stream]
+
+    chunks = asyncio.run(run())
+    assert len(chunks) == 2
+    assert streams[0].closed
+    assert provider.breaker._srtt is None
+    assert len(provider.first_chunk_latencies) == 1
+    assert provider.latencies == type(provider.latencies)()
+
+
+def test_stream_holds_the_llm_slot_until_consumed(monkeypatch):
+    router, _, streams = _router("stream-slot", ['{"area": 85, "floor"', ': 3}'])
+    monkeypatch.setattr(extractor, "llm_router", router)
+
+    async def run():
+        semaphore = asyncio.Semaphore(1)
+        monkeypatch.setattr(extractor, "_llm_semaphore", semaphore)
+        held = []
+        async for fields, _ in extractor.extract_json_stream("آپارتمان ۸۵ متری طبقه سوم بدون آسانسور"):
+            held.append((dict(fields), semaphore.locked()))
+        return held, semaphore.locked()
+
+    held, locked_after = asyncio.run(run())
+    assert held[0] == ({"area": 85}, True)
+    assert held[-1][0] == {"area": 85, "floor": 3}
+    assert not locked_after
+    assert streams[0].closed
@@ -0,0 +1,83 @@
+# tests/test_local_extractor.py
+"""تست‌های استخراج قاعده‌محور (bot_processor_core/local_extractor.py)"""
+
+import pytest
+
+from bot_processor_core.local_extractor import extract_local
+
+
+def test_phone_after_price_is_not_part_of_price():
+    fields, leftover = extract_local("آپارتمان ۱۲۰ متر طبقه ۳ دو خواب قیمت ۵ میلیارد ۰۹۱۲۱۲۳۴۵۶۷")
+    assert fields["price_total"] == 5_000_000_000
+    assert fields["owner_phone"] == "09121234567"
+    assert leftover == ""
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("قیمت ۵ میلیارد و ۲۰۰ میلیون تومان", 5_200_000_000),
+    ("قیمت چهار میلیارد و دویست میلیون", 4_200_000_000),
+    ("قیمت: 5,000,000,000", 5_000_000_000),
+])
+def test_compound_prices(text, expected):
+    fields, _ = extract_local(text)
+    assert fields["price_total"] == expected
+
+
+def test_bare_number_after_multiplier_is_not_appended():
+    fields, _ = extract_local("قیمت ۵ میلیارد ۲۰۰")
+    assert fields["price_total"] == 5_000_000_000
+
+
+def test_basement_is_not_land():
+    fields, leftover = extract_local("واحد با زیرزمین")
+    assert "property_type" not in fields
+    assert "زیرزمین" in leftover
+
+
+def test_seller_is_not_sale():
+    fields, _ = extract_local("فروشنده: رضایی، اجاره آپارتمان")
+    assert fields["transaction_type"] == "رهن و اجاره"
+
+
+def test_for_sale_suffix_still_matches():
+    fields, _ = extract_local("آپارتمان فروشی ۱۱۰ متر")
+    assert fields == {"property_type": "آپارتمان", "transaction_type": "فروش", "area": 110}
+
+
+@pytest.mark.parametrize("text", [
+    "فاصله تا دریا ۲۰۰ متر",
+    "از ساحل ۱۰۰ متر",
+])
+def test_distance_is_not_area(text):
+    fields, leftover = extract_local(text)
+    assert "area" not in fields
+    assert "متر" in leftover
+
+
+def test_area_next_to_property_type_overrides_distance_word():
+    fields, _ = extract_local("ویلا ۲۰۰ متر فاصله تا دریا ۵۰۰ متر")
+    assert fields["area"] == 200
+
+    fields, _ = extract_local("از آپارتمان ۱۲۰ متر")
+    assert fields["area"] == 120
+
+
+@pytest.mark.parametrize("text", [
+    "تراس ۱۲ متر",
+    "حیاط ۴۰ متری",
+    "بالکن حدود ۶ متر",
+    "انباری ۸ متر",
+    "خیابان ۱۲ متری",
+])
+def test_part_area_is_not_property_area(text):
+    fields, leftover = extract_local(text)
+    assert "area" not in fields
+    assert "متر" in leftover
+
+
+def test_property_area_next_to_part_area():
+    fields, _ = extract_local("آپارتمان ۱۲۰ متر با تراس ۱۲ متر")
+    assert fields["area"] == 120
+
+    fields, _ = extract_local("حیاط ۴۰ متری، ویلا ۲۰۰ متر")
+    assert fields["area"] == 200
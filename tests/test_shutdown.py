@@ -0,0 +1,62 @@
+# tests/test_shutdown.py
+"""تست‌های خاموش شدن: خالی کردن بافر پیام‌ها و ادامه مراحل با وجود خطا"""
+
+import asyncio
+from types import SimpleNamespace
+
+import bot
+from bot_processor_core.coalescer import MessageCoalescer
+
+
+class _ClosedMessage:
+    """پیام با bot بسته‌شده (مثل بعد از Application.shutdown)"""
+
+    async def reply_text(self, text, **kwargs):
+        raise RuntimeError("This HTTPXRequest is not initialized!")
+
+
+def test_flush_all_survives_failing_replies():
+    handled = []
+
+    async def handler(text, user_id, update):
+        handled.append(user_id)
+        raise ValueError("boom")
+
+    async def run():
+        coalescer = MessageCoalescer(handler, window_seconds=60)
+        for user_id in (1, 2, 3):
+            coalescer._buffers[user_id] = ["۱۲۰ متر"]
+            coalescer._updates[user_id] = SimpleNamespace(message=_ClosedMessage())
+        await coalescer.flush_all()
+        return coalescer
+
+    coalescer = asyncio.run(run())
+    assert handled == [1, 2, 3]
+    assert not coalescer._buffers
+
+
+def test_shutdown_runs_every_step_after_a_failure(monkeypatch):
+    calls = []
+
+    async def failing_pool_shutdown():
+        calls.append("stt pool")
+        raise RuntimeError("pool broken")
+
+    def record(name, result=None):
+        def step():
+            calls.append(name)
+            return result
+        return step
+
+    async def done():
+        return None
+
+    monkeypatch.setattr(bot, "stt_pool", SimpleNamespace(shutdown=failing_pool_shutdown))
+    monkeypatch.setattr(bot, "shutdown_preprocess_pool", record("preprocess pool"))
+    monkeypatch.setattr(bot, "shutdown_stt_backend", record("stt backend"))
+    monkeypatch.setattr(bot, "save_state_snapshot", lambda: calls.append("state snapshot") or done())
+    monkeypatch.setattr(bot, "close_state_store", lambda: calls.append("state store") or done())
+    monkeypatch.setattr(bot, "close_nocodb_client", lambda: calls.append("nocodb client") or done())
+
+    asyncio.run(bot.on_shutdown(None))
+    assert calls == ["stt pool", "preprocess pool", "stt backend", "state snapshot", "state store", "nocodb client"]
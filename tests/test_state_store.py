@@ -0,0 +1,83 @@
+# tests/test_state_store.py
+"""تست‌های store ماندگار state و مسیر خواندن async در conversation_state"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import conversation_state
+from services.state_store import RedisStateStore, SQLiteStateStore, dump_state
+
+
+def _round_trip(store):
+    expires_at = time.time() + 60
+    store.save_many([
+        (1, dump_state({"area": 120, "meta": {"pending_field": "floor"}}), expires_at),
+        (2, dump_state({"area": 80}), expires_at),
+        (3, dump_state({"area": 50}), time.time() - 1),  # منقضی: ذخیره نمی‌شود
+    ])
+
+    data, loaded_expires_at = store.load(1)
+    assert data == {"area": 120, "meta": {"pending_field": "floor"}}
+    assert loaded_expires_at == pytest.approx(expires_at, abs=1)
+    assert store.load(3) is None
+
+    store.delete_many([1])
+    assert store.load(1) is None
+    assert store.load(2)[0] == {"area": 80}
+    store.close()
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    _round_trip(SQLiteStateStore(str(tmp_path / "state.db")))
+
+
+def test_redis_store_round_trip():
+    fakeredis = pytest.importorskip("fakeredis")
+    _round_trip(RedisStateStore(client=fakeredis.FakeRedis()))
+
+
+class _RecordingStore:
+    name = "recording"
+
+    def __init__(self, record):
+        self.record = record
+        self.threads = []
+
+    def load(self, user_id):
+        self.threads.append(threading.current_thread())
+        return self.record
+
+
+@pytest.fixture
+def persistent_state(monkeypatch):
+    def install(store):
+        monkeypatch.setattr(conversation_state, "state_store", store)
+        monkeypatch.setattr(conversation_state, "_persistent", True)
+        return store
+    yield install
+    conversation_state.clear_state(42)
+    conversation_state._deleted.discard(42)
+    conversation_state._absent.delete("42")
+
+
+def test_load_state_reads_store_off_the_event_loop(persistent_state):
+    store = persistent_state(_RecordingStore(({"area": 95}, time.time() + 60)))
+
+    asyncio.run(conversation_state.load_state(42))
+
+    assert store.threads and store.threads[0] is not threading.main_thread()
+    assert conversation_state.get_state(42)["area"] == 95
+    assert len(store.threads) == 1  # بعد از load_state خواندن از کش داغ است
+
+
+def test_load_state_remembers_absent_users(persistent_state):
+    store = persistent_state(_RecordingStore(None))
+
+    asyncio.run(conversation_state.load_state(42))
+    asyncio.run(conversation_state.load_state(42))
+
+    assert len(store.threads) == 1
+    assert conversation_state.get_state(42) == {}
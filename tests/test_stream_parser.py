@@ -0,0 +1,37 @@
+# tests/test_stream_parser.py
+"""تست پارسر تدریجی JSON استریم استخراج"""
+
+import json
+
+import pytest
+
+from extractor import IncrementalJSONParser
+
+_PAYLOADS = [
+    '{"area": 85.5, "floor": -2, "price": 1.2e9, "total": 120, "has_parking": true, "city": "تهران", "note": null}',
+    '{ "area" : 85 , "rooms": 3 }',
+    '{"ratio": 1E+3, "neg": -0.25e-2, "zero": 0}',
+]
+
+
+@pytest.mark.parametrize("payload", _PAYLOADS)
+def test_one_char_per_chunk_matches_json_loads(payload):
+    parser = IncrementalJSONParser()
+    pairs = []
+    for char in payload:
+        pairs.extend(parser.feed(char))
+
+    assert parser.done
+    assert dict(pairs) == json.loads(payload)
+
+
+def test_number_split_at_decimal_point_waits_for_more_input():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"area": 85.') == []
+    assert parser.feed('5, "floor": 1') == [("area", 85.5)]
+    assert parser.feed("}") == [("floor", 1)]
+
+
+def test_malformed_object_still_raises():
+    with pytest.raises(ValueError):
+        IncrementalJSONParser().feed('{"area": "85" x')
@@ -0,0 +1,28 @@
+"""
+بررسی جدول‌های NocoDB برای ledger اعتبار (بعد از setup_transactions.py / setup_users.py)
+ستون‌های لازم وجود داشته باشند و ledger_key واقعاً یکتا باشد (یک درج تکراری آزمایشی که پاک می‌شود).
+کد خروج 1 = ربات نباید با LEDGER_BACKEND=nocodb اجرا شود.
+"""
+
+import asyncio
+import sys
+
+from services.nocodb.base import close_nocodb_client, init_nocodb_client
+from services.nocodb.ledger import LedgerMisconfigured, ledger
+
+
+async def main() -> int:
+    await init_nocodb_client()
+    try:
+        await ledger.verify()
+    except LedgerMisconfigured as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        await close_nocodb_client()
+    print(f"✅ Credit ledger ({ledger.name}) OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))